@@ -0,0 +1,366 @@
+
+"""
+Benchmarks of the data file, slack paging, training and testing code paths on synthetic data.
+
+Run with `python -m tests.benchmark -o results.json` from the repository root, and compare the results of two commits
+with `python -m tests.benchmark --compare old.json new.json`. Training and testing need spaCy, pass --skip-training to
+only benchmark the data file and slack paging.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import yuri
+from yuri import storage
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+# Training is much slower than everything else, so the largest size is left out by default
+DEFAULT_TRAIN_SIZES = (1000, 10000)
+DEFAULT_LABELS = 5
+DEFAULT_REPEAT = 3
+DEFAULT_EPOCHS = 3
+DEFAULT_CHANNELS = 2000
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_SEED = 1
+
+COMMON_WORDS = (
+    'the a is to on in for of and please can someone help with this that it we our after before when again now '
+    'anyone seeing error failing broken deploy build job host service request issue alert check look thanks'
+).split()
+# Share of the words of a text that are specific to its label
+LABEL_WORD_RATIO = 0.3
+LABEL_WORDS = 20
+
+
+def get_label_names(num_labels: int) -> List[str]:
+    return [f'label-{i}' for i in range(num_labels)]
+
+
+def generate_text(rng: random.Random, label: str) -> str:
+    """
+    Generates a text of common words mixed with words specific to the label, so that a model can learn the labels.
+    """
+    words = []
+    for _ in range(rng.randint(6, 24)):
+        if rng.random() < LABEL_WORD_RATIO:
+            words.append(f'{label.replace("-", "")}w{rng.randrange(LABEL_WORDS)}')
+        else:
+            words.append(rng.choice(COMMON_WORDS))
+    return ' '.join(words)
+
+
+def generate_messages(num_messages: int, num_labels: int = DEFAULT_LABELS,
+                      seed: int = DEFAULT_SEED) -> List[Tuple[dict, str]]:
+    """
+    Generates slack messages with increasing timestamps, with unevenly sized labels like real channels.
+    :return: List of (message, label) tuples from oldest to newest
+    """
+    rng = random.Random(seed)
+    labels = get_label_names(num_labels)
+    weights = [1 / (i + 1) for i in range(num_labels)]
+    messages = []
+    for i in range(num_messages):
+        label = rng.choices(labels, weights=weights)[0]
+        messages.append(({
+            'ts': f'{1500000000 + i}.{rng.randrange(1000000):06d}',
+            'user': f'U{rng.randrange(50)}',
+            'text': generate_text(rng, label),
+        }, label))
+    return messages
+
+
+def generate_data(num_entries: int, num_labels: int = DEFAULT_LABELS, seed: int = DEFAULT_SEED) -> Dict[str, dict]:
+    """
+    Generates classified data in the same format as the classify command, keyed by message ID.
+    """
+    return {
+        yuri.get_message_id(message): {'text': message['text'], 'label': label}
+        for message, label in generate_messages(num_entries, num_labels, seed)
+    }
+
+
+def write_data_file(data_file: str, data: Dict[str, dict]):
+    """
+    Writes the data as a compacted data file without a journal.
+    """
+    store = storage.DataStore(data_file)
+    store.load()
+    store.data = data
+    store.compact()
+
+
+def measure(func: Callable[[], Any], repeat: int = DEFAULT_REPEAT) -> Dict[str, float]:
+    """
+    Runs the function repeatedly with its output suppressed.
+    :return: The fastest and mean number of seconds of a run
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start_time)
+    return {'min_seconds': min(times), 'mean_seconds': sum(times) / len(times), 'runs': len(times)}
+
+
+def _rate(result: Dict[str, float], count: int, unit: str) -> Dict[str, float]:
+    result[f'{unit}_per_second'] = count / result['min_seconds'] if result['min_seconds'] else 0.0
+    return result
+
+
+def bench_data_file(size: int, num_labels: int, work_dir: str, repeat: int = DEFAULT_REPEAT) -> Dict[str, Any]:
+    """
+    Measures loading the data file, appending a batch of classifications to its journal and compacting it.
+    """
+    data_file = os.path.join(work_dir, f'data-{size}.json')
+    with contextlib.redirect_stdout(io.StringIO()):
+        write_data_file(data_file, generate_data(size, num_labels))
+    batch = generate_data(yuri.DEFAULT_BATCH_SIZE, num_labels, seed=DEFAULT_SEED + 1)
+    return {
+        'load_data': _rate(measure(lambda: yuri.load_data(data_file), repeat), size, 'entries'),
+        'write_data': _rate(
+            measure(lambda: yuri.write_data(batch, None, None, data_file), repeat), len(batch), 'entries'
+        ),
+        'compact': _rate(measure(lambda: storage.get_store(data_file).compact(), repeat), size, 'entries'),
+    }
+
+
+def bench_slack(size: int, work_dir: str, num_channels: int = DEFAULT_CHANNELS,
+                page_size: int = DEFAULT_PAGE_SIZE, repeat: int = DEFAULT_REPEAT) -> Dict[str, Any]:
+    """
+    Measures looking up a channel ID and paging through the history of a channel on a local fake slack server.
+    """
+    from tests.fake_slack import FakeSlackServer
+    from yuri import slack
+
+    channels = {f'C{i:06d}': f'channel-{i}' for i in range(num_channels)}
+    # The channel looked up is listed last, so every page of channels is retrieved
+    channel_id = f'C{num_channels - 1:06d}'
+    messages = {channel_id: [message for message, _ in generate_messages(size)]}
+    cache_file = os.path.join(work_dir, 'channels.json')
+    results = {}
+    with FakeSlackServer(channels=channels, messages=messages) as server:
+        session = slack.create_session(api_url=server.api_url)
+        token = 'xoxp-benchmark'
+        results['get_channel_id'] = _rate(measure(
+            lambda: slack.get_channel_id(token, channels[channel_id], session=session, cache_file=None), repeat
+        ), num_channels, 'channels')
+        slack.get_channel_id(token, channels[channel_id], session=session, cache_file=cache_file)
+        results['get_channel_id_cached'] = measure(
+            lambda: slack.get_channel_id(token, channels[channel_id], session=session, cache_file=cache_file), repeat
+        )
+
+        def page_history():
+            count = sum(len(page) for page in slack.get_history_pages(
+                token, channel_id, page_size=page_size, session=session
+            ))
+            if count != size:
+                raise Exception(f'Paged through {count} messages instead of {size}')
+
+        results['history_pages'] = _rate(measure(page_history, repeat), size, 'messages')
+        session.close()
+    return results
+
+
+def bench_training(size: int, num_labels: int, work_dir: str, epochs: int = DEFAULT_EPOCHS) -> Dict[str, Any]:
+    """
+    Trains a model on the generated data, timing every epoch and every evaluation of it.
+    :return: The results along with the directory of the trained model
+    """
+    from yuri import dataset, training
+
+    labeled_data = dataset.LabeledDataset.from_data(generate_data(size, num_labels))
+    train_ids, eval_ids = yuri.split_training_ids(labeled_data.ids, 20, seed=DEFAULT_SEED)
+    output_dir = os.path.join(work_dir, f'model-{size}')
+
+    # Every epoch ends with an evaluation, so the time between evaluations is the time of an epoch
+    evaluate = training._evaluate
+    evaluations: List[Tuple[float, float]] = []
+
+    def timed_evaluate(*args, **kwargs):
+        start_time = time.perf_counter()
+        scores = evaluate(*args, **kwargs)
+        evaluations.append((start_time, time.perf_counter()))
+        return scores
+
+    training._evaluate = timed_evaluate
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            scores = training.train_textcat_model(
+                lambda: (labeled_data.examples(train_ids), labeled_data.examples(eval_ids)),
+                n_iter=epochs, output_dir=output_dir, labels=labeled_data.get_labels(), seed=DEFAULT_SEED,
+            )
+            total = time.perf_counter() - start_time
+    finally:
+        training._evaluate = evaluate
+
+    epoch_ends = [end for _, end in evaluations]
+    epoch_seconds = [end - previous for previous, end in zip(epoch_ends, epoch_ends[1:])]
+    evaluate_seconds = [end - start for start, end in evaluations]
+    return {
+        'train': {
+            'total_seconds': total,
+            'epochs': len(evaluations),
+            # The first epoch also includes tokenizing, so only the following ones are compared
+            'epoch_seconds': epoch_seconds,
+            'mean_epoch_seconds': sum(epoch_seconds) / len(epoch_seconds) if epoch_seconds else None,
+            'examples_per_second': len(train_ids) * len(epoch_seconds) / sum(epoch_seconds) if epoch_seconds else None,
+            'textcat_f': scores['textcat_f'],
+        },
+        '_evaluate': _rate({
+            'min_seconds': min(evaluate_seconds),
+            'mean_seconds': sum(evaluate_seconds) / len(evaluate_seconds),
+            'runs': len(evaluate_seconds),
+        }, len(eval_ids), 'texts'),
+    }, output_dir
+
+
+def bench_test_file(size: int, num_labels: int, model_dir: str, work_dir: str,
+                    repeat: int = DEFAULT_REPEAT) -> Dict[str, Any]:
+    """
+    Measures testing a tab-separated file with a trained model like `yuri test -f`.
+    """
+    from yuri import training
+
+    test_file = os.path.join(work_dir, f'test-{size}.tsv')
+    with open(test_file, 'w') as fobj:
+        for entry in generate_data(size, num_labels, seed=DEFAULT_SEED + 2).values():
+            fobj.write(f'{entry["text"]}\t{entry["label"]}\n')
+    # The model is loaded once by the first test, like the test command does
+    with contextlib.redirect_stdout(io.StringIO()):
+        training.load_model(model_dir)
+    return {
+        'test_file': _rate(measure(
+            lambda: training.test_textcat_model_batch(model_dir, yuri.read_test_file(test_file)), repeat
+        ), size, 'lines'),
+    }
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+            universal_newlines=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes: Iterable[int] = DEFAULT_SIZES, train_sizes: Iterable[int] = DEFAULT_TRAIN_SIZES,
+                   num_labels: int = DEFAULT_LABELS, epochs: int = DEFAULT_EPOCHS, repeat: int = DEFAULT_REPEAT,
+                   skip_training: bool = False, work_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Runs every benchmark for every size.
+    :param train_sizes: The sizes to train and test models with
+    :param work_dir: If set, the directory to generate data and train models in, otherwise a temporary directory
+    :return: The results keyed by size, then by benchmark, along with the commit and versions they were measured with
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = work_dir or tmp_dir
+        for size in sizes:
+            print(f'Benchmarking the data file and slack paging with {size} entries', file=sys.stderr)
+            size_results = results.setdefault(str(size), {})
+            size_results.update(bench_data_file(size, num_labels, work_dir, repeat))
+            size_results.update(bench_slack(size, work_dir, repeat=repeat))
+        if not skip_training:
+            for size in train_sizes:
+                print(f'Benchmarking training and testing with {size} entries', file=sys.stderr)
+                size_results = results.setdefault(str(size), {})
+                train_results, model_dir = bench_training(size, num_labels, work_dir, epochs)
+                size_results.update(train_results)
+                size_results.update(bench_test_file(size, num_labels, model_dir, work_dir, repeat))
+
+    versions = {'python': platform.python_version()}
+    if not skip_training:
+        import spacy
+        versions['spacy'] = spacy.__version__
+    return {
+        'commit': get_commit(),
+        'time': time.time(),
+        'versions': versions,
+        'labels': num_labels,
+        'results': results,
+    }
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> List[Tuple[str, str, float, float]]:
+    """
+    Compares the fastest times of the benchmarks in both results.
+    :return: List of (size, benchmark, previous seconds, current seconds) tuples of benchmarks in both
+    """
+    rows = []
+    for size, benchmarks in current['results'].items():
+        for name, result in benchmarks.items():
+            previous_result = previous['results'].get(size, {}).get(name)
+            seconds_key = 'min_seconds' if 'min_seconds' in result else 'mean_epoch_seconds'
+            if previous_result and previous_result.get(seconds_key) and result.get(seconds_key):
+                rows.append((size, name, previous_result[seconds_key], result[seconds_key]))
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark yuri on synthetic data')
+    parser.add_argument(
+        "-s", "--sizes",
+        default=','.join(str(size) for size in DEFAULT_SIZES),
+        help="Comma-separated numbers of entries to benchmark the data file and slack paging with",
+    )
+    parser.add_argument(
+        "-t", "--train-sizes",
+        default=','.join(str(size) for size in DEFAULT_TRAIN_SIZES),
+        help="Comma-separated numbers of entries to benchmark training and testing with",
+    )
+    parser.add_argument("-l", "--labels", type=int, default=DEFAULT_LABELS, help="The number of labels")
+    parser.add_argument("-n", "--epochs", type=int, default=DEFAULT_EPOCHS, help="The number of epochs to train")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT, help="The number of runs to time")
+    parser.add_argument("--skip-training", action="store_true", help="If set, does not train or test models")
+    parser.add_argument("-w", "--work-dir", help="If set, keeps the generated data and models in this directory")
+    parser.add_argument("-o", "--output", help="If set, writes the results to this JSON file instead of stdout")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("PREVIOUS", "CURRENT"),
+        help="Instead of benchmarking, compares two JSON results files",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], 'r') as fobj:
+            previous = json.loads(fobj.read())
+        with open(args.compare[1], 'r') as fobj:
+            current = json.loads(fobj.read())
+        print(f'Comparing {previous.get("commit")} to {current.get("commit")}')
+        for size, name, previous_seconds, current_seconds in compare(previous, current):
+            print(f'{size:>8}  {name:<24}{previous_seconds:10.4f}s {current_seconds:10.4f}s '
+                  f'{(current_seconds / previous_seconds - 1):+8.1%}')
+        return
+
+    results = run_benchmarks(
+        sizes=[int(size) for size in args.sizes.split(',') if size],
+        train_sizes=[int(size) for size in args.train_sizes.split(',') if size],
+        num_labels=args.labels, epochs=args.epochs, repeat=args.repeat, skip_training=args.skip_training,
+        work_dir=args.work_dir,
+    )
+    content = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fobj:
+            fobj.write(content)
+        print(f'Wrote the results to {args.output}', file=sys.stderr)
+    else:
+        print(content)
+
+
+if __name__ == '__main__':
+    main()
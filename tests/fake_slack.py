@@ -0,0 +1,162 @@
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeSlackServer(object):
+    """
+    Local stand-in for the slack web API methods used by yuri, serving channels and messages kept in memory. Pass
+    api_url to yuri.create_session (or set it as the SLACK_API_URL env var) to send requests to it.
+
+    Every rate_limit_every requests (if set) is answered with HTTP 429 and a Retry-After of 0 seconds.
+
+    Thread replies are messages with a thread_ts other than their own ts. Like slack, they are only listed in the
+    history of the channel if they were also sent to the channel (with the thread_broadcast subtype).
+    """
+
+    def __init__(self, channels: Optional[Dict[str, str]] = None, messages: Optional[Dict[str, List[dict]]] = None,
+                 rate_limit_every: Optional[int] = None):
+        # Channel IDs to names
+        self.channels = channels or {}
+        # Channel IDs to messages in any order
+        self.messages = messages or {}
+        self.rate_limit_every = rate_limit_every
+        self.requests: List[str] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._thread = None
+
+    @property
+    def api_url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_port}/api/'
+
+    def start(self) -> 'FakeSlackServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeSlackServer':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add_message(self, channel_id: str, message: dict):
+        with self._lock:
+            self.messages.setdefault(channel_id, []).append(message)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle(parse_qs(urlparse(self.path).query))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self._handle(parse_qs(self.rfile.read(length).decode('utf-8')))
+
+            def _handle(self, query: Dict[str, List[str]]):
+                method = urlparse(self.path).path.rsplit('/', 1)[-1]
+                params = {key: values[0] for key, values in query.items()}
+                with fake._lock:
+                    fake.requests.append(method)
+                    rate_limited = fake.rate_limit_every and len(fake.requests) % fake.rate_limit_every == 0
+                    if not rate_limited:
+                        body = fake.handle(method, params)
+                if rate_limited:
+                    self.send_response(429)
+                    self.send_header('Retry-After', '0')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                content = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def handle(self, method: str, params: Dict[str, str]) -> dict:
+        handler = getattr(self, f'_{method.replace(".", "_")}', None)
+        if not handler:
+            return {'ok': False, 'error': 'unknown_method'}
+        return handler(params)
+
+    @staticmethod
+    def _page(items: list, params: Dict[str, str], default_limit: int) -> dict:
+        offset = int(params.get('cursor') or 0)
+        limit = int(params.get('limit') or default_limit)
+        has_more = offset + limit < len(items)
+        return {
+            'items': items[offset:offset + limit],
+            'has_more': has_more,
+            'response_metadata': {'next_cursor': str(offset + limit) if has_more else ''},
+        }
+
+    def _conversations_list(self, params: Dict[str, str]) -> dict:
+        channels = [{'id': channel_id, 'name': name} for channel_id, name in self.channels.items()]
+        page = self._page(channels, params, 100)
+        return {'ok': True, 'channels': page['items'], 'response_metadata': page['response_metadata']}
+
+    def _conversations_info(self, params: Dict[str, str]) -> dict:
+        channel_id = params.get('channel')
+        if channel_id not in self.channels:
+            return {'ok': False, 'error': 'channel_not_found'}
+        return {'ok': True, 'channel': {'id': channel_id, 'name': self.channels[channel_id]}}
+
+    def _conversations_history(self, params: Dict[str, str]) -> dict:
+        channel_id = params.get('channel')
+        if channel_id not in self.channels:
+            return {'ok': False, 'error': 'channel_not_found'}
+        oldest = params.get('oldest')
+        latest = params.get('latest')
+        inclusive = params.get('inclusive') in ('1', 'true', 'True')
+        messages = [
+            message for message in self.messages.get(channel_id, [])
+            if (not oldest or message['ts'] > oldest or (inclusive and message['ts'] == oldest)) and
+               (not latest or message['ts'] < latest or (inclusive and message['ts'] == latest)) and
+               (not self._is_reply(message) or message.get('subtype') == 'thread_broadcast')
+        ]
+        # Slack returns the newest messages first
+        messages.sort(key=lambda message: message['ts'], reverse=True)
+        page = self._page(messages, params, 100)
+        return {
+            'ok': True, 'messages': page['items'], 'has_more': page['has_more'],
+            'response_metadata': page['response_metadata'],
+        }
+
+    @staticmethod
+    def _is_reply(message: dict) -> bool:
+        return message.get('thread_ts', message['ts']) != message['ts']
+
+    def _conversations_replies(self, params: Dict[str, str]) -> dict:
+        channel_id = params.get('channel')
+        if channel_id not in self.channels:
+            return {'ok': False, 'error': 'channel_not_found'}
+        thread_ts = params.get('ts')
+        # The message starting the thread comes first, followed by the replies from oldest to newest
+        messages = sorted(
+            (message for message in self.messages.get(channel_id, [])
+             if message['ts'] == thread_ts or message.get('thread_ts') == thread_ts),
+            key=lambda message: message['ts']
+        )
+        if not messages or messages[0]['ts'] != thread_ts:
+            return {'ok': False, 'error': 'thread_not_found'}
+        page = self._page(messages, params, 100)
+        return {
+            'ok': True, 'messages': page['items'], 'has_more': page['has_more'],
+            'response_metadata': page['response_metadata'],
+        }
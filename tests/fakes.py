@@ -0,0 +1,40 @@
+from typing import Any, Iterable
+
+
+class FakeDoc(object):
+    """
+    Stand-in for a scored spaCy doc of two labels, the score of label a is the last word of the text.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        score = float(text.split()[-1])
+        self.cats = {'a': score, 'b': 1 - score}
+
+    def __len__(self) -> int:
+        return len(self.text.split())
+
+
+class FakeModel(object):
+    """
+    Stand-in for a spaCy pipeline scoring texts into FakeDocs, it is its own text classifier.
+    """
+    labels = ('a', 'b')
+
+    def get_pipe(self, name: str) -> 'FakeModel':
+        return self
+
+    def pipe(self, texts: Iterable[Any], as_tuples: bool = False, batch_size: int = None, n_process: int = 1):
+        for item in texts:
+            if as_tuples:
+                text, context = item
+                yield FakeDoc(text), context
+            else:
+                yield FakeDoc(item)
+
+
+def channel_message(i: int, **kwargs) -> dict:
+    """
+    Builds the i-th message of a channel, one second after the previous one.
+    """
+    return dict({'ts': f'{1500000000 + i}.000100', 'user': 'U1', 'text': f'message {i}'}, **kwargs)
@@ -0,0 +1,30 @@
+import yuri
+from tests.fakes import FakeModel
+
+
+def _message(ts: str, score: float, **kwargs) -> dict:
+    return dict(ts=ts, user='U1', text=f'message {score}', **kwargs)
+
+
+def test_predict_labels():
+    messages = [_message('1', 0.9), _message('2', 0.3), _message('3', 0.5, attachments=[{}])]
+    predictions = yuri.predict_labels(FakeModel(), messages)
+    assert predictions == {'1-U1': ('a', 0.9), '2-U1': ('b', 0.7)}
+
+    ordered = yuri.order_by_confidence(messages, predictions)
+    assert [message['ts'] for message in ordered] == ['2', '1', '3']
+
+
+def test_classify_batch_auto_accept(monkeypatch):
+    import inquirer
+    prompted = []
+    monkeypatch.setattr(inquirer, 'confirm', lambda *args, **kwargs: True)
+    monkeypatch.setattr(yuri, 'get_label', lambda labels, default=None: prompted.append(default) or 'b')
+
+    messages = [_message('1', 0.95), _message('2', 0.6)]
+    predictions = yuri.predict_labels(FakeModel(), messages)
+    added, updated = yuri.classify_batch(messages, {}, {'a', 'b'}, predictions=predictions, auto_accept=0.9)
+    assert added == {'1-U1': {'text': 'message 0.95', 'label': 'a'}, '2-U1': {'text': 'message 0.6', 'label': 'b'}}
+    assert not updated
+    # Only the prediction below the threshold is prompted for, with the predicted label selected
+    assert prompted == ['a']
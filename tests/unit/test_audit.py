@@ -0,0 +1,53 @@
+import json
+import yuri
+from tests.fakes import FakeModel
+from yuri import audit
+
+
+def _data() -> dict:
+    return {
+        '1': {'text': 'message 0.95', 'label': 'b'},
+        '2': {'text': 'message 0.6', 'label': 'b'},
+        '3': {'text': 'message 0.9', 'label': 'a'},
+        '4': {'text': 'message 0.1', 'label': 'a'},
+        '5': {'text': 'message 0.99', 'label': 'other'},
+    }
+
+
+def test_audit_scores():
+    data = _data()
+    report = audit.audit_scores(audit.score_entries(FakeModel(), data, chunk_size=2), confidence=0.8)
+    assert (report['entries'], report['unscored'], report['disagreements'], report['flagged']) == (4, 1, 3, 2)
+    assert report['labels']['a'] == {
+        'entries': 2, 'disagreements': 1, 'flagged': 1, 'disagreement_rate': 0.5, 'flagged_rate': 0.5,
+    }
+    assert report['labels']['b']['disagreements'] == 2
+    # Sorted by descending margin
+    assert [(entry['id'], entry['predicted']) for entry in report['flagged_entries']] == [('1', 'a'), ('4', 'b')]
+    assert abs(report['flagged_entries'][0]['margin'] - 0.9) < 1e-6
+
+    report = audit.audit_scores(audit.score_entries(FakeModel(), data), confidence=0.8, max_flagged=1)
+    assert report['flagged'] == 2
+    assert [entry['id'] for entry in report['flagged_entries']] == ['1']
+
+
+def test_review_flagged(monkeypatch, tmp_path):
+    import inquirer
+    data_file = str(tmp_path / 'data.json')
+    data = _data()
+    yuri.write_data(data, None, None, data_file)
+    monkeypatch.setattr(inquirer, 'confirm', lambda *args, **kwargs: True)
+    prompted = []
+    monkeypatch.setattr(yuri, 'get_label', lambda labels, default=None: prompted.append(default) or default)
+
+    report = audit.audit_scores(audit.score_entries(FakeModel(), data), confidence=0.8)
+    audit.write_report(report, str(tmp_path / 'report.json'))
+    with open(str(tmp_path / 'report.json'), 'r') as fobj:
+        assert json.loads(fobj.read()) == report
+
+    yuri.review_flagged(report['flagged_entries'], data, data_file, None, None, batch_size=1)
+    assert prompted == ['a', 'b']
+    stored, _, _ = yuri.load_data(data_file)
+    assert stored['1']['label'] == 'a'
+    assert stored['4']['label'] == 'b'
+    assert stored['2']['label'] == 'b'
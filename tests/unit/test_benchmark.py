@@ -0,0 +1,23 @@
+import json
+from tests import benchmark
+
+
+def test_generate_data():
+    data = benchmark.generate_data(200, num_labels=3)
+    assert len(data) == 200
+    assert {entry['label'] for entry in data.values()} == set(benchmark.get_label_names(3))
+    assert benchmark.generate_data(200, num_labels=3) == data
+
+
+def test_run_benchmarks(tmp_path, capsys):
+    output_file = str(tmp_path / 'results.json')
+    benchmark.main(['-s', '50', '-r', '1', '--skip-training', '-w', str(tmp_path), '-o', output_file])
+    with open(output_file, 'r') as fobj:
+        results = json.loads(fobj.read())
+    assert set(results['results']['50']) == {
+        'load_data', 'write_data', 'compact', 'get_channel_id', 'get_channel_id_cached', 'history_pages'
+    }
+    assert results['results']['50']['load_data']['entries_per_second'] > 0
+
+    benchmark.main(['--compare', output_file, output_file])
+    assert 'history_pages' in capsys.readouterr().out
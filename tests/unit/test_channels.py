@@ -0,0 +1,63 @@
+import argparse
+import inquirer
+import yuri
+from tests.fakes import channel_message
+from yuri.mirror import MessageMirror
+from yuri.storage import DataStore
+
+
+def test_channel_timestamps(tmp_path):
+    data_file = str(tmp_path / 'data.json')
+    store = DataStore(data_file, compact_threshold=3)
+    store.append({'1-U1': {'text': 'one', 'label': 'a', 'channel': 'C1'}}, '1', '2', channel_id='C1',
+                 channel_name='oncall')
+    store.append({}, '3', '4', channel_id='C2', channel_name='alerts')
+    # The name of a channel given by ID is kept
+    store.append({}, '0', '2', channel_id='C1')
+    assert DataStore(data_file).load() == ({'1-U1': {'text': 'one', 'label': 'a', 'channel': 'C1'}}, None, None)
+
+    reloaded = DataStore(data_file)
+    reloaded.load()
+    assert reloaded.channels == {
+        'C1': {'name': 'oncall', 'start_timestamp': '0', 'end_timestamp': '2'},
+        'C2': {'name': 'alerts', 'start_timestamp': '3', 'end_timestamp': '4'},
+    }
+
+
+def test_legacy_channel_cursor(tmp_path):
+    data_file = str(tmp_path / 'data.json')
+    yuri.write_data({}, '1', '2', data_file)
+    assert yuri.get_channel_cursors(data_file, ['C1']) == {'C1': ('1', '2')}
+    assert yuri.get_channel_cursors(data_file, ['C1', 'C2']) == {'C1': (None, None), 'C2': (None, None)}
+
+
+def test_classify_channels(tmp_path, monkeypatch):
+    monkeypatch.setattr(inquirer, 'confirm', lambda *args, **kwargs: True)
+    monkeypatch.setattr(yuri, 'get_label', lambda labels, default=None: 'a')
+    data_file = str(tmp_path / 'data.json')
+    with MessageMirror(str(tmp_path / 'mirror.sqlite3')) as message_mirror:
+        message_mirror.add_channel('C1', 'oncall')
+        message_mirror.add_channel('C2', 'alerts')
+        message_mirror.add_messages('C1', [channel_message(i) for i in range(4)])
+        message_mirror.add_messages('C2', [channel_message(i) for i in range(10, 12)])
+
+        args = argparse.Namespace(slack_channels=['#oncall', 'alerts'], channel_is_id=False)
+        channel_names = yuri.get_classify_channels(args, message_mirror)
+        assert channel_names == {'C1': 'oncall', 'C2': 'alerts'}
+        data = {}
+        cursors = yuri.classify_messages(
+            None, {'C1': (None, None), 'C2': (None, None)}, data, yuri.DIRECTION_OLDER, None, batch_size=3,
+            data_file=data_file, message_source=message_mirror, channel_names=channel_names,
+        )
+
+    assert cursors == {'C1': (channel_message(0)['ts'], None), 'C2': (channel_message(10)['ts'], None)}
+    assert {key: entry['channel'] for key, entry in data.items()} == {
+        **{yuri.get_message_id(channel_message(i)): 'C1' for i in range(4)},
+        **{yuri.get_message_id(channel_message(i)): 'C2' for i in range(10, 12)},
+    }
+    assert yuri.get_channel_cursors(data_file, ['C2']) == {'C2': (channel_message(10)['ts'], None)}
+
+    # Training data may be limited to channels by name or ID and weighted by channel
+    data, labeled_data = yuri.get_training_data(data_file, ['#alerts'])
+    assert len(data) == len(labeled_data) == 2
+    assert yuri.get_channel_weights(data_file, ['oncall=3', 'C2=1']) == {'C1': 3, 'C2': 1}
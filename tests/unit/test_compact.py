@@ -0,0 +1,139 @@
+import os
+import numpy
+import pytest
+from yuri import compact
+
+
+class FakeMemory(object):
+    """
+    The weights of a thinc layer in the first row and its gradients in the second row.
+    """
+
+    def __init__(self, layer_id, params):
+        size = sum(value.size for value in params.values())
+        self.ops = None
+        self._mem = numpy.zeros((2, size), dtype=numpy.float32)
+        self._offsets = {}
+        offset = 0
+        for name, value in params.items():
+            self._offsets[(layer_id, name)] = (offset, 0, value.shape)
+            self._offsets[(layer_id, f'd_{name}')] = (offset, 1, value.shape)
+            self._mem[0, offset:offset + value.size] = value.ravel()
+            offset += value.size
+
+    def get(self, name):
+        offset, row, shape = self._offsets[name]
+        return self._mem[row, offset:offset + int(numpy.prod(shape))].reshape(shape)
+
+
+class FakeLayer(object):
+
+    def __init__(self, layer_id, params, layers=()):
+        self.id = layer_id
+        self._dims = {'nO': 2}
+        self._mem = FakeMemory(layer_id, params)
+        self._layers = list(layers)
+
+
+class FakeTokenizer(object):
+
+    def to_bytes(self, exclude=()):
+        return b'tokenizer'
+
+
+class FakeTextcat(object):
+
+    def __init__(self, model):
+        self.model = model
+        self.cfg = {'exclusive_classes': True, 'architecture': 'simple_cnn'}
+        self.labels = ('a', 'b')
+
+
+class FakeNlp(object):
+
+    def __init__(self, model):
+        self.lang = 'en'
+        self.meta = {'name': 'test'}
+        self.tokenizer = FakeTokenizer()
+        self._textcat = FakeTextcat(model)
+
+    def get_pipe(self, name):
+        return self._textcat
+
+
+def _build_model():
+    random_state = numpy.random.RandomState(0)
+    inner = FakeLayer(2, {'W': random_state.rand(3, 2).astype(numpy.float32), 'b': numpy.ones(2, numpy.float32)})
+    return FakeLayer(1, {'E': random_state.rand(5).astype(numpy.float32)}, layers=[inner])
+
+
+@pytest.mark.parametrize('precision', [compact.PRECISION_FLOAT16, compact.PRECISION_FLOAT32])
+def test_write_and_map(tmp_path, precision):
+    model_file = str(tmp_path / f'model{compact.FILE_SUFFIX}')
+    model = _build_model()
+    size = compact.write_compact_model(FakeNlp(model), model_file, precision)
+    assert compact.is_compact_model(model_file)
+    assert not compact.is_compact_model(str(tmp_path))
+
+    header, data = compact._read_header(model_file)
+    assert size == os.path.getsize(model_file)
+    assert header['labels'] == ['a', 'b']
+    assert header['precision'] == precision
+    assert data[:len(b'tokenizer')].tobytes() == b'tokenizer'
+    # Gradients are not exported
+    assert [[param[0] for param in layer['params']] for layer in header['layers']] == [['E'], ['W', 'b']]
+    assert all(layer['offset'] % compact.ALIGNMENT == 0 for layer in header['layers'])
+
+    loaded = _build_model()
+    compact._map_weights(compact._get_layers(loaded), header, data)
+    for layer, original in zip(compact._get_layers(loaded), compact._get_layers(model)):
+        for key, (_, row, _) in original._mem._offsets.items():
+            if row == 0:
+                assert key in layer._mem
+                numpy.testing.assert_allclose(layer._mem[key], original._mem.get(key), atol=1e-3)
+    # float32 weights are used from the mapping as they are, float16 weights are converted to a copy
+    assert numpy.shares_memory(loaded._mem.weights, data) == (precision == compact.PRECISION_FLOAT32)
+    assert loaded._mem.weights.flags.writeable
+    with pytest.raises(Exception):
+        loaded._mem.add_gradient((1, 'd_E'), (1, 'E'))
+
+
+def test_read_invalid_file(tmp_path):
+    model_file = tmp_path / 'model'
+    model_file.write_bytes(b'not a model')
+    assert not compact.is_compact_model(str(model_file))
+    with pytest.raises(Exception):
+        compact._read_header(str(model_file))
+
+
+@pytest.fixture(scope='module')
+def trained_model_dir(tmp_path_factory):
+    pytest.importorskip('spacy')
+    pytest.importorskip('thinc')
+    from yuri import training
+    examples = [
+        (f'disk full on host-{i}', {'cats': {'disk': True, 'deploy': False}}) for i in range(10)
+    ] + [
+        (f'deploy {i} of the api finished', {'cats': {'disk': False, 'deploy': True}}) for i in range(10)
+    ]
+    model_dir = str(tmp_path_factory.mktemp('compact') / 'model')
+    training.train_textcat_model(
+        lambda: (examples, examples), n_iter=2, output_dir=model_dir, labels=['disk', 'deploy'], seed=1
+    )
+    return model_dir
+
+
+@pytest.mark.parametrize('precision,tolerance', [(compact.PRECISION_FLOAT16, 1e-2), (compact.PRECISION_FLOAT32, 1e-6)])
+def test_round_trip(trained_model_dir, tmp_path, precision, tolerance):
+    import spacy
+    nlp = spacy.load(trained_model_dir)
+    model_file = str(tmp_path / f'model{compact.FILE_SUFFIX}')
+    compact.write_compact_model(nlp, model_file, precision)
+    compact_nlp = compact.load_compact_model(model_file)
+
+    texts = ['disk full on host-42', 'deploy 7 of the api finished', 'something else entirely']
+    for doc, compact_doc in zip(nlp.pipe(texts), compact_nlp.pipe(texts)):
+        assert [token.text for token in compact_doc] == [token.text for token in doc]
+        assert sorted(compact_doc.cats) == sorted(doc.cats)
+        for label, score in doc.cats.items():
+            assert abs(compact_doc.cats[label] - score) <= tolerance
@@ -0,0 +1,60 @@
+
+import os
+import pytest
+from yuri import crossvalidation, training
+from yuri.crossvalidation import stratified_folds
+
+
+def _example(i: int, label: str) -> tuple:
+    return f'text {i}', {'cats': {'a': label == 'a', 'b': label == 'b'}}
+
+
+def test_stratified_folds():
+    examples = [_example(i, 'a') for i in range(9)] + [_example(i, 'b') for i in range(9, 12)]
+    folds = stratified_folds(examples, 3, seed=1)
+    assert sorted(len(fold) for fold in folds) == [4, 4, 4]
+    for fold in folds:
+        assert sum(1 for example in fold if example[1]['cats']['b']) == 1
+    assert sorted(example[0] for fold in folds for example in fold) == sorted(example[0] for example in examples)
+    # The same seed always splits the same way
+    assert stratified_folds(examples, 3, seed=1) == folds
+
+
+def test_train_fold_holds_out_validation(monkeypatch, tmp_path):
+    trained = {}
+
+    def train_textcat_model(load_data_func, **kwargs):
+        trained['train'], trained['validation'] = load_data_func()
+        trained['kwargs'] = kwargs
+
+    monkeypatch.setattr(training, 'train_textcat_model', train_textcat_model)
+    monkeypatch.setattr(crossvalidation, '_evaluate_model', lambda model_dir, examples: {'evaluated': list(examples)})
+    train_data = [_example(i, 'a') for i in range(15)] + [_example(i, 'b') for i in range(15, 20)]
+    eval_data = [_example(20, 'a'), _example(21, 'b')]
+    scores = crossvalidation._train_fold(0, train_data, eval_data, ['a', 'b'], str(tmp_path / 'fold-0'), 'docs.docbin', {})
+
+    # The best epoch is picked on a part of the training folds, the held out fold is only evaluated at the end
+    assert scores == {'evaluated': eval_data}
+    # The docs tokenized by the parent are used, the shared doc cache is not touched
+    assert trained['kwargs']['doc_file'] == 'docs.docbin' and 'doc_cache_dir' not in trained['kwargs']
+    assert trained['validation']
+    assert sorted(trained['train'] + trained['validation']) == sorted(train_data)
+    assert not set(example[0] for example in eval_data).intersection(
+        example[0] for example in trained['train'] + trained['validation']
+    )
+
+
+def test_run_cross_validation_doc_cache(tmp_path, capsys):
+    pytest.importorskip('spacy')
+    examples = [_example(i, 'a') for i in range(6)] + [_example(i, 'b') for i in range(6, 12)]
+    cache_dir = str(tmp_path / 'doc_cache')
+    summary = crossvalidation.run_cross_validation(
+        examples, ['a', 'b'], 2, doc_cache_dir=cache_dir, seed=1, workers=2, n_iter=1
+    )
+    assert summary['folds'] == 2
+    # Only the cache of all texts is kept, so that training on the same data reuses it
+    assert len(os.listdir(cache_dir)) == 1
+    capsys.readouterr()
+    import spacy
+    training.tokenize_texts(spacy.blank('en'), [example[0] for example in examples], cache_dir=cache_dir)
+    assert 'Loaded 12 tokenized texts' in capsys.readouterr().out
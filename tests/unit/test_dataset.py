@@ -0,0 +1,35 @@
+
+import pickle
+from yuri.crossvalidation import stratified_folds
+from yuri.dataset import LabeledDataset, get_example_labels, get_texts
+
+
+def test_labeled_dataset():
+    labeled_data = LabeledDataset.from_data({
+        '1-U1': {'text': 'one', 'label': 'a'},
+        '2-U1': {'text': 'two', 'label': 'b'},
+        '3-U1': {'text': 'three', 'label': 'a'},
+    })
+    assert labeled_data.label_counts() == {'a': 2, 'b': 1}
+
+    # Relabeling an entry moves its count to the new label
+    labeled_data.add('2-U1', 'two!', 'a')
+    assert labeled_data.label_counts() == {'a': 3}
+    assert labeled_data.get_labels() == ['a']
+    assert len(labeled_data) == 3
+
+    examples = labeled_data.examples(['2-U1', '1-U1'])
+    assert list(examples) == [('two!', {'cats': {'a': True, 'b': False}}), ('one', {'cats': {'a': True, 'b': False}})]
+    assert get_texts(examples) == ['two!', 'one']
+    assert get_example_labels(examples) == ['a', 'a']
+    assert list(pickle.loads(pickle.dumps(examples))) == list(examples)
+
+
+def test_stratified_labeled_folds():
+    labeled_data = LabeledDataset.from_data(
+        {str(i): {'text': f'text {i}', 'label': 'b' if i % 4 == 0 else 'a'} for i in range(12)}
+    )
+    folds = stratified_folds(labeled_data.examples(), 3, seed=1)
+    for fold in folds:
+        assert get_example_labels(fold).count('b') == 1
+    assert sorted(text for fold in folds for text in get_texts(fold)) == sorted(labeled_data.texts)
@@ -0,0 +1,62 @@
+
+import yuri
+from yuri import duplicates
+from yuri.duplicates import DuplicateIndex
+
+
+def _entry(text: str, label: str = 'alert') -> dict:
+    return {'text': text, 'label': label}
+
+
+DATA = {
+    '1-U1': _entry('Disk usage on host web-12 is at 91% <https://grafana.example.com/d/123|dashboard>'),
+    '2-U1': _entry('Disk usage on host web-31 is at 97% <https://grafana.example.com/d/456|dashboard>'),
+    '3-U1': _entry('How do I request access to the staging cluster?', 'question'),
+    '4-U1': _entry('Disk usage on host web-12 is at 91% <https://grafana.example.com/d/123|dashboard>', 'question'),
+}
+
+
+def test_find_near_duplicates(tmp_path):
+    index_file = str(tmp_path / 'data.json.duplicates')
+    duplicate_index = DuplicateIndex(index_file)
+    assert duplicate_index.sync(DATA) == 4
+    duplicate_index.save()
+
+    # Loaded from the file, nothing is hashed again
+    duplicate_index = DuplicateIndex(index_file)
+    assert duplicate_index.sync(DATA) == 0
+    assert duplicate_index.find('Disk usage on host web-7 is at 99% <https://grafana.example.com/d/9|dashboard>')[0] \
+        in ('1-U1', '2-U1', '4-U1')
+    assert duplicate_index.find('how do i request access to the STAGING cluster') == ('3-U1', 1.0)
+    match = duplicate_index.find('How do I request access to the staging cluster? Thanks!')
+    assert match[0] == '3-U1' and 0.8 <= match[1] < 1.0
+    assert duplicate_index.find('Is the build broken again today?') is None
+
+    data = dict(DATA)
+    del data['4-U1']
+    duplicate_index.sync(data)
+    assert '4-U1' not in duplicate_index
+
+
+def test_collapse():
+    duplicate_index = DuplicateIndex()
+    duplicate_index.sync(DATA)
+    clusters = duplicate_index.clusters(DATA)
+    assert clusters == [['1-U1', '2-U1', '4-U1'], ['3-U1']]
+
+    kept, weights, members = duplicates.collapse(clusters, DATA, weighting=duplicates.WEIGHTING_LOG)
+    # Conflicting labels in a cluster are both kept
+    assert sorted(kept) == ['1-U1', '3-U1', '4-U1']
+    assert weights == {'1-U1': 2, '3-U1': 1, '4-U1': 1}
+    assert members['1-U1'] == ['1-U1', '2-U1']
+
+
+def test_collapse_filtered_data_keeps_index(tmp_path):
+    data_file = str(tmp_path / 'data.json')
+    yuri.get_duplicate_index(DATA, data_file)
+    filtered = {key: DATA[key] for key in ('1-U1', '2-U1')}
+    kept, _, members = yuri.collapse_duplicates(filtered, data_file, list(filtered), duplicates.WEIGHTING_NONE,
+                                                save_index=False)
+    assert kept == ['1-U1'] and members['1-U1'] == ['1-U1', '2-U1']
+    # The entries of the data that was filtered out are still indexed
+    assert '4-U1' in DuplicateIndex(duplicates.get_index_file(data_file))
@@ -0,0 +1,25 @@
+
+import numpy
+from yuri import evaluation
+
+
+def test_evaluate():
+    labels = ['a', 'b', 'c']
+    scores = numpy.array([[0.9, 0.05, 0.05], [0.2, 0.7, 0.1], [0.6, 0.3, 0.1], [0.1, 0.1, 0.8]])
+    # The last expected label is unknown, so it only counts towards the false positives of c
+    gold = evaluation.label_matrix(['a', 'b', 'b', 'x'], labels)
+    result = evaluation.evaluate(scores, gold, labels)
+
+    assert round(result['textcat_p'], 3) == 0.5
+    assert round(result['textcat_r'], 3) == 0.667
+    assert round(result['textcat_f'], 3) == 0.571
+    assert round(result['textcat_accuracy'], 3) == 0.667
+    assert round(result['per_label']['b']['r'], 3) == 0.5
+    assert result['per_label']['b']['support'] == 2
+    assert round(result['textcat_macro_f'], 3) == 0.444
+    assert result['confusion'].tolist() == [[1, 0, 0], [1, 1, 0], [0, 0, 0]]
+
+
+def test_gold_matrix():
+    gold = evaluation.gold_matrix([{'a': True, 'b': False}, {'a': False, 'b': True}], ['b', 'a'])
+    assert gold.tolist() == [[False, True], [True, False]]
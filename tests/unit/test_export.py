@@ -0,0 +1,88 @@
+
+import argparse
+import inquirer
+import json
+import zipfile
+import yuri
+from yuri.export import SlackExport
+from yuri.mirror import MessageMirror
+
+
+def _message(i: int, **kwargs) -> dict:
+    # One message every 6 hours so that they span several day files
+    return dict({'ts': f'{1500000000 + i * 6 * 60 * 60}.000100', 'user': 'U1', 'text': f'message {i}'}, **kwargs)
+
+
+def _write_export(export_file: str, messages: list, channels: bool = True):
+    days = {}
+    for message in messages:
+        days.setdefault(yuri.export._timestamp_day(message['ts']), []).append(message)
+    with zipfile.ZipFile(export_file, 'w') as zip_file:
+        if channels:
+            zip_file.writestr('channels.json', json.dumps([{'id': 'C1', 'name': 'oncall'}]))
+        for day, day_messages in days.items():
+            zip_file.writestr(f'oncall/{day}.json', json.dumps(day_messages))
+
+
+def test_get_messages(tmp_path):
+    export_file = str(tmp_path / 'export.zip')
+    _write_export(export_file, [_message(i) for i in range(10)])
+    with SlackExport(export_file) as slack_export:
+        assert slack_export.channel_names() == ['oncall']
+        assert slack_export.find_channel_id('#oncall') == 'C1'
+
+        messages, start_timestamp, _ = slack_export.get_messages('oncall', None, None, yuri.DIRECTION_OLDER, 4)
+        assert [message['text'] for message in messages] == [f'message {i}' for i in (9, 8, 7, 6)]
+        messages, _, _ = slack_export.get_messages('oncall', start_timestamp, None, yuri.DIRECTION_OLDER, 4)
+        assert [message['text'] for message in messages] == [f'message {i}' for i in (5, 4, 3, 2)]
+
+        messages, _, end_timestamp = slack_export.get_messages(
+            'oncall', None, _message(2)['ts'], yuri.DIRECTION_NEWER, 3
+        )
+        assert [message['text'] for message in messages] == [f'message {i}' for i in (3, 4, 5)]
+        assert end_timestamp == _message(5)['ts']
+
+        # The channel can also be read by its ID
+        messages, _, _ = slack_export.get_messages('C1', None, None, yuri.DIRECTION_OLDER, 4)
+        assert [message['text'] for message in messages] == [f'message {i}' for i in (9, 8, 7, 6)]
+
+
+def test_import_export(tmp_path):
+    export_file = str(tmp_path / 'export.zip')
+    mirror_file = str(tmp_path / 'mirror.sqlite3')
+    _write_export(export_file, [
+        _message(0), _message(1, attachments=[{}]), _message(2, text=''), _message(3, user='U2'), _message(4)
+    ])
+    args = type('Args', (), {
+        'export_file': export_file, 'slack_channel': 'oncall', 'mirror_file': mirror_file, 'ignore_user_ids': 'U2',
+    })
+    yuri.import_export(args)
+    with MessageMirror(mirror_file) as message_mirror:
+        assert message_mirror.find_channel_id('oncall') == 'C1'
+        assert message_mirror.count('C1') == 2
+        assert message_mirror.get_sync_state('C1') == (_message(0)['ts'], _message(4)['ts'], True)
+
+
+def test_classify_export_channel_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(inquirer, 'confirm', lambda *args, **kwargs: True)
+    monkeypatch.setattr(yuri, 'get_label', lambda labels, default=None: 'a')
+    export_file = str(tmp_path / 'export.zip')
+    data_file = str(tmp_path / 'data.json')
+    _write_export(export_file, [_message(i) for i in range(3)])
+    args = argparse.Namespace(slack_channels=['#oncall'], channel_is_id=False)
+    with SlackExport(export_file) as slack_export:
+        # Entries are tagged with the channel ID like when classifying from slack or a mirror
+        channel_names = yuri.get_classify_channels(args, slack_export)
+        assert channel_names == {'C1': 'oncall'}
+        data = {}
+        yuri.classify_messages(
+            None, {'C1': (None, None)}, data, yuri.DIRECTION_OLDER, None, batch_size=2, data_file=data_file,
+            message_source=slack_export, channel_names=channel_names,
+        )
+    assert {entry['channel'] for entry in data.values()} == {'C1'} and len(data) == 3
+    assert len(yuri.get_training_data(data_file, ['oncall'])[0]) == 3
+
+    # Without a channels.json file, the channel is only known by its name
+    _write_export(export_file, [_message(0)], channels=False)
+    with SlackExport(export_file) as slack_export:
+        assert yuri.get_classify_channels(args, slack_export) == {'oncall': 'oncall'}
@@ -0,0 +1,62 @@
+import pytest
+from yuri import hyperparameters, training
+
+
+def test_get_candidates():
+    space = {'architecture': ['simple_cnn', 'bow'], 'n_iter': [5, 10, 20]}
+    candidates = hyperparameters.get_candidates(space)
+    assert len(candidates) == 6
+    assert candidates[0] == {'architecture': 'simple_cnn', 'n_iter': 5}
+    assert sorted((candidate['architecture'], candidate['n_iter']) for candidate in candidates) == sorted(
+        (architecture, n_iter) for architecture in ('simple_cnn', 'bow') for n_iter in (5, 10, 20)
+    )
+
+    # Random candidates are a subset of the grid, always the same for the same seed
+    sampled = hyperparameters.get_candidates(space, random_count=3, seed=1)
+    assert len(sampled) == 3 and all(candidate in candidates for candidate in sampled)
+    assert hyperparameters.get_candidates(space, random_count=3, seed=1) == sampled
+    assert hyperparameters.get_candidates(space, random_count=10, seed=1) == candidates
+
+    with pytest.raises(Exception, match='learn_rate'):
+        hyperparameters.get_candidates({'architecture': ['bow'], 'learn_rate': [0.1]})
+    with pytest.raises(Exception, match='n_iter'):
+        hyperparameters.get_candidates({'n_iter': []})
+
+
+def _scores(f: float) -> dict:
+    return {'textcat_f': f, 'textcat_p': f, 'textcat_r': f, 'textcat_accuracy': f, 'textcat_macro_f': f,
+            'per_label': {}}
+
+
+def test_rank_and_write_results(monkeypatch, tmp_path):
+    trained = []
+
+    def train_textcat_model(load_data_func, output_dir, **kwargs):
+        trained.append(kwargs)
+        return _scores({'simple_cnn': 0.5, 'bow': 0.75, 'ensemble': 0.5}[kwargs['architecture']])
+
+    monkeypatch.setattr(training, 'train_textcat_model', train_textcat_model)
+    candidates = hyperparameters.get_candidates({'architecture': ['simple_cnn', 'bow', 'ensemble'],
+                                                 'dropout': [[0.6, 0.2, 1e-4]]})
+    results = [
+        hyperparameters._train_candidate(index, params, [], [], ['a', 'b'], str(tmp_path / f'candidate-{index}'),
+                                         None, 2, 1)
+        for index, params in enumerate(candidates)
+    ]
+    # List values of the search space are passed as tuples, only textcat scores are kept
+    assert trained[0] == {'labels': ['a', 'b'], 'doc_cache_dir': None, 'patience': 2, 'seed': 1,
+                          'architecture': 'simple_cnn', 'dropout': (0.6, 0.2, 1e-4)}
+    assert 'per_label' not in results[0]['scores']
+
+    # Candidates with the same F-score keep their order
+    ranked = hyperparameters.rank_results(results)
+    assert [result['params']['architecture'] for result in ranked] == ['bow', 'simple_cnn', 'ensemble']
+
+    results_file = str(tmp_path / hyperparameters.RESULTS_FILE_NAME)
+    hyperparameters.write_results(ranked, results_file)
+    with open(results_file, 'r') as fobj:
+        rows = [line.rstrip('\n').split('\t') for line in fobj]
+    assert rows[0] == ['RANK', 'F', 'P', 'R', 'ACC', 'MACRO_F', 'SECONDS', 'PARAMS']
+    assert [row[:3] for row in rows[1:]] == [['1', '0.750', '0.750'], ['2', '0.500', '0.500'],
+                                             ['3', '0.500', '0.500']]
+    assert rows[1][7] == '{"architecture": "bow", "dropout": [0.6, 0.2, 0.0001]}'
@@ -0,0 +1,86 @@
+import argparse
+import os
+import yuri
+from yuri import training
+from yuri.instrumentation import Instrumentation
+
+
+def test_get_incremental_ids():
+    data = {f'{i}-U1': {'text': f'text {i}', 'label': 'a'} for i in range(10)}
+    trained_entries = {key: training.get_entry_hash(entry['text'], entry['label']) for key, entry in data.items()}
+    data['10-U1'] = {'text': 'text 10', 'label': 'b'}
+    # A relabeled entry is trained again
+    data['3-U1'] = {'text': 'text 3', 'label': 'b'}
+
+    new_ids, rehearsal_ids = yuri.get_incremental_ids(data, trained_entries, 2.0, seed=1)
+    assert sorted(new_ids) == ['10-U1', '3-U1']
+    assert len(rehearsal_ids) == 4
+    assert not set(rehearsal_ids).intersection(new_ids)
+    assert yuri.get_incremental_ids(data, trained_entries, 2.0, seed=1) == (new_ids, rehearsal_ids)
+
+
+def test_manifest(tmp_path):
+    assert training.load_manifest(str(tmp_path)) is None
+    training.write_manifest(str(tmp_path), {'1-U1': 'abc'}, {'b', 'a'})
+    assert training.load_manifest(str(tmp_path)) == {'labels': ['a', 'b'], 'entries': {'1-U1': 'abc'},
+                                                     'eval_entries': []}
+
+
+def _train_args(tmp_path, **kwargs) -> argparse.Namespace:
+    return argparse.Namespace(**dict(
+        data_file=str(tmp_path / 'data.json'), output_dir=str(tmp_path / 'model'), channels=None, channel_weights=None,
+        folds=None, incremental=True, rehearsal=1.0, seed=1, dedup=False, dedup_weighting=None, eval_percentage=20,
+        test_text=None, no_doc_cache=True, epochs=1, patience=None,
+    ), **kwargs)
+
+
+def _train(monkeypatch, args) -> dict:
+    """
+    Runs train_model with the training itself replaced, returning the arguments it was trained with.
+    """
+    trained = {}
+
+    def train_textcat_model(load_data_func, model=None, **kwargs):
+        train_data, eval_data = load_data_func()
+        trained.update(model=model, train_texts=sorted(train_data.texts), eval_texts=sorted(eval_data.texts))
+
+    monkeypatch.setattr(training, 'train_textcat_model', train_textcat_model)
+    yuri.train_model(args, Instrumentation())
+    return trained
+
+
+def test_incremental_new_label(monkeypatch, tmp_path):
+    args = _train_args(tmp_path)
+    data = {f'{i}-U1': {'text': f'text {i}', 'label': 'a'} for i in range(10)}
+    yuri.write_data(data, None, None, args.data_file)
+    os.makedirs(args.output_dir)
+    training.write_manifest(args.output_dir, {
+        key: training.get_entry_hash(entry['text'], entry['label']) for key, entry in data.items()
+    }, {'a'})
+
+    yuri.write_data({'10-U1': {'text': 'text 10', 'label': 'b'}}, None, None, args.data_file)
+    trained = _train(monkeypatch, args)
+    # The labels of the saved model can not be extended, so a new model is trained on every entry
+    assert trained['model'] is None
+    assert len(trained['train_texts']) + len(trained['eval_texts']) == 11
+    assert training.load_manifest(args.output_dir)['labels'] == ['a', 'b']
+
+
+def test_incremental_eval_entries(monkeypatch, tmp_path):
+    args = _train_args(tmp_path)
+    data = {f'{i}-U1': {'text': f'text {i}', 'label': 'a' if i % 2 else 'b'} for i in range(10)}
+    yuri.write_data(data, None, None, args.data_file)
+    os.makedirs(args.output_dir)
+    training.write_manifest(args.output_dir, {
+        key: training.get_entry_hash(entry['text'], entry['label']) for key, entry in data.items() if key != '9-U1'
+    }, {'a', 'b'}, eval_ids=['9-U1'])
+
+    # A single new entry is trained with a rehearsal entry and evaluated on the entry held out before
+    yuri.write_data({'10-U1': {'text': 'text 10', 'label': 'a'}}, None, None, args.data_file)
+    trained = _train(monkeypatch, args)
+    assert trained['model'] == args.output_dir
+    assert trained['eval_texts'] == ['text 9']
+    assert len(trained['train_texts']) == 2 and 'text 10' in trained['train_texts']
+    manifest = training.load_manifest(args.output_dir)
+    assert manifest['eval_entries'] == ['9-U1']
+    assert '10-U1' in manifest['entries'] and '9-U1' not in manifest['entries']
@@ -0,0 +1,35 @@
+import json
+import os
+import pytest
+from yuri import instrumentation
+
+
+def test_instrument(tmp_path):
+    metrics_file = str(tmp_path / 'model' / instrumentation.METRICS_FILE_NAME)
+    profile_file = str(tmp_path / 'train.prof')
+    with instrumentation.instrument(metrics_file, profile_file, command='train') as run_instrumentation:
+        for _ in range(2):
+            with run_instrumentation.span('update'):
+                sum(range(1000))
+        run_instrumentation.count('words', 5)
+        epoch = run_instrumentation.add_epoch(1, 2.0, 10, 50, loss=0.5)
+    assert epoch['examples_per_second'] == 5.0
+    assert epoch['words_per_second'] == 25.0
+    assert os.path.exists(profile_file)
+
+    with open(metrics_file, 'r') as fobj:
+        metrics = json.loads(fobj.read())
+    assert metrics['info'] == {'command': 'train'}
+    assert metrics['spans']['update']['calls'] == 2
+    assert metrics['counters'] == {'words': 5}
+    assert metrics['epochs'] == [epoch]
+    assert metrics['total_seconds'] >= metrics['spans']['update']['seconds']
+
+
+def test_instrument_failure(tmp_path):
+    metrics_file = str(tmp_path / 'metrics.json')
+    with pytest.raises(Exception):
+        with instrumentation.instrument(metrics_file, command='test'):
+            raise Exception('Failed')
+    with open(metrics_file, 'r') as fobj:
+        assert json.loads(fobj.read())['info'] == {'command': 'test', 'failed': True}
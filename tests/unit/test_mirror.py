@@ -0,0 +1,52 @@
+
+import yuri
+from tests.fake_slack import FakeSlackServer
+from tests.fakes import channel_message
+from yuri.mirror import MessageMirror
+
+
+def test_sync_and_resume(tmp_path):
+    messages = {'C1': [channel_message(i) for i in range(25)]}
+    with FakeSlackServer(channels={'C1': 'oncall'}, messages=messages, rate_limit_every=4) as server:
+        session = yuri.create_session(api_url=server.api_url)
+        with MessageMirror(str(tmp_path / 'mirror.sqlite3')) as message_mirror:
+            assert yuri.sync_channel('xoxp-1', 'C1', message_mirror, page_size=10, session=session) == 25
+            assert message_mirror.count('C1') == 25
+            assert message_mirror.get_sync_state('C1') == (channel_message(0)['ts'], channel_message(24)['ts'], True)
+
+            # Only the new messages are retrieved on the next sync
+            for i in range(25, 30):
+                server.add_message('C1', channel_message(i))
+            assert yuri.sync_channel('xoxp-1', 'C1', message_mirror, page_size=10, session=session) == 5
+            assert message_mirror.count('C1') == 30
+            assert message_mirror.get_sync_state('C1')[1] == channel_message(29)['ts']
+
+
+def test_resume_backfill(tmp_path):
+    with FakeSlackServer(channels={'C1': 'oncall'}, messages={'C1': [channel_message(i) for i in range(10)]}) as server:
+        session = yuri.create_session(api_url=server.api_url)
+        with MessageMirror(str(tmp_path / 'mirror.sqlite3')) as message_mirror:
+            # Simulate a backfill interrupted after storing the newest messages
+            message_mirror.add_messages('C1', [channel_message(i) for i in range(6, 10)])
+            message_mirror.set_sync_state('C1', channel_message(6)['ts'], channel_message(9)['ts'], False)
+            assert yuri.sync_channel('xoxp-1', 'C1', message_mirror, page_size=4, session=session) == 6
+            assert message_mirror.count('C1') == 10
+            assert message_mirror.get_sync_state('C1')[2]
+
+
+def test_get_messages(tmp_path):
+    with MessageMirror(str(tmp_path / 'mirror.sqlite3')) as message_mirror:
+        message_mirror.add_messages('C1', [channel_message(i) for i in range(10)])
+
+        messages, start_timestamp, _ = message_mirror.get_messages('C1', None, None, yuri.DIRECTION_OLDER, 4)
+        assert [message['text'] for message in messages] == [f'message {i}' for i in (9, 8, 7, 6)]
+        messages, start_timestamp, _ = message_mirror.get_messages(
+            'C1', start_timestamp, None, yuri.DIRECTION_OLDER, 4
+        )
+        assert [message['text'] for message in messages] == [f'message {i}' for i in (5, 4, 3, 2)]
+
+        messages, _, end_timestamp = message_mirror.get_messages(
+            'C1', None, channel_message(2)['ts'], yuri.DIRECTION_NEWER, 3
+        )
+        assert [message['text'] for message in messages] == [f'message {i}' for i in (3, 4, 5)]
+        assert end_timestamp == channel_message(5)['ts']
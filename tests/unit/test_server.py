@@ -0,0 +1,78 @@
+
+import json
+import os
+import threading
+import urllib.request
+from yuri.server import IGNORED_MODEL_FILES, MicroBatcher, ModelServer, get_model_version
+
+
+class _Doc(object):
+    def __init__(self, text: str, version: int):
+        self.cats = {'long': float(len(text) > 5), 'version': float(version)}
+
+
+class _Model(object):
+    def __init__(self, version: int):
+        self.version = version
+
+    def pipe(self, texts, batch_size=None):
+        return [_Doc(text, self.version) for text in texts]
+
+
+def _post(url: str, payload: dict) -> dict:
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), method='POST')
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def test_micro_batcher():
+    batches = []
+    batcher = MicroBatcher(lambda texts: batches.append(len(texts)) or [{'n': len(text)} for text in texts],
+                           max_batch_size=100, max_wait=0.2)
+    results = {}
+
+    def score(i):
+        results[i] = batcher.score(['x' * i, 'y'])
+
+    threads = [threading.Thread(target=score, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.stop()
+    assert results == {i: [{'n': i}, {'n': 1}] for i in range(5)}
+    assert sum(batches) == 10
+    assert len(batches) < 5
+
+
+def test_model_server_reload(tmp_path):
+    (tmp_path / 'meta.json').write_text('{}')
+    versions = iter(range(1, 10))
+    with ModelServer(str(tmp_path), port=0, reload_interval=None,
+                     load_func=lambda model_dir: _Model(next(versions))) as server:
+        response = _post(f'{server.address}/classify', {'text': 'some text'})
+        assert response == {'cats': {'long': 1.0, 'version': 1.0}, 'label': 'long'}
+
+        (tmp_path / 'meta.json').write_text('{"version": 2}')
+        os.utime(tmp_path / 'meta.json', (0, 1e10))
+        assert server.reload_if_changed()
+        response = _post(f'{server.address}/classify', {'texts': ['a', 'b']})
+        assert [result['cats']['version'] for result in response['results']] == [2.0, 2.0]
+
+        with urllib.request.urlopen(f'{server.address}/metrics') as metrics_response:
+            metrics = json.loads(metrics_response.read())
+        assert metrics['requests'] == 2
+        assert metrics['texts'] == 3
+        assert metrics['reloads'] == 1
+
+
+def test_model_version_ignores_metrics(tmp_path):
+    model_dir = str(tmp_path)
+    with open(os.path.join(model_dir, 'meta.json'), 'w') as fobj:
+        fobj.write('{}')
+    os.utime(os.path.join(model_dir, 'meta.json'), (1000, 1000))
+    # Written after the model is saved, they do not make the model reload
+    for file_name in IGNORED_MODEL_FILES:
+        with open(os.path.join(model_dir, file_name), 'w') as fobj:
+            fobj.write('{}')
+    assert get_model_version(model_dir) == 1000
@@ -0,0 +1,37 @@
+import pytest
+import yuri
+from tests.fake_slack import FakeSlackServer
+from yuri import slack
+
+
+def test_channel_id_cache(tmp_path):
+    cache_file = str(tmp_path / 'channels.json')
+    with FakeSlackServer(channels={'C1': 'oncall', 'C2': 'alerts'}) as server:
+        session = yuri.create_session(api_url=server.api_url)
+
+        def get_channel_id(name: str, **kwargs) -> str:
+            server.requests.clear()
+            return slack.get_channel_id('xoxp-1', name, session=session, cache_file=cache_file, **kwargs)
+
+        assert get_channel_id('#oncall') == 'C1'
+        assert server.requests == ['conversations.list']
+        # Every listed channel is cached, cached IDs are only checked to still resolve
+        assert get_channel_id('alerts') == 'C2'
+        assert server.requests == ['conversations.info']
+
+        # Expired IDs are listed again
+        assert get_channel_id('alerts', cache_ttl=0) == 'C2'
+        assert server.requests == ['conversations.list']
+
+        # A cached ID that no longer has the name is replaced
+        server.channels = {'C1': 'oncall-old', 'C2': 'alerts', 'C3': 'oncall'}
+        assert get_channel_id('oncall') == 'C3'
+        assert server.requests == ['conversations.info', 'conversations.list']
+        assert slack.load_channel_cache(cache_file)['oncall']['id'] == 'C3'
+
+        # A cached ID that no longer resolves at all is dropped
+        del server.channels['C2']
+        with pytest.raises(Exception, match='alerts'):
+            get_channel_id('alerts')
+        assert server.requests == ['conversations.info', 'conversations.list']
+        assert 'alerts' not in slack.load_channel_cache(cache_file)
@@ -0,0 +1,63 @@
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT_PATH = os.path.realpath(os.path.join(os.path.dirname(__file__), '../..'))
+YURI_BIN = os.path.join(ROOT_PATH, 'bin', 'yuri')
+# Modules that take most of the startup time and are only needed by some commands
+HEAVY_MODULES = ('spacy', 'thinc', 'numpy', 'slacker', 'requests', 'urllib3', 'inquirer', 'blessed', 'sqlite3')
+# Generous enough for slow machines, importing spaCy alone takes longer
+IMPORT_TIME_BUDGET_MS = 250
+
+# Runs the CLI with the arguments and prints every module imported by the end as the last line
+RUN_CLI = '''
+import json, runpy, sys
+sys.argv = ['yuri'] + json.loads(sys.argv[1])
+try:
+    runpy.run_path({yuri_bin!r}, run_name='__main__')
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+def _imported_modules(*args: str) -> set:
+    result = subprocess.run(
+        [sys.executable, '-c', RUN_CLI.format(yuri_bin=YURI_BIN), json.dumps(list(args))],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, universal_newlines=True, cwd=ROOT_PATH,
+    )
+    return {name.split('.')[0] for name in json.loads(result.stdout.strip().splitlines()[-1])}
+
+
+def _import_time_ms(module: str) -> float:
+    """
+    Measures the cumulative import time of a module in a fresh interpreter with -X importtime.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, universal_newlines=True, cwd=ROOT_PATH,
+    )
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+    raise Exception(f'The import time of {module} was not reported')
+
+
+def test_help_skips_heavy_modules():
+    assert not _imported_modules('--help').intersection(HEAVY_MODULES)
+    assert not _imported_modules('train', '--help').intersection(HEAVY_MODULES)
+
+
+def test_classify_text_skips_heavy_modules(tmp_path):
+    data_file = str(tmp_path / 'data.json')
+    modules = _imported_modules('-d', data_file, 'classify-text', 'some text', '-l', 'label', '-y')
+    assert os.path.exists(f'{data_file}.journal')
+    assert not modules.intersection(HEAVY_MODULES)
+
+
+def test_import_time():
+    assert _import_time_ms('yuri') < IMPORT_TIME_BUDGET_MS
@@ -0,0 +1,56 @@
+
+import json
+import os
+from yuri.storage import DataStore
+
+
+def test_append_and_replay(tmp_path):
+    data_file = str(tmp_path / 'data.json')
+    store = DataStore(data_file)
+    assert not store.exists()
+    store.append({'1-U1': {'text': 'one', 'label': 'a'}}, '1', '2')
+    store.append({'2-U1': {'text': 'two', 'label': 'b'}, '1-U1': {'text': 'one', 'label': 'c'}}, '1', '3')
+    assert not os.path.exists(data_file)
+
+    data, start_timestamp, end_timestamp = DataStore(data_file).load()
+    assert data == {'1-U1': {'text': 'one', 'label': 'c'}, '2-U1': {'text': 'two', 'label': 'b'}}
+    assert (start_timestamp, end_timestamp) == ('1', '3')
+
+
+def test_compact(tmp_path):
+    data_file = str(tmp_path / 'data.json')
+    store = DataStore(data_file, compact_threshold=3)
+    store.append({'1-U1': {'text': 'one', 'label': 'a'}}, None, None)
+    store.append({'2-U1': {'text': 'two', 'label': 'b'}, '3-U1': {'text': 'three', 'label': 'b'}}, None, None)
+    assert os.path.exists(data_file)
+    assert not os.path.exists(store.journal_file)
+    store.append({'3-U1': {'text': 'three', 'label': 'a'}}, None, None)
+    store.append({}, '1', '2')
+    store.compact()
+    # The previous snapshot is kept under its version
+    with open(f'{data_file}.3') as fobj:
+        assert len(json.loads(fobj.read())['data']) == 3
+
+    reloaded = DataStore(data_file)
+    data, start_timestamp, end_timestamp = reloaded.load()
+    assert data['3-U1']['label'] == 'a'
+    assert (start_timestamp, end_timestamp) == ('1', '2')
+    assert reloaded.version == 5
+
+
+def test_legacy_data_file_and_incomplete_record(tmp_path):
+    data_file = str(tmp_path / 'data.json')
+    with open(data_file, 'w') as fobj:
+        fobj.write(json.dumps({'data': {'1-U1': {'text': 'one', 'label': 'a'}}, 'start_timestamp': '1',
+                               'end_timestamp': None}))
+    store = DataStore(data_file)
+    store.append({'2-U1': {'text': 'two', 'label': 'b'}}, '1', None)
+    with open(store.journal_file, 'a') as fobj:
+        fobj.write('{"type": "classif')
+
+    data, start_timestamp, _ = DataStore(data_file).load()
+    assert sorted(data) == ['1-U1', '2-U1']
+    assert start_timestamp == '1'
+    # The incomplete record is removed so that new records can be appended after it
+    with open(store.journal_file) as fobj:
+        assert fobj.read().endswith('}\n')
@@ -0,0 +1,52 @@
+import yuri
+from tests.fake_slack import FakeSlackServer
+from yuri import slack
+from yuri.mirror import MessageMirror
+
+
+def _message(i: int, thread: int = None, **kwargs) -> dict:
+    message = {'ts': f'{1500000000 + i}.000100', 'user': f'U{i % 3}', 'text': f'message {i}', **kwargs}
+    if thread is not None:
+        message['thread_ts'] = f'{1500000000 + thread}.000100'
+    return message
+
+
+def _channel_messages() -> list:
+    messages = [_message(i) for i in range(10)]
+    # Messages 2 and 5 start threads, one reply of the second thread was also sent to the channel
+    messages[2]['reply_count'] = 3
+    messages[5]['reply_count'] = 2
+    messages.extend([_message(100 + i, thread=2) for i in range(3)])
+    messages.append(_message(200, thread=5))
+    messages.append(_message(201, thread=5, subtype='thread_broadcast'))
+    return messages
+
+
+def test_expand_threads():
+    with FakeSlackServer(channels={'C1': 'oncall'}, messages={'C1': _channel_messages()}, rate_limit_every=3) as server:
+        session = yuri.create_session(api_url=server.api_url)
+        assert [reply['text'] for reply in slack.get_replies('xoxp-1', 'C1', _message(2)['ts'], page_size=2,
+                                                             session=session)] == \
+            ['message 100', 'message 101', 'message 102']
+
+        messages, _, _ = slack.get_messages('xoxp-1', 'C1', None, None, yuri.DIRECTION_NEWER, 20, session=session)
+        assert len(messages) == 11
+        expanded = slack.expand_threads('xoxp-1', 'C1', messages, workers=2, session=session)
+        texts = [message['text'] for message in expanded]
+        assert texts[texts.index('message 2') + 1:texts.index('message 3')] == \
+            ['message 100', 'message 101', 'message 102']
+        # The reply also sent to the channel is only included once, where it was sent to the channel
+        assert texts[texts.index('message 5') + 1:texts.index('message 6')] == ['message 200']
+        assert texts.count('message 201') == 1
+        assert len(expanded) == 15
+        assert len({yuri.get_message_id(message) for message in expanded}) == 15
+
+
+def test_sync_threads(tmp_path):
+    with FakeSlackServer(channels={'C1': 'oncall'}, messages={'C1': _channel_messages()}) as server:
+        session = yuri.create_session(api_url=server.api_url)
+        with MessageMirror(str(tmp_path / 'mirror.sqlite3')) as message_mirror:
+            slack.sync_channel('xoxp-1', 'C1', message_mirror, page_size=4, session=session, thread_workers=2)
+            assert message_mirror.count('C1') == 15
+            # The synced range only depends on the messages of the channel, which include the reply sent to it
+            assert message_mirror.get_sync_state('C1') == (_message(0)['ts'], _message(201)['ts'], True)
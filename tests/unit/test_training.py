@@ -0,0 +1,74 @@
+import os
+import pytest
+import yuri
+from tests.fakes import FakeModel
+from yuri import training
+from yuri.instrumentation import Instrumentation
+
+
+def _tokens(docs: dict) -> dict:
+    return {text: [token.text for token in doc] for text, doc in docs.items()}
+
+
+def test_tokenize_texts_cache(monkeypatch, tmp_path, capsys):
+    spacy = pytest.importorskip('spacy')
+    cache_dir = str(tmp_path / 'doc_cache')
+    texts = ['disk full on host-1', 'deploy finished', 'disk full on host-1']
+    docs = training.tokenize_texts(spacy.blank('en'), texts, cache_dir=cache_dir)
+    assert _tokens(docs) == {'disk full on host-1': ['disk', 'full', 'on', 'host-1'],
+                             'deploy finished': ['deploy', 'finished']}
+    assert 'Tokenized 2 texts' in capsys.readouterr().out
+    cache_files = os.listdir(cache_dir)
+    assert len(cache_files) == 1 and cache_files[0].endswith(training.DOC_CACHE_SUFFIX)
+
+    # The same texts are loaded from the cache
+    cached = training.tokenize_texts(spacy.blank('en'), reversed(texts), cache_dir=cache_dir)
+    assert 'Loaded 2 tokenized texts' in capsys.readouterr().out
+    assert _tokens(cached) == _tokens(docs)
+
+    # Other texts replace the cache, files removed by another run at the same time are skipped
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: listdir(path) + [f'removed{training.DOC_CACHE_SUFFIX}'])
+    training.tokenize_texts(spacy.blank('en'), ['something else'], cache_dir=cache_dir)
+    monkeypatch.undo()
+    assert 'Tokenized 1 texts' in capsys.readouterr().out
+    new_cache_files = os.listdir(cache_dir)
+    assert len(new_cache_files) == 1 and new_cache_files != cache_files
+
+
+def test_check_early_stopping():
+    assert training.check_early_stopping([0.5]) == (1, False)
+    assert training.check_early_stopping([0.5, 0.7, 0.6]) == (2, False)
+    # The first of equal F-scores is the best epoch
+    assert training.check_early_stopping([0.5, 0.7, 0.7], patience=2) == (2, False)
+    assert training.check_early_stopping([0.5, 0.7, 0.7, 0.6], patience=2) == (2, True)
+    assert training.check_early_stopping([0.5, 0.4, 0.3, 0.2, 0.1]) == (1, False)
+    assert training.check_early_stopping([0.5, 0.4, 0.3], patience=1) == (1, True)
+
+
+def test_read_test_file(tmp_path):
+    test_file = tmp_path / 'test.tsv'
+    test_file.write_text('# text\tlabel\ndisk full 0.9\ta\n  # indented comment\ndeploy done 0.2\tb\r\n')
+    assert list(yuri.read_test_file(str(test_file))) == [('disk full 0.9', 'a'), ('deploy done 0.2', 'b')]
+
+    test_file.write_text('disk full 0.9\ta\nno label 0.1\n')
+    examples = yuri.read_test_file(str(test_file))
+    # The file is read lazily, the invalid line is only reported once it is reached
+    assert next(examples) == ('disk full 0.9', 'a')
+    with pytest.raises(Exception, match='Line 2 .* has 1'):
+        next(examples)
+
+
+def test_textcat_model_batch(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(training, 'load_model', lambda model_dir: FakeModel())
+    test_file = tmp_path / 'test.tsv'
+    test_file.write_text('# text\tlabel\ndisk full 0.9\ta\ndeploy done 0.2\tb\nhost down 0.7\tb\nlate 0.6\ta\n')
+    instrumentation = Instrumentation()
+    total, failures = training.test_textcat_model_batch(
+        'model', yuri.read_test_file(str(test_file)), batch_size=2, instrumentation=instrumentation
+    )
+    assert (total, failures) == (4, 1)
+    output = capsys.readouterr().out
+    assert 'FAIL: expected b, actual a (host down 0.7)' in output
+    assert 'Tested 4 line(s) with 1 failure(s)' in output
+    assert instrumentation.counters == {'lines': 4, 'words': 11, 'failures': 1}
@@ -1,16 +1,17 @@
 
-import inquirer
+import importlib
 import json
 import os
+import queue
 import random
-import shutil
-import slacker
+import threading
 import time
-from inquirer.render.console import ConsoleRender
-from inquirer.themes import GreenPassion
-from requests import Session
-from typing import Any, Dict, List, Optional, Set, Tuple
-from . import training
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from . import storage
+
+if TYPE_CHECKING:
+    from requests import Session
+    from . import dataset, duplicates, export, instrumentation, mirror
 
 
 parent_path = os.path.realpath(os.path.join(os.path.dirname(__file__), '../'))
@@ -19,78 +20,123 @@ parent_path = os.path.realpath(os.path.join(os.path.dirname(__file__), '../'))
 ROOT_PATH = os.environ.get('YURI_ROOT_PATH', os.path.join(parent_path, 'yuri-data'))
 DEFAULT_DATA_FILE = os.path.join(ROOT_PATH, 'slack_channel_data/data.json')
 DEFAULT_MODEL_DIR = os.path.join(ROOT_PATH, 'slack_channel_model')
+DOC_CACHE_DIR_NAME = 'doc_cache'
+DEFAULT_CHANNEL_CACHE_FILE = os.path.join(ROOT_PATH, 'slack_channel_cache.json')
 DEFAULT_BATCH_SIZE = 10
+DEFAULT_PREFETCH_PAGES = 1
+DEFAULT_MIRROR_FILE = os.path.join(ROOT_PATH, 'slack_channel_data/mirror.sqlite3')
+DEFAULT_SYNC_PAGE_SIZE = 200
+DEFAULT_THREAD_WORKERS = 4
 DIRECTION_NEWER = True
 DIRECTION_OLDER = False
 IGNORE_LABEL = 'ignore'
 CREATE_LABEL = '+add new'
-INQUIRER_RENDER = ConsoleRender(theme=GreenPassion())
+DEFAULT_IMPORT_CHUNK_SIZE = 1000
+DEFAULT_REHEARSAL_RATIO = 1.0
 
+# Local sources of messages that may be classified instead of retrieving messages from slack
+MessageSource = Union['mirror.MessageMirror', 'export.SlackExport']
 
-def get_client(token: str, session: Optional[Session] = None) -> slacker.Slacker:
-    if not token:
-        raise Exception(f'No token was provided')
-    if not token.startswith('xoxp-'):
-        raise Exception(f'The provided token is invalid since it not a user token, please use a user token instead')
-    return slacker.Slacker(token, session=session)
+# Submodules that import spaCy, numpy, the slack client or other slow dependencies are only imported once they are
+# used, so that commands which do not need them (and the help) start quickly
+LAZY_SUBMODULES = ('audit', 'compact', 'crossvalidation', 'dataset', 'duplicates', 'evaluation', 'export',
+                   'hyperparameters', 'instrumentation', 'mirror', 'server', 'slack', 'training')
+# Names of the slack module that are also available from this package
+SLACK_NAMES = (
+    'DEFAULT_CHANNEL_CACHE_TTL', 'DEFAULT_POOL_SIZE', 'DEFAULT_RETRIES', 'DEFAULT_RETRY_BACKOFF', 'RETRY_STATUSES',
+    'SLACK_API_URL', 'SlackSession', 'create_session', 'get_session', 'close_session', 'get_client',
+    'load_channel_cache', 'write_channel_cache', 'channel_id_resolves', 'get_channel_id', 'get_messages',
+    'get_history_pages', 'sync_channel',
+)
 
 
-def get_channel_id(token: str, name: str, session: Optional[Session] = None) -> str:
-    # Strip off # prefix if specified
-    if name.startswith('#'):
-        name = name[1:]
+def __getattr__(name: str) -> Any:
+    if name in LAZY_SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    if name in SLACK_NAMES:
+        return getattr(importlib.import_module('.slack', __name__), name)
+    if name == 'INQUIRER_RENDER':
+        return get_inquirer_render()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-    client = get_client(token, session=session)
-    start_query = True
-    cursor = None
-    while start_query or cursor:
-        start_query = False
-        try:
-            # Query 1000 at a time (the max supported) to keep the number of requests lower
-            response = client.conversations.list(types=['public_channel', 'private_channel'], cursor=cursor, limit=1000)
-        except Exception as e:
-            if inquirer.confirm(f'Encountered error while retrieving channel ID for {name} ({e}), retry?', default=True):
-                return get_channel_id(token, name, session=session)
-            raise
-        channels = response.body['channels']
-        for channel in channels:
-            if channel['name'] == name:
-                return channel['id']
-        cursor = response.body.get('response_metadata', {}).get('next_cursor')
-    raise Exception(f'Could not find channel {name} in list of channels for this user')
-
-
-def get_messages(
-        token: str, channel_id: str, start_timestamp: Optional[str], end_timestamp: Optional[str],
-        direction: bool, batch_size: Optional[int], session: Optional[Session] = None
-) -> Tuple[List[dict], Optional[str], Optional[str]]:
-    """
-    Retrieves a list of messages
-    :return: Tuple of messages sorted according to the direction and the start/end timestamps
-    """
-    client = get_client(token, session=session)
-    if direction == DIRECTION_OLDER:
-        timestamp_args = {'latest': start_timestamp}
-    else:
-        timestamp_args = {'oldest': end_timestamp}
-    try:
-        response = client.conversations.history(channel_id, limit=batch_size, **timestamp_args)
-    except Exception as e:
-        if inquirer.confirm(f'Encountered error while retrieving messages ({e}), retry?', default=True):
-            return get_messages(
-                token, channel_id, start_timestamp, end_timestamp, direction, batch_size, session=session
-            )
-        # Return nothing since we did not retry
-        return [], None, None
-    # The messages are already in reverse age order, with the latest chronologically at the front of the list
-    messages = response.body['messages']
-    if direction == DIRECTION_OLDER:
-        start_timestamp = messages[-1]['ts'] if len(messages) > 0 else None
-    else:
-        # If we want newer messages, reverse the order
-        messages.reverse()
-        end_timestamp = messages[-1]['ts'] if len(messages) > 0 else None
-    return messages, start_timestamp, end_timestamp
+
+_inquirer_render = None
+
+
+def get_inquirer_render():
+    """
+    Creates the render used by every prompt, importing inquirer only once something is prompted.
+    """
+    global _inquirer_render
+    if _inquirer_render is None:
+        from inquirer.render.console import ConsoleRender
+        from inquirer.themes import GreenPassion
+        _inquirer_render = ConsoleRender(theme=GreenPassion())
+    return _inquirer_render
+
+
+class MessagePrefetcher(object):
+    """
+    Fetches pages of messages on a background thread, keeping up to a number of pages ready ahead of the page
+    currently being classified. Each page is requested from where the previous page ended, and fetching stops after
+    the first empty page or error.
+    """
+
+    def __init__(
+            self, fetch_page: Callable[[Optional[str], Optional[str]], Tuple[List[dict], Optional[str], Optional[str]]],
+            start_timestamp: Optional[str], end_timestamp: Optional[str], pages: int = DEFAULT_PREFETCH_PAGES
+    ):
+        """
+        :param fetch_page: Function retrieving a page of messages from the start/end timestamps, returning the same
+        tuple as get_messages
+        """
+        self.fetch_page = fetch_page
+        self._queue = queue.Queue(maxsize=max(pages, 1))
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(start_timestamp, end_timestamp), name='yuri-message-prefetcher', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, start_timestamp: Optional[str], end_timestamp: Optional[str]):
+        while not self._stopped.is_set():
+            try:
+                page = self.fetch_page(start_timestamp, end_timestamp)
+            except Exception as e:
+                self._put(e)
+                return
+            self._put(page)
+            messages, next_start_timestamp, next_end_timestamp = page
+            if not messages:
+                return
+            start_timestamp = next_start_timestamp or start_timestamp
+            end_timestamp = next_end_timestamp or end_timestamp
+
+    def _put(self, item: Any):
+        # Wait for room in the queue, giving up as soon as the prefetcher is stopped
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def next_page(self) -> Tuple[List[dict], Optional[str], Optional[str]]:
+        """
+        Waits for the next page of messages.
+        :return: Tuple of messages sorted according to the direction and the start/end timestamps
+        """
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def stop(self):
+        """
+        Stops fetching pages and waits for the background thread to finish any request in progress.
+        """
+        self._stopped.set()
+        self._thread.join()
 
 
 def get_data_labels(data: Dict[str, dict]) -> Set[str]:
@@ -109,11 +155,17 @@ def print_classification_entries(classifications: Dict[str, dict]):
         print(f'Label: {classification["label"]}')
 
 
-def get_label(existing_labels: Set[str]) -> str:
+def get_label(existing_labels: Set[str], default: Optional[str] = None) -> str:
+    """
+    Prompts for the label of a message.
+    :param default: If set, the label selected at first
+    """
+    import inquirer
     label = inquirer.list_input(
         'Please choose a label to apply to this message',
         choices=[IGNORE_LABEL] + sorted(existing_labels) + [CREATE_LABEL],
-        render=INQUIRER_RENDER
+        default=default,
+        render=get_inquirer_render()
     )
     if label == CREATE_LABEL:
         label = create_label(existing_labels)
@@ -125,8 +177,9 @@ def get_label(existing_labels: Set[str]) -> str:
 
 
 def create_label(existing_labels: Set[str]) -> Optional[str]:
+    import inquirer
     new_label = inquirer.text(
-        message="New label name (enter CANCEL to select an existing label)", render=INQUIRER_RENDER
+        message="New label name (enter CANCEL to select an existing label)", render=get_inquirer_render()
     )
     if new_label == 'CANCEL':
         # Return nothing to cancel
@@ -138,22 +191,72 @@ def create_label(existing_labels: Set[str]) -> Optional[str]:
     return new_label
 
 
+def get_message_id(message: dict) -> str:
+    return f'{message.get("ts")}-{message.get("user")}'
+
+
+def get_skip_reason(message: dict, ignore_user_ids: Optional[Set[str]] = None) -> Optional[str]:
+    """
+    Checks whether a message should not be classified.
+    :return: The reason to skip the message, or None if it should be classified
+    """
+    # We cannot check for blocks as the newer updates of the slack client always add blocks apparently
+    if not message.get('text') or message.get('attachments'):
+        return 'Message has no text or attachments'
+    message_user = message.get('user')
+    if ignore_user_ids and message_user in ignore_user_ids:
+        return f'Message is from an ignored user ID ({message_user})'
+    return None
+
+
+def predict_labels(nlp: Any, messages: List[dict], ignore_user_ids: Optional[Set[str]] = None) -> \
+        Dict[str, Tuple[str, float]]:
+    """
+    Scores the messages that would be classified with a trained model in one batch.
+    :param nlp: The loaded spaCy pipeline of the model
+    :return: Dict of message IDs to the label with the best score and its score
+    """
+    candidates = [message for message in messages if not get_skip_reason(message, ignore_user_ids)]
+    texts = [message['text'] for message in candidates]
+    predictions = {}
+    for message, doc in zip(candidates, nlp.pipe(texts, batch_size=max(len(texts), 1))):
+        if doc.cats:
+            label = max(doc.cats, key=doc.cats.get)
+            predictions[get_message_id(message)] = (label, float(doc.cats[label]))
+    return predictions
+
+
+def order_by_confidence(messages: List[dict], predictions: Dict[str, Tuple[str, float]]) -> List[dict]:
+    """
+    Orders messages so that the ones the model is least confident about come first, keeping the timestamp order of
+    messages with the same score. Messages without a prediction (e.g. skipped ones) come last.
+    """
+    return sorted(messages, key=lambda message: predictions.get(get_message_id(message), (None, 2.0))[1])
+
+
 def classify_batch(messages: List[dict], data: Dict[str, dict], all_labels: Set[str],
-                   ignore_user_ids: Optional[Set[str]] = None) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+                   ignore_user_ids: Optional[Set[str]] = None,
+                   duplicate_index: Optional['duplicates.DuplicateIndex'] = None,
+                   predictions: Optional[Dict[str, Tuple[str, float]]] = None,
+                   auto_accept: Optional[float] = None) -> \
+        Tuple[Dict[str, dict], Dict[str, dict]]:
+    """
+    :param duplicate_index: If set, the label of a near-duplicate of a new message is proposed for it
+    :param predictions: If set, the label predicted by the model for each message ID, proposed for new messages
+    without a near-duplicate
+    :param auto_accept: If set, predicted labels of new messages with at least this score are used without a prompt
+    """
+    import inquirer
     messages_len = len(messages)
     added = {}
     updated = {}
     for i, message in enumerate(messages):
         message_text = message.get('text') or '<NO TEXT>'
-        message_id = f'{message.get("ts")}-{message.get("user")}'
+        message_id = get_message_id(message)
         print(f'{i + 1}/{messages_len} {message_text}')
-        # We cannot check for blocks as the newer updates of the slack client always add blocks apparently
-        if not message.get('text') or message.get('attachments'):
-            print('Message has no text or attachments, skipping')
-            continue
-        message_user = message.get('user')
-        if ignore_user_ids and message_user in ignore_user_ids:
-            print(f'Message is from an ignored user ID ({message_user}), skipping')
+        skip_reason = get_skip_reason(message, ignore_user_ids)
+        if skip_reason:
+            print(f'{skip_reason}, skipping')
             continue
 
         classification = data.get(message_id)
@@ -168,7 +271,10 @@ def classify_batch(messages: List[dict], data: Dict[str, dict], all_labels: Set[
             if not inquirer.confirm(f'There is already an existing classification for this message'
                                     f'{"(text has been modified)" if changed else ""}, '
                                     f'do you want to change it from {classification["label"]}?',
-                                    render=INQUIRER_RENDER):
+                                    render=get_inquirer_render()):
+                # Keep the modified text even if the label is unchanged
+                if changed:
+                    updated[message_id] = classification.copy()
                 continue
 
             # Copy the classification so that it can modified multiple times if there are problems
@@ -182,8 +288,27 @@ def classify_batch(messages: List[dict], data: Dict[str, dict], all_labels: Set[
             # Add to added dict
             added[message_id] = classification
 
+        # Propose the label of an already classified near-duplicate
+        proposed_label = None
+        if duplicate_index is not None and message_id not in updated:
+            match = duplicate_index.find(message_text, exclude_id=message_id)
+            if match and match[0] in data:
+                proposed_label = data[match[0]]['label']
+                print(f'Near-duplicate ({match[1]:.0%} similar) of a message labeled {proposed_label}: '
+                      f'{data[match[0]]["text"]}')
+
+        # Otherwise propose the label predicted by the model, which may be accepted as is if it is confident enough
+        prediction = predictions.get(message_id) if predictions and message_id not in updated else None
+        if proposed_label is None and prediction and (prediction[0] in all_labels or prediction[0] == IGNORE_LABEL):
+            proposed_label, score = prediction
+            if auto_accept is not None and score >= auto_accept:
+                print(f'Predicted label {proposed_label} ({score:.0%}), accepting')
+                classification['label'] = proposed_label
+                continue
+            print(f'Predicted label {proposed_label} ({score:.0%})')
+
         # Set classification label
-        label = get_label(all_labels)
+        label = get_label(all_labels, default=proposed_label)
         classification['label'] = label
 
     print('--------------------------------------Summary----------------------------------------')
@@ -195,60 +320,172 @@ def classify_batch(messages: List[dict], data: Dict[str, dict], all_labels: Set[
         print_classification_entries(added)
     else:
         print('No new classification entries added')
-    if not inquirer.confirm('Are the above entries correct?', default=True, render=INQUIRER_RENDER):
-        return classify_batch(messages, data, all_labels, ignore_user_ids=ignore_user_ids)
+    if not inquirer.confirm('Are the above entries correct?', default=True, render=get_inquirer_render()):
+        # Prompt for every message this time, so that auto-accepted labels can be corrected
+        return classify_batch(messages, data, all_labels, ignore_user_ids=ignore_user_ids,
+                              duplicate_index=duplicate_index, predictions=predictions)
 
     return added, updated
 
 
-def classify_messages(token: str, channel_id: str, data: Dict[str, dict], start_timestamp: Optional[str],
-                      end_timestamp: Optional[str], direction: bool,
+def classify_messages(token: str, channel_cursors: Dict[str, Tuple[Optional[str], Optional[str]]],
+                      data: Dict[str, dict], direction: bool,
                       ignore_user_ids: Optional[Set[str]], batch_size: Optional[int] = None,
-                      session: Optional[Session] = None) -> Tuple[Optional[str], Optional[str]]:
+                      session: Optional['Session'] = None,
+                      data_file: Optional[str] = None,
+                      prefetch_pages: int = DEFAULT_PREFETCH_PAGES,
+                      message_source: Optional[MessageSource] = None,
+                      duplicate_index: Optional['duplicates.DuplicateIndex'] = None,
+                      model_dir: Optional[str] = None, auto_accept: Optional[float] = None,
+                      run_instrumentation: Optional['instrumentation.Instrumentation'] = None,
+                      thread_workers: Optional[int] = None,
+                      channel_names: Optional[Dict[str, str]] = None) -> \
+        Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """
+    Classifies the messages of one or more channels, taking turns between the channels with a batch at a time. The
+    batches of every channel are fetched concurrently in the background. Classified messages are tagged with the ID of
+    their channel.
+    :param channel_cursors: The start and end timestamps to continue classifying from, by channel ID
+    :param message_source: If set, messages are read from this local mirror or slack export instead of slack
+    :param duplicate_index: If set, labels of near-duplicates are proposed and classified messages are added to it
+    :param model_dir: If set, each page is scored with this model, its predicted labels are proposed and the messages
+    are classified from the least to the most confident prediction
+    :param auto_accept: If set with a model dir, predicted labels with at least this score are accepted without a prompt
+    :param run_instrumentation: If set, the time spent fetching, predicting, labeling and writing is added to it
+    :param thread_workers: If set, the replies of threads are retrieved from slack with this many concurrent requests
+    and classified right after the message starting the thread
+    :param channel_names: The names of the channels by ID, stored with their timestamps in the data file
+    :return: The start and end timestamps reached in each channel, by channel ID
+    """
+    import inquirer
+    from . import instrumentation
+    run_instrumentation = run_instrumentation or instrumentation.Instrumentation()
+    channel_names = channel_names or {}
+    cursors = dict(channel_cursors)
     all_labels = get_data_labels(data)
-    done = False
-    while not done:
-        print('-------------------------------------------------------------------------------------')
-        previous_start_timestamp = start_timestamp
-        previous_end_timestamp = end_timestamp
-        messages, start_timestamp, end_timestamp = get_messages(
-            token, channel_id, start_timestamp, end_timestamp, direction, batch_size, session=session
+    nlp = None
+    if model_dir:
+        from . import training
+        print(f'Loading model from {model_dir} to predict labels')
+        with run_instrumentation.span('load_model'):
+            nlp = training.load_model(model_dir)
+    # Predictions of prefetched pages by message ID, pages are scored in the background before they are returned
+    predictions: Dict[str, Tuple[str, float]] = {}
+    # The prefetchers of several channels share the pipeline, which is not guaranteed to be safe to use concurrently
+    predict_lock = threading.Lock()
+
+    def fetch_page(channel_id: str, page_start_timestamp: Optional[str], page_end_timestamp: Optional[str]):
+        # Pages are fetched in the background, the time actually waited for them is timed separately
+        with run_instrumentation.span('fetch'):
+            if message_source:
+                page = message_source.get_messages(
+                    channel_id, page_start_timestamp, page_end_timestamp, direction, batch_size
+                )
+            else:
+                from . import slack
+                page = slack.get_messages(
+                    token, channel_id, page_start_timestamp, page_end_timestamp, direction, batch_size, session=session
+                )
+                if thread_workers:
+                    # The timestamps of the page only depend on the messages of the channel, not the replies
+                    page = (
+                        slack.expand_threads(token, channel_id, page[0], workers=thread_workers, session=session),
+                    ) + tuple(page[1:])
+        if nlp is not None:
+            with predict_lock, run_instrumentation.span('predict'):
+                predictions.update(predict_labels(nlp, page[0], ignore_user_ids))
+        return page
+
+    def start_prefetcher(channel_id: str) -> MessagePrefetcher:
+        return MessagePrefetcher(
+            lambda start, end: fetch_page(channel_id, start, end), *cursors[channel_id], pages=prefetch_pages
         )
 
-        # Make sure the timestamps are actually set (if get_messages returns none for them, use the last values)
-        start_timestamp = start_timestamp or previous_start_timestamp
-        end_timestamp = end_timestamp or previous_end_timestamp
+    # Fetch the following pages of every channel in the background while the current page is being classified
+    prefetchers = {channel_id: start_prefetcher(channel_id) for channel_id in cursors}
+    active_channel_ids = list(cursors)
+    index = 0
+    try:
+        while active_channel_ids:
+            print('-------------------------------------------------------------------------------------')
+            channel_id = active_channel_ids[index % len(active_channel_ids)]
+            channel_label = f'#{channel_names.get(channel_id) or channel_id}'
+            start_timestamp, end_timestamp = cursors[channel_id]
+            try:
+                with run_instrumentation.span('wait_for_page'):
+                    messages, page_start_timestamp, page_end_timestamp = prefetchers[channel_id].next_page()
+            except Exception as e:
+                prefetchers[channel_id].stop()
+                if inquirer.confirm(f'Encountered error while retrieving messages of {channel_label} ({e}), retry?',
+                                    default=True):
+                    # Start fetching again from the page that failed
+                    prefetchers[channel_id] = start_prefetcher(channel_id)
+                    continue
+                # Return nothing since we did not retry
+                messages, page_start_timestamp, page_end_timestamp = [], None, None
 
-        # Create a timestamp label for messages
-        if direction == DIRECTION_OLDER:
-            timestamp_label = f'before {start_timestamp}'
-        else:
-            timestamp_label = f'after {end_timestamp}'
+            # Make sure the timestamps are actually set (if get_messages returns none for them, use the last values)
+            start_timestamp = page_start_timestamp or start_timestamp
+            end_timestamp = page_end_timestamp or end_timestamp
+            cursors[channel_id] = (start_timestamp, end_timestamp)
+
+            # Create a timestamp label for messages
+            if direction == DIRECTION_OLDER:
+                timestamp_label = f'before {start_timestamp}'
+            else:
+                timestamp_label = f'after {end_timestamp}'
 
-        # Make sure there are messages to process
-        if not messages:
-            print(f'No new messages found {timestamp_label}, exiting')
-            break
+            # Make sure there are messages to process, the other channels are continued without this one
+            if not messages:
+                active_channel_ids.remove(channel_id)
+                prefetchers.pop(channel_id).stop()
+                print(f'No new messages found in {channel_label} {timestamp_label}'
+                      f'{", exiting" if not active_channel_ids else ""}')
+                continue
+
+            # Classify the next batch
+            print(f'Retrieved new batch of {len(messages)} message{"s" if len(messages) > 1 else ""} '
+                  f'in {channel_label} ({timestamp_label})')
+            if nlp is not None:
+                messages = order_by_confidence(messages, predictions)
+            with run_instrumentation.span('label'):
+                added, updated = classify_batch(
+                    messages, data, all_labels, ignore_user_ids=ignore_user_ids, duplicate_index=duplicate_index,
+                    predictions=predictions, auto_accept=auto_accept,
+                )
+            run_instrumentation.count('messages', len(messages))
+            run_instrumentation.count('classified', len(added) + len(updated))
+            for message in messages:
+                predictions.pop(get_message_id(message), None)
+            for message_id, classification in {**added, **updated}.items():
+                classification['channel'] = channel_id
+                data[message_id] = classification
 
-        # Classify the next batch
-        print(f'Retrieved new batch of {len(messages)} message{"s" if len(messages) > 1 else ""} ({timestamp_label})')
-        added, updated = classify_batch(messages, data, all_labels, ignore_user_ids=ignore_user_ids)
-        for message_id, classification in added.items():
-            data[message_id] = classification
-        for message_id, classification in updated.items():
-            data[message_id] = classification
+            # Save each batch as it is confirmed so that nothing is lost if the session is interrupted
+            with run_instrumentation.span('write'):
+                if data_file:
+                    write_data({**added, **updated}, start_timestamp, end_timestamp, data_file,
+                               channel_id=channel_id, channel_name=channel_names.get(channel_id))
+                if duplicate_index is not None:
+                    duplicate_index.update({**added, **updated})
+                    duplicate_index.save()
 
-        # Continue?
-        if not inquirer.confirm(f'{len(data)} total messages classified, continue to the next batch of messages?',
-                                default=True, render=INQUIRER_RENDER):
-            done = True
+            # Continue?
+            if not inquirer.confirm(f'{len(data)} total messages classified, continue to the next batch of messages?',
+                                    default=True, render=get_inquirer_render()):
+                break
+            index = active_channel_ids.index(channel_id) + 1
+    finally:
+        for prefetcher in prefetchers.values():
+            prefetcher.stop()
 
-    return start_timestamp, end_timestamp
+    return cursors
 
 
 def load_data(data_file: str, append: bool = True) -> Tuple[dict, Optional[str], Optional[str]]:
     print(f'Using data file at {data_file}')
-    if not os.path.exists(data_file):
+    store = storage.get_store(data_file)
+    if not store.exists():
         return {}, None, None
 
     if not append:
@@ -256,33 +493,90 @@ def load_data(data_file: str, append: bool = True) -> Tuple[dict, Optional[str],
             f'The data file ({data_file}) exists and append is disabled, please specify another data file'
         )
 
-    # Load existing data
-    with open(data_file, 'r') as fobj:
-        data_file = json.loads(fobj.read())
-        if not data_file:
-            raise Exception(f'The existing data file ({data_file}) is invalid, please check the file')
-        data = data_file.get('data', {})
-        print(f'Found {len(data)} total entries stored in the data file')
-        return data, data_file.get('start_timestamp'), data_file.get('end_timestamp')
+    # Load existing data, replaying any changes journaled since the last compaction
+    data, start_timestamp, end_timestamp = store.load()
+    print(f'Found {len(data)} total entries stored in the data file')
+    return data, start_timestamp, end_timestamp
+
+
+def write_data(classifications: Dict[str, dict], start_timestamp: Optional[str], end_timestamp: Optional[str],
+               data_file: str, channel_id: Optional[str] = None, channel_name: Optional[str] = None):
+    """
+    Appends new or updated classifications and the current timestamps to the data file's journal.
+    :param classifications: Only the classifications that were added or updated, keyed by message ID
+    :param channel_id: If set, the timestamps are the ones reached in this channel
+    :param channel_name: The name of the channel, kept along with its timestamps
+    """
+    storage.get_store(data_file).append(
+        classifications, start_timestamp, end_timestamp, channel_id=channel_id, channel_name=channel_name
+    )
+    print(f'Successfully wrote data to {data_file}')
+
+
+def get_channel_cursors(data_file: str, channel_ids: List[str]) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """
+    Retrieves the start and end timestamps reached in each channel. Data files classified before the timestamps were
+    kept per channel only have the timestamps of the data file, which are used when classifying a single channel.
+    :return: The start and end timestamps by channel ID, None for channels that were not classified yet
+    """
+    store = storage.get_store(data_file)
+    if store.exists() and not store.loaded:
+        store.load()
+    if not store.channels and len(channel_ids) == 1:
+        return {channel_ids[0]: (store.start_timestamp, store.end_timestamp)}
+    return {
+        channel_id: (store.channels.get(channel_id, {}).get('start_timestamp'),
+                     store.channels.get(channel_id, {}).get('end_timestamp'))
+        for channel_id in channel_ids
+    }
+
+
+def get_data_channel_ids(data_file: str, channels: Iterable[str]) -> Set[str]:
+    """
+    Resolves channels to the IDs entries are tagged with, using the names of the channels classified into the data
+    file. Channels that are not known by name are assumed to be IDs.
+    """
+    store = storage.get_store(data_file)
+    if store.exists() and not store.loaded:
+        store.load()
+    ids_by_name = {channel['name']: channel_id for channel_id, channel in store.channels.items() if channel.get('name')}
+    return {ids_by_name.get(channel.lstrip('#'), channel) for channel in channels}
 
 
-def write_data(data: Dict[str, dict], start_timestamp: Optional[str], end_timestamp: Optional[str], data_file: str):
-    # Make the directory start
-    dir_path = os.path.dirname(data_file)
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
+def get_channel_weights(data_file: str, channel_weights: Optional[List[str]]) -> Dict[str, int]:
+    """
+    Parses CHANNEL=WEIGHT values into the number of times to repeat the entries of each channel when training.
+    :return: The weights by channel ID
+    """
+    weights = {}
+    for channel_weight in channel_weights or []:
+        channel, _, weight = channel_weight.rpartition('=')
+        if not channel or not weight.isdigit() or int(weight) < 1:
+            raise Exception(f'Invalid channel weight "{channel_weight}", it should look like CHANNEL=WEIGHT with a '
+                            f'whole number weight of at least 1')
+        channel_id, = get_data_channel_ids(data_file, [channel])
+        weights[channel_id] = int(weight)
+    return weights
 
-    # Write out the new file
-    with open(data_file, 'w') as fobj:
-        fobj.write(json.dumps({
-            'data': data,
-            'start_timestamp': start_timestamp,
-            'end_timestamp': end_timestamp,
-        }, indent=2))
-        print(f'Successfully wrote data to {data_file}')
 
-    # Copy the result file to a file versioned with a timestamp
-    shutil.copy(data_file, f'{data_file}.{time.time()}')
+def read_test_file(test_file: str) -> Iterator[Tuple[str, str]]:
+    """
+    Lazily reads a tab-separated test file, skipping commented lines.
+    :return: Iterator of (text, expected label) tuples
+    """
+    with open(test_file, 'r') as fobj:
+        for i, line in enumerate(fobj):
+            line = line.rstrip('\r\n')
+            # Ignore commented lines
+            if line.strip().startswith('#'):
+                continue
+            elems = line.split('\t')
+            if len(elems) != 2:
+                raise Exception(
+                    f'Line {i + 1} of {test_file} is invalid, '
+                    f'it should contain two tab-separated values, but has {len(elems)}'
+                )
+            yield elems[0], elems[1]
 
 
 def test_model(args):
@@ -294,28 +588,23 @@ def test_model(args):
         raise Exception(f'The file "{args.test_text_or_file}" does not exist, please check file name')
 
     print(f'Loading model from {args.model_dir}')
+    from . import instrumentation, training
 
     has_failures = False
-    if args.is_file:
-        print(f'Reading {args.test_text_or_file} as a tab-separated file')
-        with open(args.test_text_or_file, 'r') as fobj:
-            file_contents = fobj.read()
-        for i, line in enumerate(file_contents.splitlines()):
-            # Ignore commented lines
-            if line.strip().startswith('#'):
-                continue
-            elems = line.split('\t')
-            if len(elems) != 2:
-                raise Exception(
-                    f'Line {i + 1} of {args.test_text_or_file} is invalid, '
-                    f'it should contain two tab-separated values, but has {len(elems)}'
-                )
-            if not training.test_textcat_model(args.model_dir, elems[0], elems[1]):
+    with instrumentation.instrument(args.metrics_file, args.profile_file, command='test') as run_instrumentation:
+        if args.is_file:
+            print(f'Reading {args.test_text_or_file} as a tab-separated file')
+            _, failures = training.test_textcat_model_batch(
+                args.model_dir, read_test_file(args.test_text_or_file), batch_size=args.batch_size,
+                n_process=args.n_process, instrumentation=run_instrumentation,
+            )
+            if failures:
+                has_failures = True
+        else:
+            print(f'Testing text "{args.test_text_or_file}"')
+            if not training.test_textcat_model(args.model_dir, args.test_text_or_file, args.expected_label,
+                                               instrumentation=run_instrumentation):
                 has_failures = True
-    else:
-        print(f'Testing text "{args.test_text_or_file}"')
-        if not training.test_textcat_model(args.model_dir, args.test_text_or_file, args.expected_label):
-            has_failures = True
 
     if has_failures:
         raise Exception('Encountered verification errors, please see above')
@@ -323,39 +612,353 @@ def test_model(args):
         print(f'All tests passed successfully')
 
     
+def serve(args):
+    if not args.model_dir:
+        raise Exception('The model dir was not specified, please try again')
+    if not os.path.exists(args.model_dir):
+        raise Exception(f'The model dir "{args.model_dir}" does not exist, please train a model first')
+
+    print(f'Loading model from {args.model_dir}')
+    from . import server
+    server.ModelServer(
+        args.model_dir, host=args.host, port=args.port, socket_path=args.socket_path,
+        max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+        reload_interval=args.reload_interval or None,
+    ).serve_forever()
+
+
+def compact_model(args):
+    if not args.model_dir or not os.path.isdir(args.model_dir):
+        raise Exception(f'The model dir "{args.model_dir}" does not exist, please train a model first')
+
+    from . import compact
+    model_file = args.model_file or f'{args.model_dir.rstrip(os.sep)}{compact.FILE_SUFFIX}'
+    texts = []
+    expected_labels = []
+    if args.sample_size and storage.get_store(args.data_file).exists():
+        data, _, _ = load_data(args.data_file)
+        message_ids = sorted(data)
+        if len(message_ids) > args.sample_size:
+            message_ids = random.Random(0).sample(message_ids, args.sample_size)
+        texts = [data[message_id]['text'] for message_id in message_ids]
+        expected_labels = [data[message_id]['label'] for message_id in message_ids]
+
+    print(f'Exporting {args.model_dir} to {model_file}, comparing both models on {len(texts)} entries')
+    report = compact.export_compact_model(
+        args.model_dir, model_file, precision=args.precision, texts=texts, expected_labels=expected_labels,
+        max_accuracy_loss=args.max_accuracy_loss,
+    )
+    compact.print_report(report)
+    report_file = f'{model_file}{compact.REPORT_SUFFIX}'
+    with open(report_file, 'w') as fobj:
+        fobj.write(json.dumps(report, indent=2))
+    print(f'Wrote the report to {report_file}')
+
+
+def review_flagged(flagged_entries: List[dict], data: Dict[str, dict], data_file: str,
+                   start_timestamp: Optional[str], end_timestamp: Optional[str], batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    Prompts for the label of entries flagged by an audit, proposing the predicted label. The changed labels are
+    written to the data file after every batch.
+    :param flagged_entries: The flagged entries of an audit report, with the message ID and predicted label and score
+    """
+    import inquirer
+    all_labels = get_data_labels(data)
+    flagged_entries = [entry for entry in flagged_entries if entry['id'] in data]
+    for batch_start in range(0, len(flagged_entries), batch_size):
+        batch = flagged_entries[batch_start:batch_start + batch_size]
+        while True:
+            updated = {}
+            for i, entry in enumerate(batch):
+                classification = data[entry['id']]
+                print(f'{batch_start + i + 1}/{len(flagged_entries)} {classification["text"]}')
+                print(f'Labeled {classification["label"]}, predicted label {entry["predicted"]} ({entry["score"]:.0%})')
+                label = get_label(all_labels, default=entry['predicted'])
+                if label != classification['label']:
+                    updated[entry['id']] = dict(classification, label=label)
+            print('--------------------------------------Summary----------------------------------------')
+            if updated:
+                print(f'Updated {len(updated)} existing classification(s):')
+                print_classification_entries(updated)
+            else:
+                print('No classification entries changed')
+            if inquirer.confirm('Are the above entries correct?', default=True, render=get_inquirer_render()):
+                break
+        if updated:
+            data.update(updated)
+            write_data(updated, start_timestamp, end_timestamp, data_file)
+
+
+def audit_data(args):
+    if not args.model_dir or not os.path.exists(args.model_dir):
+        raise Exception(f'The model "{args.model_dir}" does not exist, please train a model first')
+
+    from . import audit, instrumentation, training
+    data, start_timestamp, end_timestamp = load_data(args.data_file)
+    if not data:
+        raise Exception(f'The data file {args.data_file} has no entries to audit')
+    report_file = args.report_file or f'{args.data_file}{audit.REPORT_SUFFIX}'
+
+    print(f'Loading model from {args.model_dir}')
+    with instrumentation.instrument(args.metrics_file, args.profile_file, command='audit') as run_instrumentation:
+        with run_instrumentation.span('load_model'):
+            nlp = training.load_model(args.model_dir)
+        with run_instrumentation.span('score'):
+            report = audit.audit_scores(
+                audit.score_entries(nlp, data, batch_size=args.batch_size, n_process=args.n_process),
+                confidence=args.confidence, max_flagged=args.max_flagged or None,
+            )
+        run_instrumentation.count('entries', len(data))
+        run_instrumentation.count('flagged', report['flagged'])
+    report['model_dir'] = args.model_dir
+    audit.print_report(report, data)
+    audit.write_report(report, report_file)
+    print(f'Wrote the report to {report_file}')
+
+    if args.review and report['flagged_entries']:
+        review_flagged(report['flagged_entries'], data, args.data_file, start_timestamp, end_timestamp)
+
+
+def split_training_ids(ids: List[str], eval_percentage: int, seed: Optional[int] = None) -> \
+        Tuple[List[str], List[str]]:
+    """
+    Randomly splits the message IDs of the classified data into training and evaluation IDs.
+    :param seed: If set, the IDs are always split the same way for the same seed
+    """
+    limit = len(ids)
+    train_limit = limit - int(limit * (eval_percentage / 100))
+    print(f'Training data with {train_limit} entries and evaluating with {limit - train_limit} entries '
+          f'({eval_percentage}%)')
+    # Randomize the list
+    ids = list(ids)
+    random.Random(seed).shuffle(ids)
+    return ids[:train_limit], ids[train_limit:]
+
+
+def split_training_data(labeled_data: 'dataset.LabeledDataset', eval_percentage: int, seed: Optional[int] = None) -> \
+        Tuple['dataset.LabeledExamples', 'dataset.LabeledExamples']:
+    """
+    Randomly splits the classified data into training and evaluation data.
+    :param seed: If set, the data is always split the same way for the same seed
+    """
+    train_ids, eval_ids = split_training_ids(labeled_data.ids, eval_percentage, seed=seed)
+    return labeled_data.examples(train_ids), labeled_data.examples(eval_ids)
+
+
+def get_training_data(data_file: str, channels: Optional[List[str]] = None) -> \
+        Tuple[Dict[str, dict], 'dataset.LabeledDataset']:
+    """
+    Loads the classified data and indexes it for training.
+    :param channels: If set, only the entries classified from these channels (names or IDs) are used
+    :return: Tuple of the classified data and the indexed data
+    """
+    from . import dataset
+    data, _, _ = load_data(data_file)
+    if channels:
+        channel_ids = get_data_channel_ids(data_file, channels)
+        data = {key: entry for key, entry in data.items() if entry.get('channel') in channel_ids}
+        print(f'Using the {len(data)} entries classified from {", ".join(sorted(channels))}')
+    labeled_data = dataset.LabeledDataset.from_data(data)
+    print('Entries per label: ' + ', '.join(
+        f'{label} ({count})' for label, count in sorted(labeled_data.label_counts().items())
+    ))
+    return data, labeled_data
+
+
+def get_incremental_ids(data: Dict[str, dict], trained_entries: Dict[str, str], rehearsal_ratio: float,
+                        seed: Optional[int] = None) -> Tuple[List[str], List[str]]:
+    """
+    Finds the entries to train a model further on, the entries that were added or changed since it was trained along
+    with a random sample of the entries it was already trained on so that it does not forget them.
+    :param trained_entries: Dict of the message IDs the model was trained on to the hash of their text and label
+    :param rehearsal_ratio: The number of already trained entries to sample per new entry
+    :return: Tuple of the new message IDs and the sampled already trained message IDs
+    """
+    from . import training
+    new_ids = []
+    old_ids = []
+    for message_id, classification in data.items():
+        if trained_entries.get(message_id) == training.get_entry_hash(classification['text'],
+                                                                      classification['label']):
+            old_ids.append(message_id)
+        else:
+            new_ids.append(message_id)
+    rehearsal_count = min(len(old_ids), int(len(new_ids) * rehearsal_ratio))
+    return new_ids, random.Random(seed).sample(old_ids, rehearsal_count)
+
+
+def get_doc_cache_dir(args) -> Optional[str]:
+    # Keep the tokenized texts next to the data file unless disabled
+    return None if args.no_doc_cache else os.path.join(os.path.dirname(args.data_file), DOC_CACHE_DIR_NAME)
+
+
+def get_duplicate_index(data: Dict[str, dict], data_file: str, save: bool = True) -> 'duplicates.DuplicateIndex':
+    """
+    Loads the near-duplicate index kept next to the data file, indexing any entries that are new or changed.
+    :param save: If false, the index is only updated in memory, for data that does not hold every entry of the data
+    file (e.g. only the entries of some channels), as saving it would drop the other entries from the index
+    """
+    from . import duplicates
+    duplicate_index = duplicates.DuplicateIndex(duplicates.get_index_file(data_file))
+    indexed = duplicate_index.sync(data)
+    if indexed:
+        print(f'Indexed {indexed} entries for near-duplicates')
+    if save:
+        duplicate_index.save()
+    return duplicate_index
+
+
+def collapse_duplicates(data: Dict[str, dict], data_file: str, ids: List[str], weighting: str,
+                        save_index: bool = True) -> Tuple[List[str], Dict[str, int], Dict[str, List[str]]]:
+    """
+    Collapses the near-duplicates of the entries to train on into one entry per cluster and label.
+    :param save_index: If false, the near-duplicate index is not saved, see get_duplicate_index
+    :return: The same tuple as duplicates.collapse
+    """
+    from . import duplicates
+    kept, weights, members = duplicates.collapse(get_duplicate_index(data, data_file, save=save_index).clusters(ids),
+                                                 data, weighting=weighting)
+    print(f'Collapsed {len(ids)} entries into {len(kept)} entries without near-duplicates')
+    return kept, weights, members
+
+
 def train(args):
     if not args.output_dir:
         raise Exception('The output dir was not specified, please try again')
 
-    data, _, _ = load_data(args.data_file)
-    labels = set(data[key]['label'] for key in data)
-
-    def get_labels(true_label: str) -> Dict[str, bool]:
-        nonlocal labels
-        result = {}
-        for label in labels:
-            result[label] = true_label == label
-        return result
-
-    def data_func() -> Tuple[
-        List[Tuple[Any, Dict[str, Dict[str, bool]]]], List[Tuple[Any, Dict[str, Dict[str, bool]]]]
-    ]:
-        nonlocal data
-        limit = len(data)
-        train_limit = int(limit * (args.eval_percentage / 100))
-        print(f'Training data with {train_limit} entries and evaluating with {limit - train_limit} entries '
-              f'({args.eval_percentage}%)')
-        tuple_data = []
-        for _, classification in data.items():
-            tuple_data.append(
-                (classification['text'], {'cats': get_labels(classification['label'])})
+    from . import instrumentation
+    # Cross validation does not save a model to write the metrics next to
+    metrics_file = args.metrics_file or (
+        None if args.folds else os.path.join(args.output_dir, instrumentation.METRICS_FILE_NAME)
+    )
+    with instrumentation.instrument(metrics_file, args.profile_file, command='train') as run_instrumentation:
+        train_model(args, run_instrumentation)
+
+
+def train_model(args, run_instrumentation: 'instrumentation.Instrumentation'):
+    with run_instrumentation.span('read_data'):
+        data, labeled_data = get_training_data(args.data_file, args.channels)
+    labels = set(labeled_data.get_labels())
+    channel_weights = get_channel_weights(args.data_file, args.channel_weights)
+
+    if args.folds:
+        if args.incremental:
+            raise Exception('Cross validation trains new models, it can not be combined with incremental training')
+        if channel_weights:
+            raise Exception('Cross validation evaluates the data as it is, it can not be combined with channel weights')
+        fold_ids = list(data)
+        if args.dedup:
+            # Near-duplicates in different folds would inflate the scores
+            with run_instrumentation.span('dedup'):
+                fold_ids, _, _ = collapse_duplicates(
+                    data, args.data_file, fold_ids, args.dedup_weighting, save_index=not args.channels
+                )
+        # Only evaluate how well a model trains on the data, no model is saved
+        from . import crossvalidation
+        with run_instrumentation.span('cross_validation'):
+            crossvalidation.run_cross_validation(
+                labeled_data.examples(fold_ids), labels, args.folds, doc_cache_dir=get_doc_cache_dir(args),
+                seed=args.seed, workers=args.workers, n_iter=args.epochs, patience=args.patience,
+            )
+        return
+
+    from . import training
+    model = None
+    train_ids = list(data)
+    trained_entries = {}
+    manifest_labels = set(labels)
+    eval_ids = None
+    if args.incremental:
+        manifest = training.load_manifest(args.output_dir)
+        if manifest is None:
+            print(f'There is no model with a manifest in {args.output_dir} to train further, training a new model')
+        elif labels.difference(manifest['labels']):
+            # The output layer of a trained text classifier can not be resized for new labels
+            print(f'The labels {", ".join(sorted(labels.difference(manifest["labels"])))} are not known to the model '
+                  f'in {args.output_dir}, training a new model')
+        else:
+            model = args.output_dir
+            # Entries that changed keep their old hash, so they are still new next time if they aren't trained now
+            trained_entries = manifest['entries']
+            # Evaluate on the entries held out when the model was first trained rather than on a share of the new
+            # entries, which are often too few to hold any out
+            eval_ids = [key for key in manifest.get('eval_entries', []) if key in data]
+            if not eval_ids:
+                # Older manifests do not list the held out entries, so a share of the whole data file is held out
+                print(f'Holding out {args.eval_percentage}% of the data file for evaluation')
+                _, eval_ids = split_training_ids(list(data), args.eval_percentage, seed=args.seed)
+            held_out = set(eval_ids)
+            new_ids, rehearsal_ids = get_incremental_ids(
+                {key: entry for key, entry in data.items() if key not in held_out}, trained_entries, args.rehearsal,
+                seed=args.seed,
             )
-        # Randomize the list
-        random.shuffle(tuple_data)
-        return tuple_data[:train_limit], tuple_data[train_limit:]
+            if not new_ids:
+                print('No entries were added or changed since the model was trained, there is nothing to train')
+                return
+            manifest_labels.update(manifest['labels'])
+            print(f'Training the model further with {len(new_ids)} new or changed entries and {len(rehearsal_ids)} '
+                  f'already trained entries')
+            train_ids = new_ids + rehearsal_ids
+
+    weights = {}
+    members = {}
+    if args.dedup:
+        with run_instrumentation.span('dedup'):
+            # The data of some channels only does not hold every entry of the index
+            train_ids, weights, members = collapse_duplicates(
+                data, args.data_file, train_ids, args.dedup_weighting, save_index=not args.channels
+            )
+
+    trained_ids = []
+    held_out_ids = []
+
+    def data_func() -> Tuple['dataset.LabeledExamples', 'dataset.LabeledExamples']:
+        if eval_ids is None:
+            train_split, eval_split = split_training_ids(train_ids, args.eval_percentage, seed=args.seed)
+        else:
+            train_split, eval_split = train_ids, eval_ids
+        # A collapsed entry also stands for its near-duplicates
+        trained_ids.extend(key for kept_id in train_split for key in members.get(kept_id, [kept_id]))
+        held_out_ids.extend(key for kept_id in eval_split for key in members.get(kept_id, [kept_id]))
+        # Weighted entries are repeated after splitting, so that the same entry is never also evaluated
+        weighted_split = [
+            kept_id for kept_id in train_split
+            for _ in range(weights.get(kept_id, 1) * channel_weights.get(data[kept_id].get('channel'), 1))
+        ]
+        return labeled_data.examples(weighted_split), labeled_data.examples(eval_split)
 
     training.train_textcat_model(
-        load_data_func=data_func, output_dir=args.output_dir, labels=labels, test_text=args.test_text
+        load_data_func=data_func, model=model, output_dir=args.output_dir, labels=labels, test_text=args.test_text,
+        doc_cache_dir=get_doc_cache_dir(args), n_iter=args.epochs, patience=args.patience, seed=args.seed,
+        instrumentation=run_instrumentation,
+    )
+
+    # Record what the model was trained on for the next incremental run
+    with run_instrumentation.span('write_manifest'):
+        for key in trained_ids:
+            trained_entries[key] = training.get_entry_hash(data[key]['text'], data[key]['label'])
+        training.write_manifest(args.output_dir, trained_entries, manifest_labels, eval_ids=held_out_ids)
+
+
+def sweep(args):
+    if not args.output_dir:
+        raise Exception('The output dir was not specified, please try again')
+
+    from . import hyperparameters
+    if args.space_file:
+        with open(args.space_file, 'r') as fobj:
+            space = json.loads(fobj.read())
+    else:
+        space = hyperparameters.DEFAULT_SPACE
+    candidates = hyperparameters.get_candidates(space, random_count=args.random_count, seed=args.seed)
+
+    _, labeled_data = get_training_data(args.data_file)
+    labels = set(labeled_data.get_labels())
+    # Every candidate is trained and evaluated on the same split
+    train_data, eval_data = split_training_data(labeled_data, args.eval_percentage, seed=args.seed)
+    hyperparameters.run_sweep(
+        candidates, train_data, eval_data, labels, args.output_dir, doc_cache_dir=get_doc_cache_dir(args),
+        patience=args.patience, seed=args.seed, workers=args.workers,
     )
 
 
@@ -383,7 +986,109 @@ def classify_single(args):
 
     # Set the data and write it out
     data[message_id] = classification
-    write_data(data, start_timestamp, end_timestamp, args.data_file)
+    write_data({message_id: classification}, start_timestamp, end_timestamp, args.data_file)
+
+
+def get_classify_channel_id(args, slack_channel: str, message_source: Optional[MessageSource] = None) -> str:
+    from . import export
+    if isinstance(message_source, export.SlackExport):
+        # Entries are tagged with the same ID as when the channel is read from slack or a mirror, the export reads the
+        # channel by its ID too. Exports without a channels.json file only know the channel by its name.
+        channel_name = slack_channel.lstrip('#')
+        return message_source.find_channel_id(channel_name) or channel_name
+    if args.channel_is_id:
+        return slack_channel
+    if message_source:
+        channel_id = message_source.find_channel_id(slack_channel)
+        if not channel_id:
+            raise Exception(f'The channel {slack_channel} has not been synced to {message_source.mirror_file}')
+        return channel_id
+    from . import slack
+    return slack.get_channel_id(args.slack_token, slack_channel)
+
+
+def get_classify_channels(args, message_source: Optional[MessageSource] = None) -> Dict[str, Optional[str]]:
+    """
+    Resolves the slack channels of the command line to their IDs.
+    :return: The name of each channel by ID, None if the channels were given by ID
+    """
+    return {
+        get_classify_channel_id(args, slack_channel, message_source):
+            None if args.channel_is_id else slack_channel.lstrip('#')
+        for slack_channel in args.slack_channels
+    }
+
+
+def sync(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from . import mirror, slack
+    with mirror.MessageMirror(args.mirror_file) as message_mirror:
+        # All requests share one pooled session, which is closed at the end of the run
+        try:
+            channels = get_classify_channels(args)
+            for channel_id, channel_name in channels.items():
+                message_mirror.add_channel(channel_id, channel_name)
+            channel_labels = [
+                f'{channel_name or channel_id} ({channel_id})' for channel_id, channel_name in channels.items()
+            ]
+            print(f'Syncing {", ".join(channel_labels)} to {args.mirror_file}')
+            # The channels are synced at the same time, without using more connections than the session keeps
+            with ThreadPoolExecutor(max_workers=min(len(channels), slack.DEFAULT_POOL_SIZE)) as executor:
+                retrieved = dict(zip(channels, executor.map(
+                    lambda channel_id: slack.sync_channel(
+                        args.slack_token, channel_id, message_mirror, page_size=args.page_size,
+                        thread_workers=args.thread_workers,
+                    ),
+                    channels
+                )))
+        finally:
+            slack.close_session()
+        for channel_id, channel_retrieved in retrieved.items():
+            print(f'Retrieved {channel_retrieved} message(s) from {channels[channel_id] or channel_id}, '
+                  f'{message_mirror.count(channel_id)} total messages are synced')
+
+
+def import_export(args):
+    # Parse ignore user ids from comma-separated list
+    if args.ignore_user_ids:
+        ignore_user_ids = set(args.ignore_user_ids.split(','))
+    else:
+        ignore_user_ids = None
+
+    from . import export, mirror
+    with export.SlackExport(args.export_file) as slack_export, mirror.MessageMirror(args.mirror_file) as message_mirror:
+        channel_name = args.slack_channel.lstrip('#')
+        channel_id = slack_export.find_channel_id(channel_name) or channel_name
+        message_mirror.add_channel(channel_id, channel_name)
+        print(f'Importing channel {channel_name} ({channel_id}) from {args.export_file} to {args.mirror_file}')
+
+        imported = 0
+        skipped = 0
+        oldest_ts = None
+        newest_ts = None
+        chunk = []
+        # Stream the export from the oldest message, storing it in chunks to keep memory bounded
+        for message in slack_export.iter_messages(channel_name, DIRECTION_NEWER):
+            if get_skip_reason(message, ignore_user_ids):
+                skipped += 1
+                continue
+            chunk.append(message)
+            oldest_ts = oldest_ts or message['ts']
+            newest_ts = message['ts']
+            if len(chunk) >= DEFAULT_IMPORT_CHUNK_SIZE:
+                imported += message_mirror.add_messages(channel_id, chunk)
+                chunk = []
+                print(f'Imported {imported} message(s)')
+        imported += message_mirror.add_messages(channel_id, chunk)
+
+        # The export holds the channel from its start, so a sync only needs to retrieve newer messages afterwards
+        synced_oldest_ts, synced_newest_ts, _ = message_mirror.get_sync_state(channel_id)
+        if newest_ts and (not synced_oldest_ts or synced_oldest_ts <= newest_ts):
+            message_mirror.set_sync_state(
+                channel_id, oldest_ts, max(newest_ts, synced_newest_ts or newest_ts), True
+            )
+        print(f'Imported {imported} message(s) and skipped {skipped} message(s), '
+              f'{message_mirror.count(channel_id)} total messages are stored')
 
 
 def classify(args):
@@ -393,18 +1098,58 @@ def classify(args):
     else:
         ignore_user_ids = None
 
-    # with Session() as session:
-    channel_id = get_channel_id(args.slack_token, args.slack_channel)
-    data, start_timestamp, end_timestamp = load_data(args.data_file, args.append)
-    start_timestamp, end_timestamp = classify_messages(
-        args.slack_token,
-        channel_id,
-        data,
-        # Override the timestamps to use if specified
-        args.start_timestamp or start_timestamp,
-        args.end_timestamp or end_timestamp,
-        args.direction,
-        ignore_user_ids=ignore_user_ids,
-        batch_size=args.batch_size,
-    )
-    write_data(data, start_timestamp, end_timestamp, args.data_file)
+    if args.mirror_file and args.export_file:
+        raise Exception('Only one of a mirror or a slack export may be used to classify messages')
+    if args.auto_accept is not None and not args.assist_model_dir:
+        raise Exception('Auto-accepting predicted labels requires a model to predict them with --assist')
+    if args.thread_workers and (args.mirror_file or args.export_file):
+        raise Exception('Thread replies are only retrieved from slack, sync the mirror with --threads to include them '
+                        'in it, slack exports already include them')
+    from . import export, instrumentation, mirror
+    if args.export_file:
+        message_source = export.SlackExport(args.export_file)
+    elif args.mirror_file:
+        message_source = mirror.MessageMirror(args.mirror_file)
+    else:
+        message_source = None
+    # All requests share one pooled session, which is closed at the end of the run
+    try:
+        with instrumentation.instrument(
+                args.metrics_file, args.profile_file, command='classify'
+        ) as run_instrumentation:
+            with run_instrumentation.span('channel_id'):
+                channel_names = get_classify_channels(args, message_source)
+            with run_instrumentation.span('read_data'):
+                data, _, _ = load_data(args.data_file, args.append)
+                duplicate_index = None if args.no_duplicates else get_duplicate_index(data, args.data_file)
+            cursors = classify_messages(
+                args.slack_token,
+                {
+                    # Override the timestamps to use if specified
+                    channel_id: (args.start_timestamp or start_timestamp, args.end_timestamp or end_timestamp)
+                    for channel_id, (start_timestamp, end_timestamp)
+                    in get_channel_cursors(args.data_file, list(channel_names)).items()
+                },
+                data,
+                args.direction,
+                ignore_user_ids=ignore_user_ids,
+                batch_size=args.batch_size,
+                data_file=args.data_file,
+                prefetch_pages=args.prefetch_pages,
+                message_source=message_source,
+                duplicate_index=duplicate_index,
+                model_dir=args.assist_model_dir,
+                auto_accept=args.auto_accept,
+                run_instrumentation=run_instrumentation,
+                thread_workers=args.thread_workers,
+                channel_names=channel_names,
+            )
+            for channel_id, (start_timestamp, end_timestamp) in cursors.items():
+                write_data({}, start_timestamp, end_timestamp, args.data_file, channel_id=channel_id,
+                           channel_name=channel_names[channel_id])
+    finally:
+        if message_source:
+            message_source.close()
+        else:
+            from . import slack
+            slack.close_session()
@@ -0,0 +1,118 @@
+
+import heapq
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+REPORT_SUFFIX = '.audit.json'
+DEFAULT_CONFIDENCE = 0.8
+DEFAULT_BATCH_SIZE = 256
+# The number of entries scored between progress updates
+DEFAULT_CHUNK_SIZE = 10000
+# Only the flagged entries with the largest margins are kept, so that auditing a badly labeled data file still uses
+# bounded memory
+DEFAULT_MAX_FLAGGED = 1000
+DEFAULT_PRINT_FLAGGED = 20
+
+
+def score_entries(nlp, data: Dict[str, dict], batch_size: int = DEFAULT_BATCH_SIZE, n_process: int = 1,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[str, str, Dict[str, float]]]:
+    """
+    Scores the text of every entry with the model. The texts are streamed through the model, so only the batches being
+    scored are held in memory, and the progress is printed after every chunk of entries.
+    :param data: The classified data, a dict of message IDs to classifications with a text and a label
+    :param n_process: The number of processes to use for scoring, 1 scores in the current process
+    :return: Iterator of the message ID, the stored label and the category scores of each entry
+    """
+    entries = ((classification['text'], message_id) for message_id, classification in data.items())
+    start_time = time.perf_counter()
+    scored = 0
+    for doc, message_id in nlp.pipe(entries, as_tuples=True, batch_size=batch_size, n_process=n_process):
+        yield message_id, data[message_id]['label'], doc.cats
+        scored += 1
+        if scored % chunk_size == 0 or scored == len(data):
+            elapsed = time.perf_counter() - start_time
+            print(f'Scored {scored}/{len(data)} entries ({scored / elapsed if elapsed > 0 else 0.0:.1f} entries/s)')
+
+
+def audit_scores(scores: Iterable[Tuple[str, str, Dict[str, float]]], confidence: float = DEFAULT_CONFIDENCE,
+                 max_flagged: Optional[int] = DEFAULT_MAX_FLAGGED) -> Dict[str, Any]:
+    """
+    Compares the stored label of each entry with the label the model predicts. An entry is flagged when the model
+    predicts another label with a score of at least the confidence, the margin being how much higher the predicted
+    label scores than the stored one.
+    :param scores: The message ID, the stored label and the category scores of each entry, see score_entries
+    :param max_flagged: If set, only this many flagged entries with the largest margins are listed
+    :return: The report, with the counts of entries, disagreements (any other best label) and flagged entries both in
+    total and per label, and the flagged entries sorted by descending margin. Entries with a label the model does not
+    know are only counted as unscored.
+    """
+    labels: Dict[str, Dict[str, Any]] = {}
+    flagged: List[Tuple[float, int, Dict[str, Any]]] = []
+    unscored = 0
+    for index, (message_id, label, cats) in enumerate(scores):
+        if label not in cats:
+            unscored += 1
+            continue
+        stats = labels.setdefault(label, {'entries': 0, 'disagreements': 0, 'flagged': 0})
+        stats['entries'] += 1
+        predicted = max(cats, key=cats.get)
+        if predicted == label:
+            continue
+        stats['disagreements'] += 1
+        score = float(cats[predicted])
+        if score < confidence:
+            continue
+        stats['flagged'] += 1
+        margin = score - float(cats[label])
+        entry = {'id': message_id, 'label': label, 'predicted': predicted, 'score': score,
+                 'label_score': float(cats[label]), 'margin': margin}
+        # The heap keeps the largest margins, ties keep the entries scored first
+        item = (margin, -index, entry)
+        if max_flagged is None or len(flagged) < max_flagged:
+            heapq.heappush(flagged, item)
+        elif item[:2] > flagged[0][:2]:
+            heapq.heapreplace(flagged, item)
+
+    for stats in labels.values():
+        stats['disagreement_rate'] = stats['disagreements'] / stats['entries']
+        stats['flagged_rate'] = stats['flagged'] / stats['entries']
+    return {
+        'confidence': confidence,
+        'entries': sum(stats['entries'] for stats in labels.values()),
+        'unscored': unscored,
+        'disagreements': sum(stats['disagreements'] for stats in labels.values()),
+        'flagged': sum(stats['flagged'] for stats in labels.values()),
+        'labels': dict(sorted(labels.items())),
+        'flagged_entries': [item[2] for item in sorted(flagged, key=lambda item: item[:2], reverse=True)],
+    }
+
+
+def write_report(report: Dict[str, Any], report_file: str):
+    dir_path = os.path.dirname(report_file)
+    if dir_path and not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    tmp_file = f'{report_file}.tmp'
+    with open(tmp_file, 'w') as fobj:
+        fobj.write(json.dumps(report, indent=2))
+    os.replace(tmp_file, report_file)
+
+
+def print_report(report: Dict[str, Any], data: Dict[str, dict], print_flagged: int = DEFAULT_PRINT_FLAGGED):
+    width = max([len(label) for label in report['labels']] + [len('LABEL')])
+    print('{0:<{width}}\t{1:>8}\t{2:>8}\t{3:>8}\t{4:>8}'.format(
+        'LABEL', 'ENTRIES', 'DISAGREE', 'FLAGGED', 'RATE', width=width
+    ))
+    for label, stats in report['labels'].items():
+        print('{0:<{width}}\t{1:>8}\t{2:>8}\t{3:>8}\t{4:>8.2%}'.format(
+            label, stats['entries'], stats['disagreements'], stats['flagged'], stats['disagreement_rate'], width=width
+        ))
+    print(f'{report["disagreements"]} of {report["entries"]} entries disagree with the model, {report["flagged"]} '
+          f'with a confidence of at least {report["confidence"]:.0%}')
+    if report['unscored']:
+        print(f'{report["unscored"]} entries have a label the model does not know and were not audited')
+    for entry in report['flagged_entries'][:print_flagged]:
+        print(f'{entry["margin"]:.3f}\t{entry["label"]} -> {entry["predicted"]} ({entry["score"]:.0%})\t'
+              f'{data[entry["id"]]["text"] if entry["id"] in data else entry["id"]}')
@@ -0,0 +1,332 @@
+
+import json
+import os
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# spaCy and numpy are slow to import, so they are only imported by the functions using them to keep the defaults
+# here cheap to read
+if TYPE_CHECKING:
+    import numpy
+
+
+FILE_SUFFIX = '.compact'
+REPORT_SUFFIX = '.report.json'
+PRECISION_AUTO = 'auto'
+PRECISION_FLOAT16 = 'float16'
+PRECISION_FLOAT32 = 'float32'
+PRECISIONS = (PRECISION_AUTO, PRECISION_FLOAT16, PRECISION_FLOAT32)
+# The top-1 accuracy that float16 weights may lose on the sample before float32 weights are kept instead
+DEFAULT_MAX_ACCURACY_LOSS = 0.005
+DEFAULT_SAMPLE_SIZE = 1000
+DEFAULT_LOAD_REPEAT = 3
+
+MAGIC = b'YURIMDL\0'
+FORMAT_VERSION = 1
+# Sections start on cache line boundaries, so that mapped weights are aligned for BLAS
+ALIGNMENT = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _get_layers(model) -> List[Any]:
+    """
+    Lists the layers of a thinc model that hold weights, in the same order as thinc serializes them.
+    """
+    layers = []
+    queue = [model]
+    for layer in queue:
+        if hasattr(layer, '_model') and not hasattr(layer._model, '_mem'):
+            raise Exception(f'The layer {layer} wraps another library, it can not be exported to a compact model')
+        if hasattr(layer, '_mem'):
+            layers.append(layer)
+        queue.extend(getattr(layer, '_layers', []))
+    return layers
+
+
+class _MappedMemory(object):
+    """
+    Replacement for the memory of a thinc layer, holding the weights of the layer in a single array such as a slice of
+    a memory mapped file. Only the weights are kept, without room for gradients, so a layer with this memory may only
+    be used for inference.
+    """
+
+    def __init__(self, ops, offsets: Dict[Tuple[int, str], Tuple[int, int, Tuple[int, ...]]],
+                 weights: 'numpy.ndarray'):
+        """
+        :param offsets: Dict of each (layer ID, param name) to the (offset, row, shape) of the param in the weights,
+        the same layout as the memory of thinc layers where the row is always 0
+        """
+        self.ops = ops
+        self._offsets = offsets
+        self._weights = weights
+        self._i = len(weights)
+
+    @property
+    def weights(self) -> 'numpy.ndarray':
+        return self._weights
+
+    def __contains__(self, name: Tuple[int, str]) -> bool:
+        return name in self._offsets
+
+    def __getitem__(self, name: Tuple[int, str]) -> 'numpy.ndarray':
+        return self.get(name)
+
+    def get(self, name: Tuple[int, str], default: Any = None) -> Any:
+        if name not in self._offsets:
+            return default
+        offset, _, shape = self._offsets[name]
+        size = 1
+        for dim in shape:
+            size *= dim
+        return self._weights[offset:offset + size].reshape(shape)
+
+    def add(self, name: Tuple[int, str], shape: Tuple[int, ...]):
+        raise Exception('No weights may be added to a compact model, it may only be used for inference')
+
+    def add_gradient(self, grad_name: Tuple[int, str], param_name: Tuple[int, str]):
+        raise Exception('A compact model has no gradients, it may only be used for inference')
+
+
+def is_compact_model(path: str) -> bool:
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as fobj:
+        return fobj.read(len(MAGIC)) == MAGIC
+
+
+def write_compact_model(nlp, model_file: str, precision: str = PRECISION_FLOAT16) -> int:
+    """
+    Writes the tokenizer and the textcat weights of a pipeline to a single file. The file starts with a JSON header
+    describing the layers, followed by the tokenizer and the weights of each layer, every section aligned so that the
+    weights may be memory mapped as they are.
+    :param precision: The type the weights are stored as, PRECISION_FLOAT16 halves the size of the weights
+    :return: The size of the written file in bytes
+    """
+    import numpy
+    if precision not in (PRECISION_FLOAT16, PRECISION_FLOAT32):
+        raise Exception(f'Unknown precision {precision}, supported precisions are {PRECISION_FLOAT16} and '
+                        f'{PRECISION_FLOAT32}')
+    textcat = nlp.get_pipe('textcat')
+    if textcat.cfg.get('pretrained_vectors'):
+        raise Exception('Models using pretrained word vectors can not be exported to a compact model')
+    tokenizer_bytes = nlp.tokenizer.to_bytes(exclude=['vocab'])
+    dtype = numpy.dtype(precision)
+
+    sections = [tokenizer_bytes]
+    offset = _align(len(tokenizer_bytes))
+    layers = []
+    for layer in _get_layers(textcat.model):
+        params = []
+        values = []
+        size = 0
+        # Gradients are kept in the second row of a thinc memory, only the weights of the first row are exported
+        for key, (_, row, shape) in sorted(layer._mem._offsets.items(), key=lambda item: item[1][0]):
+            if row != 0:
+                continue
+            name = key[1]
+            value = numpy.asarray(layer._mem.get(key))
+            params.append([name, size, list(shape)])
+            values.append(value.ravel().astype(dtype))
+            size += value.size
+        weights = numpy.concatenate(values) if values else numpy.zeros(0, dtype=dtype)
+        layers.append({'dims': dict(layer._dims), 'params': params, 'offset': offset, 'size': size})
+        sections.append(weights.tobytes())
+        offset = _align(offset + len(sections[-1]))
+
+    header = json.dumps({
+        'format_version': FORMAT_VERSION,
+        'lang': nlp.lang,
+        'meta': {key: nlp.meta[key] for key in ('name', 'version', 'spacy_version') if key in nlp.meta},
+        'textcat_cfg': dict(textcat.cfg),
+        'labels': list(textcat.labels),
+        'precision': precision,
+        'tokenizer': [0, len(tokenizer_bytes)],
+        'layers': layers,
+    }).encode('utf-8')
+
+    tmp_file = f'{model_file}.tmp'
+    with open(tmp_file, 'wb') as fobj:
+        fobj.write(MAGIC)
+        fobj.write(len(header).to_bytes(8, 'little'))
+        fobj.write(header)
+        for section in sections:
+            fobj.write(b'\0' * (_align(fobj.tell()) - fobj.tell()))
+            fobj.write(section)
+    os.replace(tmp_file, model_file)
+    return os.path.getsize(model_file)
+
+
+def _read_header(model_file: str) -> Tuple[Dict[str, Any], 'numpy.memmap']:
+    """
+    Reads the header of a compact model and memory maps the sections following it.
+    :return: Tuple of the header and the mapped bytes, which the offsets of the header are relative to
+    """
+    import numpy
+    with open(model_file, 'rb') as fobj:
+        if fobj.read(len(MAGIC)) != MAGIC:
+            raise Exception(f'{model_file} is not a compact model')
+        header_size = int.from_bytes(fobj.read(8), 'little')
+        header = json.loads(fobj.read(header_size).decode('utf-8'))
+    if header.get('format_version') != FORMAT_VERSION:
+        raise Exception(f'{model_file} has the unsupported format version {header.get("format_version")}, please '
+                        f'export it again')
+    # Mapped copy-on-write rather than read-only, so that the weights are writable arrays like the ones thinc allocates
+    # itself. The pages stay shared between processes as long as they are only read, which is the case when scoring
+    return header, numpy.memmap(model_file, dtype=numpy.uint8, mode='c', offset=_align(len(MAGIC) + 8 + header_size))
+
+
+def _map_weights(layers: List[Any], header: Dict[str, Any], data: 'numpy.memmap'):
+    """
+    Replaces the memory of each layer by its weights in the mapped sections of a compact model.
+    """
+    import numpy
+    if len(layers) != len(header['layers']):
+        raise Exception(f'The compact model has {len(header["layers"])} layers, but the textcat of this spaCy version '
+                        f'has {len(layers)}, please export it again')
+    dtype = numpy.dtype(header['precision'])
+    for layer, layer_header in zip(layers, header['layers']):
+        for dim, value in layer_header['dims'].items():
+            setattr(layer, dim, value)
+        offset = layer_header['offset']
+        weights = data[offset:offset + layer_header['size'] * dtype.itemsize].view(dtype)
+        if dtype != numpy.float32:
+            weights = weights.astype(numpy.float32)
+        layer._mem = _MappedMemory(layer._mem.ops, {
+            (layer.id, name): (param_offset, 0, tuple(shape)) for name, param_offset, shape in layer_header['params']
+        }, weights)
+
+
+def load_compact_model(model_file: str) -> Any:
+    """
+    Loads a compact model written by write_compact_model. The file is memory mapped, float32 weights are used straight
+    from the mapping so that processes loading the same file share its pages, while float16 weights are converted to
+    float32 once when loading.
+    :return: A spaCy pipeline with the tokenizer and textcat of the exported model, which may only be used for
+    inference
+    """
+    import spacy
+    header, data = _read_header(model_file)
+    nlp = spacy.blank(header['lang'], meta=header['meta'])
+    tokenizer_offset, tokenizer_size = header['tokenizer']
+    nlp.tokenizer.from_bytes(data[tokenizer_offset:tokenizer_offset + tokenizer_size].tobytes(), exclude=['vocab'])
+    textcat = nlp.create_pipe('textcat', config=header['textcat_cfg'])
+    for label in header['labels']:
+        textcat.add_label(label)
+    cfg = {key: value for key, value in textcat.cfg.items() if key != 'nr_class'}
+    textcat.model = textcat.Model(len(textcat.labels), **cfg)
+    nlp.add_pipe(textcat)
+    _map_weights(_get_layers(textcat.model), header, data)
+    return nlp
+
+
+def _score(nlp, texts: Sequence[str], labels: Sequence[str]) -> 'numpy.ndarray':
+    from . import evaluation
+    return evaluation.doc_scores(nlp.pipe(texts), labels)
+
+
+def _time_load(load_func: Callable[[str], Any], path: str, repeat: int) -> float:
+    """
+    :return: The fastest of the load times in seconds
+    """
+    load_times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        load_func(path)
+        load_times.append(time.perf_counter() - start_time)
+    return min(load_times)
+
+
+def _get_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(dir_path, file_name))
+        for dir_path, _, file_names in os.walk(path) for file_name in file_names
+    )
+
+
+def export_compact_model(model_dir: str, model_file: str, precision: str = PRECISION_AUTO,
+                         texts: Optional[Sequence[str]] = None, expected_labels: Optional[Sequence[str]] = None,
+                         max_accuracy_loss: float = DEFAULT_MAX_ACCURACY_LOSS,
+                         load_repeat: int = DEFAULT_LOAD_REPEAT) -> Dict[str, Any]:
+    """
+    Exports the model of a directory to a compact model file and compares both.
+    :param precision: PRECISION_AUTO stores float16 weights unless the top-1 accuracy on the texts drops by more than
+    max_accuracy_loss, in which case float32 weights are stored (they are also stored without any texts to check)
+    :param texts: The texts to compare the scores of both models on
+    :param expected_labels: If set, the label of each text to compute the accuracy of both models
+    :param load_repeat: The number of times each model is loaded, the fastest load time is reported
+    :return: The report, with the precision, the size and load time of both models, the share of texts whose best
+    label is the same, the largest score difference and the accuracy of both models
+    """
+    import numpy
+    import spacy
+    from . import evaluation
+    if precision not in PRECISIONS:
+        raise Exception(f'Unknown precision {precision}, supported precisions are {", ".join(PRECISIONS)}')
+    texts = list(texts or [])
+    nlp = spacy.load(model_dir)
+    labels = list(nlp.get_pipe('textcat').labels)
+    full_scores = _score(nlp, texts, labels)
+    gold = evaluation.label_matrix(expected_labels, labels) if expected_labels is not None else None
+
+    def get_accuracy(scores: 'numpy.ndarray') -> Optional[float]:
+        if gold is None or not len(scores):
+            return None
+        return evaluation.evaluate(scores, gold, labels)['textcat_accuracy']
+
+    if precision == PRECISION_AUTO:
+        candidates = [PRECISION_FLOAT16, PRECISION_FLOAT32] if texts else [PRECISION_FLOAT32]
+    else:
+        candidates = [precision]
+    full_accuracy = get_accuracy(full_scores)
+    for candidate in candidates:
+        write_compact_model(nlp, model_file, candidate)
+        compact_scores = _score(load_compact_model(model_file), texts, labels)
+        compact_accuracy = get_accuracy(compact_scores)
+        if full_accuracy is None or compact_accuracy is None:
+            # Without expected labels, a changed best label counts as a wrong one
+            loss = 1.0 - float((full_scores.argmax(axis=1) == compact_scores.argmax(axis=1)).mean()) if texts else 0.0
+        else:
+            loss = full_accuracy - compact_accuracy
+        if loss <= max_accuracy_loss:
+            break
+        if candidate != candidates[-1]:
+            print(f'{candidate} weights lose {loss:.2%} accuracy, trying {candidates[-1]} weights')
+
+    return {
+        'model_dir': model_dir,
+        'model_file': model_file,
+        'precision': candidate,
+        'texts': len(texts),
+        'agreement': float((full_scores.argmax(axis=1) == compact_scores.argmax(axis=1)).mean()) if texts else None,
+        'max_score_difference': float(numpy.abs(full_scores - compact_scores).max()) if texts else None,
+        'full': {
+            'size_bytes': _get_size(model_dir),
+            'load_seconds': _time_load(spacy.load, model_dir, load_repeat),
+            'accuracy': full_accuracy,
+        },
+        'compact': {
+            'size_bytes': _get_size(model_file),
+            'load_seconds': _time_load(load_compact_model, model_file, load_repeat),
+            'accuracy': compact_accuracy,
+        },
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    def format_value(value: Optional[float], spec: str) -> str:
+        return 'n/a' if value is None else format(value, spec)
+
+    print(f'Exported {report["model_dir"]} to {report["model_file"]} with {report["precision"]} weights')
+    print('{0:<8}\t{1:>10}\t{2:>8}\t{3:>8}'.format('MODEL', 'SIZE (KB)', 'LOAD (S)', 'ACC'))
+    for name in ('full', 'compact'):
+        model = report[name]
+        print('{0:<8}\t{1:>10.0f}\t{2:>8.3f}\t{3:>8}'.format(
+            name, model['size_bytes'] / 1024, model['load_seconds'], format_value(model['accuracy'], '.3f')
+        ))
+    print(f'Same best label for {format_value(report["agreement"], ".2%")} of {report["texts"]} text(s), largest '
+          f'score difference {format_value(report["max_score_difference"], ".4f")}')
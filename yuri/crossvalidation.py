@@ -0,0 +1,177 @@
+
+import contextlib
+import os
+import random
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from . import dataset, training
+
+# The training folds are split into this many parts, one of which picks the best epoch and stops training early, so
+# that the fold being evaluated is never seen while training
+VALIDATION_FOLDS = 10
+
+
+def stratified_fold_indices(examples: Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]], k: int,
+                            seed: Optional[int] = None) -> List[List[int]]:
+    """
+    Splits the indices of the examples into folds with the same proportion of each label. The examples of each label
+    are shuffled and then dealt to the folds in turn, continuing with the next fold for the next label.
+    :param seed: If set, the examples are always split the same way for the same seed
+    """
+    by_label: Dict[str, List[int]] = {}
+    for index, label in enumerate(dataset.get_example_labels(examples)):
+        by_label.setdefault(label or '', []).append(index)
+
+    rng = random.Random(seed)
+    folds = [[] for _ in range(k)]
+    fold = 0
+    for label in sorted(by_label):
+        label_indices = by_label[label]
+        rng.shuffle(label_indices)
+        for index in label_indices:
+            folds[fold].append(index)
+            fold = (fold + 1) % k
+    return folds
+
+
+def stratified_folds(examples: Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]], k: int,
+                     seed: Optional[int] = None) -> List[Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]]]:
+    """
+    Splits the examples into folds with the same proportion of each label (see stratified_fold_indices).
+    """
+    return [dataset.select(examples, fold) for fold in stratified_fold_indices(examples, k, seed=seed)]
+
+
+def _evaluate_model(model_dir: str, examples: Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]]) -> Dict[str, Any]:
+    """
+    Evaluates a saved model on the examples.
+    """
+    from . import evaluation
+    nlp = training.read_model(model_dir)
+    textcat = nlp.get_pipe('textcat')
+    docs = [nlp.make_doc(text) for text in dataset.get_texts(examples)]
+    gold = evaluation.label_matrix(dataset.get_example_labels(examples), list(textcat.labels))
+    return training._evaluate(textcat, docs, gold)
+
+
+def _train_fold(index: int, train_data: Sequence, eval_data: Sequence, labels: Iterable[str], fold_dir: str,
+                doc_file: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Trains and evaluates one fold in a worker process, with the training output written to a log in the fold dir.
+    The best epoch is picked on a validation split of the training folds, and the saved model is then evaluated on
+    the held out fold, so that the fold does not influence its own score. The docs are read from the doc file
+    tokenized by the parent process, so that folds neither tokenize again nor write to the shared doc cache.
+    """
+    os.makedirs(fold_dir)
+    folds = stratified_fold_indices(train_data, VALIDATION_FOLDS, seed=kwargs.get('seed'))
+    validation_data = dataset.select(train_data, folds[0])
+    inner_train_data = dataset.select(train_data, [i for fold in folds[1:] for i in fold])
+    model_dir = os.path.join(fold_dir, 'model')
+    with open(os.path.join(fold_dir, 'train.log'), 'w') as log, contextlib.redirect_stdout(log):
+        training.train_textcat_model(
+            load_data_func=lambda: (inner_train_data, validation_data), output_dir=model_dir,
+            labels=labels, doc_file=doc_file, **kwargs
+        )
+        return _evaluate_model(model_dir, eval_data)
+
+
+def summarize(fold_scores: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Computes the mean and standard deviation of the metrics over all folds.
+    :return: Dict of each averaged metric (e.g. textcat_f) and per label metric to a tuple of the mean and standard
+    deviation, the labels, the total support per label and the confusion matrix summed over all folds
+    """
+    import numpy
+    labels = fold_scores[0]['labels']
+    metrics = [key for key in fold_scores[0] if key.startswith('textcat_')]
+    summary = {'labels': labels, 'folds': len(fold_scores)}
+    for metric in metrics:
+        values = numpy.array([scores[metric] for scores in fold_scores])
+        summary[metric] = (float(values.mean()), float(values.std()))
+    summary['per_label'] = {}
+    for label in labels:
+        label_summary = {}
+        for metric in ('p', 'r', 'f'):
+            values = numpy.array([scores['per_label'][label][metric] for scores in fold_scores])
+            label_summary[metric] = (float(values.mean()), float(values.std()))
+        label_summary['support'] = sum(scores['per_label'][label]['support'] for scores in fold_scores)
+        summary['per_label'][label] = label_summary
+    summary['confusion'] = sum(scores['confusion'] for scores in fold_scores)
+    return summary
+
+
+def print_summary(summary: Dict[str, Any]):
+    labels: List[str] = summary['labels']
+    width = max([len(label) for label in labels] + [9])
+    print(f'Cross validation over {summary["folds"]} folds (mean +/- stddev):')
+    print('{:<{width}}\t{:^13}\t{:^13}\t{:^13}\t{:^7}'.format('LABEL', 'P', 'R', 'F', 'SUPPORT', width=width))
+    for label in labels:
+        metrics = summary['per_label'][label]
+        print('{:<{width}}\t{:.3f} +/- {:.3f}\t{:.3f} +/- {:.3f}\t{:.3f} +/- {:.3f}\t{:>7}'.format(
+            label, *metrics['p'], *metrics['r'], *metrics['f'], metrics['support'], width=width
+        ))
+    for name, prefix in (('macro avg', 'textcat_macro_'), ('micro avg', 'textcat_')):
+        print('{:<{width}}\t{:.3f} +/- {:.3f}\t{:.3f} +/- {:.3f}\t{:.3f} +/- {:.3f}'.format(
+            name, *summary[f'{prefix}p'], *summary[f'{prefix}r'], *summary[f'{prefix}f'], width=width
+        ))
+    print('Top-1 accuracy: {:.3f} +/- {:.3f}'.format(*summary['textcat_accuracy']))
+    print('Confusion matrix summed over all folds (rows are expected labels, columns are predicted labels):')
+    row_width = width + len(str(len(labels))) + 1
+    print('\t'.join([' ' * row_width] + [str(i) for i in range(len(labels))]))
+    for i, label in enumerate(labels):
+        print('\t'.join([f'{i} {label}'.ljust(row_width)] + [str(count) for count in summary['confusion'][i]]))
+
+
+def run_cross_validation(
+        examples: Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]], labels: Iterable[str], k: int,
+        doc_cache_dir: Optional[str] = None, seed: Optional[int] = None, workers: Optional[int] = None,
+        **kwargs
+) -> Dict[str, Any]:
+    """
+    Trains a model for each of k stratified folds in parallel on a process pool, each evaluated on its fold and
+    trained on the others (with a share of them held out to pick the best epoch). None of the models are kept.
+    :param doc_cache_dir: If set, the tokenized texts of all examples are cached in this directory (see
+    training.tokenize_texts)
+    :param workers: The number of processes, defaults to the number of CPUs
+    :param kwargs: Any other train_textcat_model arguments used to train every fold
+    :return: The summary of the scores of all folds
+    """
+    import spacy
+    if k < 2:
+        raise Exception('At least 2 folds are needed for cross validation')
+    if len(examples) < k:
+        raise Exception(f'There are fewer entries ({len(examples)}) than folds ({k})')
+    labels = sorted(labels)
+    folds = stratified_fold_indices(examples, k, seed=seed)
+    work_dir = tempfile.mkdtemp(prefix='.yuri-folds-')
+    try:
+        # Tokenize once up front, every fold then reads the same docs from a private file, only this process uses the
+        # doc cache
+        docs = training.tokenize_texts(spacy.blank('en'), dataset.get_texts(examples), cache_dir=doc_cache_dir)
+        doc_file = os.path.join(work_dir, f'docs{training.DOC_CACHE_SUFFIX}')
+        training.write_docs(docs.values(), doc_file)
+
+        workers = min(workers or os.cpu_count() or 1, k)
+        print(f'Training {k} folds with {workers} processes')
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for index in range(k):
+                train_indices = [i for fold, indices in enumerate(folds) if fold != index for i in indices]
+                futures.append(executor.submit(
+                    _train_fold, index, dataset.select(examples, train_indices),
+                    dataset.select(examples, folds[index]), labels,
+                    os.path.join(work_dir, f'fold-{index}'), doc_file, dict(kwargs, seed=seed)
+                ))
+            fold_scores = []
+            for index, future in enumerate(futures):
+                scores = future.result()
+                print(f'Fold {index + 1}/{k} finished with F-score {scores["textcat_f"]:.3f}')
+                fold_scores.append(scores)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary = summarize(fold_scores)
+    print_summary(summary)
+    return summary
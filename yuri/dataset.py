@@ -0,0 +1,137 @@
+
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+class LabeledExamples(Sequence):
+    """
+    Training examples in the same (text, {'cats': {label: bool}}) format as a list of tuples, but only keeping the
+    text and the ID of the label of each example. The categories of an example are built when it is accessed.
+    """
+
+    def __init__(self, texts: List[str], label_ids: array, labels: List[str]):
+        """
+        :param label_ids: The index of the label of each text in the labels
+        """
+        self.texts = texts
+        self.label_ids = label_ids
+        self.labels = labels
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, index: int) -> Tuple[str, Dict[str, Dict[str, bool]]]:
+        label_id = self.label_ids[index]
+        return self.texts[index], {'cats': {label: i == label_id for i, label in enumerate(self.labels)}}
+
+    def subset(self, indices: Iterable[int]) -> 'LabeledExamples':
+        indices = list(indices)
+        return LabeledExamples(
+            [self.texts[i] for i in indices], array('i', (self.label_ids[i] for i in indices)), self.labels
+        )
+
+
+class LabeledDataset(object):
+    """
+    Classified entries indexed for training. Every label is assigned an integer ID, each entry only keeps its text and
+    the ID of its label, and the number of entries of each label is kept up to date as entries are added or relabeled.
+    """
+
+    def __init__(self):
+        self.labels: List[str] = []
+        self.counts: List[int] = []
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.label_ids = array('i')
+        self._label_index: Dict[str, int] = {}
+        self._rows: Dict[str, int] = {}
+
+    @classmethod
+    def from_data(cls, data: Dict[str, dict]) -> 'LabeledDataset':
+        """
+        Indexes the classified data, a dict of message IDs to classifications with a text and a label.
+        """
+        dataset = cls()
+        for message_id, classification in data.items():
+            dataset.add(message_id, classification['text'], classification['label'])
+        return dataset
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get_label_id(self, label: str) -> int:
+        """
+        Retrieves the ID of a label, adding it to the labels if it is new.
+        """
+        label_id = self._label_index.get(label)
+        if label_id is None:
+            label_id = len(self.labels)
+            self._label_index[label] = label_id
+            self.labels.append(label)
+            self.counts.append(0)
+        return label_id
+
+    def add(self, message_id: str, text: str, label: str):
+        """
+        Adds a classified entry, replacing the text and label of an entry with the same message ID.
+        """
+        label_id = self.get_label_id(label)
+        row = self._rows.get(message_id)
+        if row is None:
+            self._rows[message_id] = len(self.ids)
+            self.ids.append(message_id)
+            self.texts.append(text)
+            self.label_ids.append(label_id)
+        else:
+            self.counts[self.label_ids[row]] -= 1
+            self.texts[row] = text
+            self.label_ids[row] = label_id
+        self.counts[label_id] += 1
+
+    def get_labels(self) -> List[str]:
+        """
+        :return: The labels of at least one entry
+        """
+        return [label for label, count in zip(self.labels, self.counts) if count]
+
+    def label_counts(self) -> Dict[str, int]:
+        return {label: count for label, count in zip(self.labels, self.counts) if count}
+
+    def examples(self, message_ids: Optional[Iterable[str]] = None) -> LabeledExamples:
+        """
+        :param message_ids: If set, only the examples of these entries in this order, otherwise every entry
+        """
+        rows = range(len(self.ids)) if message_ids is None else [self._rows[message_id] for message_id in message_ids]
+        return LabeledExamples(self.texts, self.label_ids, self.labels).subset(rows)
+
+
+def get_texts(examples: Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]]) -> List[str]:
+    """
+    Retrieves the text of each example without building the categories of labeled examples.
+    """
+    if isinstance(examples, LabeledExamples):
+        return list(examples.texts)
+    return [example[0] for example in examples]
+
+
+def get_example_labels(examples: Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]]) -> List[Optional[str]]:
+    """
+    Retrieves the label of each example without building the categories of labeled examples.
+    :return: The label of each example, None for examples without a label
+    """
+    if isinstance(examples, LabeledExamples):
+        return [examples.labels[label_id] for label_id in examples.label_ids]
+    return [
+        next((label for label in sorted(example[1]['cats']) if example[1]['cats'][label]), None)
+        for example in examples
+    ]
+
+
+def select(examples: Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]],
+           indices: Iterable[int]) -> Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]]:
+    """
+    Selects the examples at the indices, keeping labeled examples compact.
+    """
+    if isinstance(examples, LabeledExamples):
+        return examples.subset(indices)
+    return [examples[i] for i in indices]
@@ -0,0 +1,284 @@
+
+import hashlib
+import json
+import math
+import os
+import re
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+# numpy is only imported once texts are hashed, to keep the defaults here cheap to read
+if TYPE_CHECKING:
+    import numpy
+
+
+INDEX_FILE_SUFFIX = '.duplicates'
+INDEX_VERSION = 1
+DEFAULT_THRESHOLD = 0.8
+NUM_PERM = 64
+# 16 bands of 4 rows find most pairs with a similarity above 0.5 as candidates
+LSH_BANDS = 16
+SHINGLE_SIZE = 3
+WEIGHTING_NONE = 'none'
+WEIGHTING_LOG = 'log'
+WEIGHTINGS = (WEIGHTING_NONE, WEIGHTING_LOG)
+
+# Parts of messages that vary between otherwise identical alerts and questions
+NORMALIZE_PATTERNS = [
+    (re.compile(r'<[^>|\s]+\|([^>]+)>'), r'\1'),
+    (re.compile(r'<[@#!][^>]+>'), ' <ref> '),
+    (re.compile(r'https?://\S+'), ' <url> '),
+    (re.compile(r'\b[0-9a-f]{7,}\b'), ' <hex> '),
+    (re.compile(r'\d+([.:,/-]\d+)*'), ' <num> '),
+]
+TOKEN_PATTERN = re.compile(r'<\w+>|\w+')
+
+# Mersenne prime larger than any 32 bit shingle hash
+_PRIME = (1 << 61) - 1
+_permutations = None
+
+
+def _get_permutations() -> Tuple['numpy.ndarray', 'numpy.ndarray']:
+    """
+    Generates the MinHash permutations, always the same ones so that saved signatures stay comparable.
+    """
+    global _permutations
+    if _permutations is None:
+        import numpy
+        random_state = numpy.random.RandomState(1)
+        _permutations = (
+            random_state.randint(1, 1 << 32, size=NUM_PERM, dtype=numpy.uint64),
+            random_state.randint(0, 1 << 32, size=NUM_PERM, dtype=numpy.uint64),
+        )
+    return _permutations
+
+
+def normalize(text: str) -> List[str]:
+    """
+    Normalizes a message into lowercase tokens, replacing links, mentions, numbers and hex IDs by placeholders.
+    """
+    text = text.lower()
+    for pattern, replacement in NORMALIZE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return TOKEN_PATTERN.findall(text)
+
+
+def get_fingerprint(tokens: List[str]) -> str:
+    return hashlib.sha1(' '.join(tokens).encode('utf-8')).hexdigest()
+
+
+def get_signature(tokens: List[str]) -> 'numpy.ndarray':
+    """
+    Computes the MinHash signature of the shingles of the tokens (every run of SHINGLE_SIZE tokens).
+    :return: Array of NUM_PERM hashes, the share of equal hashes of two signatures estimates their Jaccard similarity
+    """
+    import numpy
+    perm_a, perm_b = _get_permutations()
+    if len(tokens) < SHINGLE_SIZE:
+        shingles = {' '.join(tokens)}
+    else:
+        shingles = {' '.join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    hashes = numpy.array(
+        [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little')
+         for shingle in shingles], dtype=numpy.uint64
+    )
+    # The products stay below 2^64, since both factors are below 2^32
+    permuted = (perm_a[:, None] * hashes[None, :] + perm_b[:, None]) % _PRIME
+    return (permuted.min(axis=1) & 0xFFFFFFFF).astype(numpy.uint32)
+
+
+def get_similarity(signature: 'numpy.ndarray', other_signature: 'numpy.ndarray') -> float:
+    return float((signature == other_signature).mean())
+
+
+def _band_keys(signature: 'numpy.ndarray') -> List[bytes]:
+    rows = NUM_PERM // LSH_BANDS
+    return [bytes([band]) + signature[band * rows:(band + 1) * rows].tobytes() for band in range(LSH_BANDS)]
+
+
+class DuplicateIndex(object):
+    """
+    Index of the texts of classified entries for finding near-duplicates, such as repeated bot alerts that only differ
+    in numbers or links. Texts with the same normalized tokens have the same fingerprint, and other near-duplicates are
+    found with locality sensitive hashing of MinHash signatures of the token shingles.
+
+    The index is saved to a file next to the data file and updated incrementally, only entries that were added or
+    whose text changed are hashed again.
+    """
+
+    def __init__(self, index_file: Optional[str] = None, threshold: float = DEFAULT_THRESHOLD):
+        """
+        :param index_file: If set, the file the index is loaded from and saved to
+        :param threshold: The estimated Jaccard similarity above which two texts are near-duplicates
+        """
+        self.index_file = index_file
+        self.threshold = threshold
+        self._fingerprints: Dict[str, str] = {}
+        self._signatures: Dict[str, 'numpy.ndarray'] = {}
+        self._by_fingerprint: Dict[str, set] = {}
+        self._buckets: Dict[bytes, set] = {}
+        self._changed = False
+        if index_file and os.path.exists(index_file):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._fingerprints
+
+    def _load(self):
+        import numpy
+        with open(self.index_file, 'r') as fobj:
+            try:
+                index = json.loads(fobj.read())
+            except ValueError:
+                print(f'Warning: ignoring invalid duplicate index {self.index_file}')
+                return
+        if index.get('version') != INDEX_VERSION or index.get('num_perm') != NUM_PERM:
+            # Built with other parameters, so it is built again
+            return
+        for message_id, (fingerprint, signature) in index['entries'].items():
+            self._add(message_id, fingerprint, numpy.frombuffer(bytes.fromhex(signature), dtype=numpy.uint32))
+
+    def save(self):
+        if not self.index_file or not self._changed:
+            return
+        tmp_file = f'{self.index_file}.tmp'
+        with open(tmp_file, 'w') as fobj:
+            fobj.write(json.dumps({
+                'version': INDEX_VERSION,
+                'num_perm': NUM_PERM,
+                'entries': {
+                    message_id: [fingerprint, self._signatures[message_id].tobytes().hex()]
+                    for message_id, fingerprint in self._fingerprints.items()
+                },
+            }))
+        os.replace(tmp_file, self.index_file)
+        self._changed = False
+
+    def _add(self, message_id: str, fingerprint: str, signature: 'numpy.ndarray'):
+        self._fingerprints[message_id] = fingerprint
+        self._signatures[message_id] = signature
+        self._by_fingerprint.setdefault(fingerprint, set()).add(message_id)
+        for key in _band_keys(signature):
+            self._buckets.setdefault(key, set()).add(message_id)
+
+    def remove(self, message_id: str):
+        fingerprint = self._fingerprints.pop(message_id, None)
+        if fingerprint is None:
+            return
+        signature = self._signatures.pop(message_id)
+        self._by_fingerprint[fingerprint].discard(message_id)
+        for key in _band_keys(signature):
+            self._buckets[key].discard(message_id)
+        self._changed = True
+
+    def update(self, classifications: Dict[str, dict]) -> int:
+        """
+        Adds classified entries to the index, hashing them again if their text changed.
+        :return: The number of entries that were (re)indexed
+        """
+        indexed = 0
+        for message_id, classification in classifications.items():
+            tokens = normalize(classification['text'])
+            fingerprint = get_fingerprint(tokens)
+            if self._fingerprints.get(message_id) == fingerprint:
+                continue
+            self.remove(message_id)
+            self._add(message_id, fingerprint, get_signature(tokens))
+            self._changed = True
+            indexed += 1
+        return indexed
+
+    def sync(self, data: Dict[str, dict]) -> int:
+        """
+        Updates the index to hold exactly the entries of the classified data.
+        :return: The number of entries that were (re)indexed
+        """
+        for message_id in [message_id for message_id in self._fingerprints if message_id not in data]:
+            self.remove(message_id)
+        return self.update(data)
+
+    def _similar(self, fingerprint: str, signature: 'numpy.ndarray') -> Iterable[Tuple[str, float]]:
+        for message_id in self._by_fingerprint.get(fingerprint, ()):
+            yield message_id, 1.0
+        candidates = set()
+        for key in _band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        for message_id in candidates:
+            if self._fingerprints[message_id] == fingerprint:
+                continue
+            similarity = get_similarity(signature, self._signatures[message_id])
+            if similarity >= self.threshold:
+                yield message_id, similarity
+
+    def find(self, text: str, exclude_id: Optional[str] = None) -> Optional[Tuple[str, float]]:
+        """
+        Finds the most similar indexed entry to a text.
+        :param exclude_id: If set, the message ID of the text itself, which is never returned
+        :return: Tuple of the message ID and estimated similarity of the best near-duplicate, None if there is none
+        """
+        tokens = normalize(text)
+        matches = [
+            match for match in self._similar(get_fingerprint(tokens), get_signature(tokens)) if match[0] != exclude_id
+        ]
+        if not matches:
+            return None
+        # Prefer the most similar entry, then the oldest one for a stable result
+        return min(matches, key=lambda match: (-match[1], match[0]))
+
+    def clusters(self, message_ids: Iterable[str]) -> List[List[str]]:
+        """
+        Groups indexed entries into clusters of near-duplicates, linking any two entries that are near-duplicates.
+        :return: The clusters with their message IDs sorted, including clusters of a single entry
+        """
+        message_ids = [message_id for message_id in message_ids if message_id in self._fingerprints]
+        included = set(message_ids)
+        parents = {message_id: message_id for message_id in message_ids}
+
+        def find_root(message_id: str) -> str:
+            while parents[message_id] != message_id:
+                parents[message_id] = parents[parents[message_id]]
+                message_id = parents[message_id]
+            return message_id
+
+        for message_id in message_ids:
+            for other_id, _ in self._similar(self._fingerprints[message_id], self._signatures[message_id]):
+                if other_id in included:
+                    root, other_root = find_root(message_id), find_root(other_id)
+                    if root != other_root:
+                        parents[max(root, other_root)] = min(root, other_root)
+
+        clusters: Dict[str, List[str]] = {}
+        for message_id in message_ids:
+            clusters.setdefault(find_root(message_id), []).append(message_id)
+        return sorted(sorted(cluster) for cluster in clusters.values())
+
+
+def get_index_file(data_file: str) -> str:
+    return f'{data_file}{INDEX_FILE_SUFFIX}'
+
+
+def collapse(clusters: List[List[str]], data: Dict[str, dict],
+             weighting: str = WEIGHTING_NONE) -> Tuple[List[str], Dict[str, int], Dict[str, List[str]]]:
+    """
+    Collapses each cluster of near-duplicates into one entry per label, so that conflicting labels are kept.
+    :param weighting: WEIGHTING_NONE to count every kept entry once, WEIGHTING_LOG to repeat it once more for every
+    doubling of the entries it stands for
+    :return: Tuple of the kept message IDs, the number of times to repeat each kept entry and the message IDs of the
+    entries each kept entry stands for
+    """
+    if weighting not in WEIGHTINGS:
+        raise Exception(f'Unknown weighting {weighting}, supported weightings are {", ".join(WEIGHTINGS)}')
+    kept = []
+    weights = {}
+    members = {}
+    for cluster in clusters:
+        by_label: Dict[str, List[str]] = {}
+        for message_id in cluster:
+            by_label.setdefault(data[message_id]['label'], []).append(message_id)
+        for label_ids in by_label.values():
+            kept.append(label_ids[0])
+            members[label_ids[0]] = label_ids
+            weights[label_ids[0]] = 1 + int(math.log2(len(label_ids))) if weighting == WEIGHTING_LOG else 1
+    return kept, weights, members
@@ -0,0 +1,122 @@
+
+import numpy
+from typing import Any, Dict, Iterable, List, Sequence
+
+
+DEFAULT_THRESHOLD = 0.5
+# Avoids dividing by zero for labels without any predictions or gold entries
+EPSILON = 1e-8
+
+
+def doc_scores(docs: Iterable[Any], labels: Sequence[str]) -> numpy.ndarray:
+    """
+    Gathers the category scores of the docs into a matrix.
+    :return: Matrix of docs x labels
+    """
+    return numpy.array(
+        [[doc.cats.get(label, 0.0) for label in labels] for doc in docs], dtype=numpy.float32
+    ).reshape(-1, len(labels))
+
+
+def gold_matrix(cats: Iterable[Dict[str, bool]], labels: Sequence[str]) -> numpy.ndarray:
+    """
+    Gathers the gold categories into a matrix.
+    :param cats: The gold categories of each doc (e.g. {'label': True, 'other': False})
+    :return: Boolean matrix of docs x labels
+    """
+    return numpy.array(
+        [[bool(doc_cats.get(label)) for label in labels] for doc_cats in cats], dtype=bool
+    ).reshape(-1, len(labels))
+
+
+def label_matrix(expected_labels: Iterable[str], labels: Sequence[str]) -> numpy.ndarray:
+    """
+    Gathers a single expected label per doc into a gold matrix, labels that are unknown have no gold category.
+    :return: Boolean matrix of docs x labels
+    """
+    indices = {label: i for i, label in enumerate(labels)}
+    expected = numpy.array([indices.get(label, -1) for label in expected_labels], dtype=numpy.int64)
+    return expected[:, None] == numpy.arange(len(labels))[None, :]
+
+
+def _f_score(precision: numpy.ndarray, recall: numpy.ndarray) -> numpy.ndarray:
+    total = precision + recall
+    return numpy.where(total > 0, 2 * precision * recall / numpy.maximum(total, EPSILON), 0.0)
+
+
+def evaluate(scores: numpy.ndarray, gold: numpy.ndarray, labels: Sequence[str],
+             threshold: float = DEFAULT_THRESHOLD) -> Dict[str, Any]:
+    """
+    Computes all metrics in one pass over the score and gold matrices. A label is predicted for a doc when its score
+    is at least the threshold, and the top-1 prediction of a doc is the label with the best score.
+    :param scores: Matrix of docs x labels with the predicted scores
+    :param gold: Boolean matrix of docs x labels with the gold categories
+    :return: Dict of the micro averaged precision, recall and F-score (textcat_p, textcat_r and textcat_f), the macro
+    averages (textcat_macro_p, textcat_macro_r, textcat_macro_f), the top-1 accuracy (textcat_accuracy), the labels,
+    the per label metrics (per_label) and the confusion matrix of gold x top-1 predicted labels (confusion)
+    """
+    predicted = scores >= threshold
+    tp = (predicted & gold).sum(axis=0).astype(numpy.float64)
+    fp = (predicted & ~gold).sum(axis=0).astype(numpy.float64)
+    fn = (~predicted & gold).sum(axis=0).astype(numpy.float64)
+    support = gold.sum(axis=0)
+
+    precision = tp / (tp + fp + EPSILON)
+    recall = tp / (tp + fn + EPSILON)
+    f_score = _f_score(precision, recall)
+
+    micro_p = tp.sum() / (tp.sum() + fp.sum() + EPSILON)
+    micro_r = tp.sum() / (tp.sum() + fn.sum() + EPSILON)
+    micro_f = float(_f_score(numpy.array(micro_p), numpy.array(micro_r)))
+
+    # Top-1 metrics only apply to docs with a gold label
+    has_gold = gold.any(axis=1)
+    gold_index = gold.argmax(axis=1)[has_gold]
+    predicted_index = scores.argmax(axis=1)[has_gold] if len(labels) else gold_index
+    confusion = numpy.zeros((len(labels), len(labels)), dtype=numpy.int64)
+    numpy.add.at(confusion, (gold_index, predicted_index), 1)
+    accuracy = float((gold_index == predicted_index).mean()) if len(gold_index) else 0.0
+
+    return {
+        'textcat_p': float(micro_p),
+        'textcat_r': float(micro_r),
+        'textcat_f': micro_f,
+        'textcat_macro_p': float(precision.mean()) if len(labels) else 0.0,
+        'textcat_macro_r': float(recall.mean()) if len(labels) else 0.0,
+        'textcat_macro_f': float(f_score.mean()) if len(labels) else 0.0,
+        'textcat_accuracy': accuracy,
+        'labels': list(labels),
+        'per_label': {
+            label: {'p': float(precision[i]), 'r': float(recall[i]), 'f': float(f_score[i]), 'support': int(support[i])}
+            for i, label in enumerate(labels)
+        },
+        'confusion': confusion,
+    }
+
+
+def print_report(scores: Dict[str, Any]):
+    """
+    Prints a table of the per label metrics, the averages and the confusion matrix of an evaluation.
+    """
+    labels: List[str] = scores['labels']
+    width = max([len(label) for label in labels] + [9])
+    print('{:<{width}}\t{:^5}\t{:^5}\t{:^5}\t{:^7}'.format('LABEL', 'P', 'R', 'F', 'SUPPORT', width=width))
+    for label in labels:
+        metrics = scores['per_label'][label]
+        print('{:<{width}}\t{:.3f}\t{:.3f}\t{:.3f}\t{:>7}'.format(
+            label, metrics['p'], metrics['r'], metrics['f'], metrics['support'], width=width
+        ))
+    print('{:<{width}}\t{:.3f}\t{:.3f}\t{:.3f}'.format(
+        'macro avg', scores['textcat_macro_p'], scores['textcat_macro_r'], scores['textcat_macro_f'], width=width
+    ))
+    print('{:<{width}}\t{:.3f}\t{:.3f}\t{:.3f}'.format(
+        'micro avg', scores['textcat_p'], scores['textcat_r'], scores['textcat_f'], width=width
+    ))
+    print(f'Top-1 accuracy: {scores["textcat_accuracy"]:.3f}')
+
+    print('Confusion matrix (rows are expected labels, columns are predicted labels):')
+    # Rows are prefixed by the index of the label, which is used as the column header
+    row_width = width + len(str(len(labels))) + 1
+    print('\t'.join([' ' * row_width] + [str(i) for i in range(len(labels))]))
+    for i, label in enumerate(labels):
+        print('\t'.join([f'{i} {label}'.ljust(row_width)] + [str(count) for count in scores['confusion'][i]]))
@@ -0,0 +1,134 @@
+
+import datetime
+import json
+import re
+import zipfile
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+DAY_FILE_PATTERN = re.compile(r'^(?P<channel>[^/]+)/(?P<day>\d{4}-\d{2}-\d{2})\.json$')
+
+
+def _timestamp_day(timestamp: str) -> str:
+    return datetime.datetime.fromtimestamp(float(timestamp), datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def _shift_day(day: str, days: int) -> str:
+    return (datetime.datetime.strptime(day, '%Y-%m-%d') + datetime.timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+class SlackExport(object):
+    """
+    Reads messages from a standard slack workspace export, a ZIP file with a directory per channel holding one JSON
+    file of messages per day. Messages are streamed from the archive one day file at a time, so the archive is never
+    extracted or loaded into memory as a whole.
+    """
+
+    def __init__(self, export_file: str):
+        self.export_file = export_file
+        self._zip = zipfile.ZipFile(export_file)
+        self._day_files: Dict[str, List[Tuple[str, str]]] = {}
+        self._channel_ids: Optional[Dict[str, str]] = None
+        for name in self._zip.namelist():
+            match = DAY_FILE_PATTERN.match(name)
+            if match:
+                self._day_files.setdefault(match.group('channel'), []).append((match.group('day'), name))
+        for day_files in self._day_files.values():
+            day_files.sort()
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self) -> 'SlackExport':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def channel_names(self) -> List[str]:
+        return sorted(self._day_files)
+
+    def _get_channel_ids(self) -> Dict[str, str]:
+        # The channels.json file is optional, channels are then only known by their name
+        if self._channel_ids is None:
+            self._channel_ids = {}
+            if 'channels.json' in self._zip.namelist():
+                with self._zip.open('channels.json') as fobj:
+                    self._channel_ids = {
+                        channel['name']: channel['id'] for channel in json.load(fobj)
+                        if channel.get('name') and channel.get('id')
+                    }
+        return self._channel_ids
+
+    def find_channel_id(self, name: str) -> Optional[str]:
+        """
+        Finds the ID of a channel from the channels.json file in the export (if present).
+        """
+        if name.startswith('#'):
+            name = name[1:]
+        return self._get_channel_ids().get(name)
+
+    def _get_day_files(self, channel: str) -> List[Tuple[str, str]]:
+        if channel.startswith('#'):
+            channel = channel[1:]
+        if channel not in self._day_files:
+            # The channel may also be given by its ID
+            channel = next(
+                (name for name, channel_id in self._get_channel_ids().items() if channel_id == channel), channel
+            )
+        if channel not in self._day_files:
+            raise Exception(f'The channel {channel} was not found in the slack export {self.export_file}')
+        return self._day_files[channel]
+
+    def iter_messages(self, channel: str, direction: bool, start_timestamp: Optional[str] = None,
+                      end_timestamp: Optional[str] = None) -> Iterator[dict]:
+        """
+        Streams the messages of a channel.
+        :param channel: The name of the channel, or its ID if the export has a channels.json file
+        :param direction: True to stream from the oldest message forward (yuri.DIRECTION_NEWER), False to stream from
+        the newest message backward
+        :param start_timestamp: If set, only messages before it are streamed when moving backward
+        :param end_timestamp: If set, only messages after it are streamed when moving forward
+        """
+        day_files = self._get_day_files(channel)
+        if not direction:
+            day_files = reversed(day_files)
+        # Day files are named by the local date of the workspace, so allow a day of difference when skipping them
+        start_day = _shift_day(_timestamp_day(start_timestamp), 1) if start_timestamp and not direction else None
+        end_day = _shift_day(_timestamp_day(end_timestamp), -1) if end_timestamp and direction else None
+        for day, name in day_files:
+            if (start_day and day > start_day) or (end_day and day < end_day):
+                continue
+            with self._zip.open(name) as fobj:
+                messages = json.load(fobj)
+            messages.sort(key=lambda message: message.get('ts', ''), reverse=not direction)
+            for message in messages:
+                timestamp = message.get('ts')
+                if not timestamp:
+                    continue
+                if not direction and start_timestamp and timestamp >= start_timestamp:
+                    continue
+                if direction and end_timestamp and timestamp <= end_timestamp:
+                    continue
+                yield message
+
+    def get_messages(
+            self, channel: str, start_timestamp: Optional[str], end_timestamp: Optional[str], direction: bool,
+            batch_size: Optional[int]
+    ) -> Tuple[List[dict], Optional[str], Optional[str]]:
+        """
+        Retrieves a list of messages from the channel in the same way as MessageMirror.get_messages.
+        :return: Tuple of messages sorted according to the direction and the start/end timestamps
+        """
+        if direction and end_timestamp is None:
+            # Without an end timestamp, start with the newest messages like slack does
+            messages = list(islice(self.iter_messages(channel, False), batch_size))
+            messages.reverse()
+        else:
+            messages = list(islice(self.iter_messages(channel, direction, start_timestamp, end_timestamp), batch_size))
+        if not direction:
+            start_timestamp = messages[-1]['ts'] if messages else None
+        else:
+            end_timestamp = messages[-1]['ts'] if messages else None
+        return messages, start_timestamp, end_timestamp
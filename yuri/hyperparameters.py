@@ -0,0 +1,162 @@
+
+import contextlib
+import itertools
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from . import dataset, training
+
+
+# Each key is a list of values to search, which are the train_textcat_model arguments with the same names
+DEFAULT_SPACE = {
+    'architecture': ['simple_cnn', 'bow', 'ensemble'],
+    'dropout': [list(training.DEFAULT_DROPOUT), [0.4, 0.1, 1e-4]],
+    'batch_size': [list(training.DEFAULT_BATCH_SIZE), [1.0, 16.0, 1.001]],
+    'n_iter': [training.DEFAULT_N_ITER],
+}
+SPACE_KEYS = ('architecture', 'dropout', 'batch_size', 'n_iter')
+RESULTS_FILE_NAME = 'sweep_results.tsv'
+
+
+def get_candidates(space: Dict[str, List[Any]], random_count: Optional[int] = None,
+                   seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Builds the candidate hyperparameters of a search space.
+    :param space: Dict of each hyperparameter to the list of values to search
+    :param random_count: If set, only this many candidates are randomly chosen from the full grid
+    :return: List of candidates, each a dict of hyperparameters to values
+    """
+    unknown_keys = set(space).difference(SPACE_KEYS)
+    if unknown_keys:
+        raise Exception(f'Unknown hyperparameters in the search space: {", ".join(sorted(unknown_keys))}, '
+                        f'supported hyperparameters are {", ".join(SPACE_KEYS)}')
+    keys = sorted(space)
+    for key in keys:
+        if not isinstance(space[key], list) or not space[key]:
+            raise Exception(f'The search space for {key} must be a non-empty list of values')
+    candidates = [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+    if random_count and random_count < len(candidates):
+        candidates = random.Random(seed).sample(candidates, random_count)
+    return candidates
+
+
+def _train_candidate(
+        index: int, params: Dict[str, Any], train_data: Sequence, eval_data: Sequence, labels: Iterable[str],
+        candidate_dir: str, doc_cache_dir: str, patience: Optional[int], seed: Optional[int]
+) -> Dict[str, Any]:
+    """
+    Trains one candidate in a worker process, with the training output written to a log in the candidate dir.
+    """
+    os.makedirs(candidate_dir)
+    model_dir = os.path.join(candidate_dir, 'model')
+    kwargs = {key: tuple(value) if isinstance(value, list) else value for key, value in params.items()}
+    start_time = time.perf_counter()
+    with open(os.path.join(candidate_dir, 'train.log'), 'w') as log, contextlib.redirect_stdout(log):
+        scores = training.train_textcat_model(
+            load_data_func=lambda: (train_data, eval_data), output_dir=model_dir, labels=labels,
+            doc_cache_dir=doc_cache_dir, patience=patience, seed=seed, **kwargs
+        )
+    return {
+        'index': index,
+        'params': params,
+        'scores': {key: value for key, value in scores.items() if key.startswith('textcat_')},
+        'elapsed': time.perf_counter() - start_time,
+        'model_dir': model_dir,
+    }
+
+
+def _format_params(params: Dict[str, Any]) -> str:
+    return json.dumps(params, sort_keys=True)
+
+
+def rank_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Sorts the results of the candidates from the best to the worst evaluation F-score, candidates with the same
+    F-score keep their order.
+    """
+    return sorted(results, key=lambda result: result['scores']['textcat_f'], reverse=True)
+
+
+def write_results(results: List[Dict[str, Any]], results_file: str):
+    with open(results_file, 'w') as fobj:
+        fobj.write('RANK\tF\tP\tR\tACC\tMACRO_F\tSECONDS\tPARAMS\n')
+        for rank, result in enumerate(results):
+            scores = result['scores']
+            fobj.write('{}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.1f}\t{}\n'.format(
+                rank + 1, scores['textcat_f'], scores['textcat_p'], scores['textcat_r'], scores['textcat_accuracy'],
+                scores['textcat_macro_f'], result['elapsed'], _format_params(result['params'])
+            ))
+
+
+def run_sweep(
+        candidates: List[Dict[str, Any]], train_data: Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]],
+        eval_data: Sequence[Tuple[Any, Dict[str, Dict[str, bool]]]], labels: Iterable[str], output_dir: str,
+        doc_cache_dir: Optional[str] = None, patience: Optional[int] = None, seed: Optional[int] = None,
+        workers: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Trains the candidates in parallel on a process pool, all with the same training and evaluation data, then saves
+    the model of the candidate with the best evaluation F-score to the output dir along with a table of the results.
+    :param workers: The number of processes, defaults to the number of CPUs
+    :return: The results of the candidates that finished, sorted from best to worst
+    """
+    import spacy
+    if not candidates:
+        raise Exception('There are no candidates to train')
+    labels = sorted(labels)
+    output_parent_dir = os.path.dirname(os.path.abspath(output_dir))
+    if not os.path.exists(output_parent_dir):
+        os.makedirs(output_parent_dir)
+    sweep_dir = tempfile.mkdtemp(prefix='.yuri-sweep-', dir=output_parent_dir)
+    try:
+        # Tokenize once up front, every candidate then loads the same docs from the cache
+        doc_cache_dir = doc_cache_dir or os.path.join(sweep_dir, 'doc_cache')
+        training.tokenize_texts(
+            spacy.blank('en'), dataset.get_texts(train_data) + dataset.get_texts(eval_data), cache_dir=doc_cache_dir
+        )
+
+        workers = min(workers or os.cpu_count() or 1, len(candidates))
+        print(f'Training {len(candidates)} candidates with {workers} processes')
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    _train_candidate, index, params, train_data, eval_data, labels,
+                    os.path.join(sweep_dir, f'candidate-{index}'), doc_cache_dir, patience, seed
+                ): params
+                for index, params in enumerate(candidates)
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f'Candidate {_format_params(futures[future])} failed: {e}')
+                    continue
+                results.append(result)
+                print(f'Candidate {len(results)}/{len(candidates)} finished with F-score '
+                      f'{result["scores"]["textcat_f"]:.3f} in {result["elapsed"]:.1f}s '
+                      f'({_format_params(result["params"])})')
+        if not results:
+            raise Exception('Every candidate failed to train')
+
+        results = rank_results(results)
+        best = results[0]
+        print(f'Best candidate: {_format_params(best["params"])} with F-score {best["scores"]["textcat_f"]:.3f}')
+
+        # Only the best model is saved
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        spacy.load(best['model_dir']).to_disk(output_dir)
+        training.unload_model(output_dir)
+        print(f'Saved model to {output_dir}')
+        results_file = os.path.join(output_dir, RESULTS_FILE_NAME)
+        write_results(results, results_file)
+        print(f'Saved results to {results_file}')
+    finally:
+        shutil.rmtree(sweep_dir, ignore_errors=True)
+    return results
@@ -0,0 +1,144 @@
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak memory is then not reported
+    resource = None
+
+
+METRICS_FILE_NAME = 'yuri_metrics.json'
+
+
+def get_peak_rss_mb(children: bool = False) -> Optional[float]:
+    """
+    Retrieves the peak resident memory of this process, or of its finished child processes.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class Instrumentation(object):
+    """
+    Collects the time spent in each stage of a command, along with counters and per-epoch training metrics. Stages
+    may be timed from several threads, the time of a stage that runs more than once is added up.
+    """
+
+    def __init__(self, **info: Any):
+        """
+        :param info: Details of the run to include in the metrics, such as the command
+        """
+        self.info = info
+        self.spans: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.epochs: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._start_time = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        Times the stage with the given name.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.perf_counter() - start_time)
+
+    def add_span(self, name: str, seconds: float):
+        with self._lock:
+            span = self.spans.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            span['seconds'] += seconds
+            span['calls'] += 1
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_epoch(self, epoch: int, seconds: float, examples: int, words: int, **metrics: Any) -> Dict[str, Any]:
+        """
+        Records the metrics of a training epoch along with its throughput.
+        :param seconds: The seconds spent updating the model, excluding the evaluation
+        :return: The recorded metrics
+        """
+        epoch_metrics = dict(
+            epoch=epoch,
+            seconds=seconds,
+            examples_per_second=examples / seconds if seconds else 0.0,
+            words_per_second=words / seconds if seconds else 0.0,
+            **metrics,
+        )
+        with self._lock:
+            self.epochs.append(epoch_metrics)
+        return epoch_metrics
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                info=self.info,
+                started_at=self._started_at,
+                total_seconds=time.perf_counter() - self._start_time,
+                peak_rss_mb=get_peak_rss_mb(),
+                peak_children_rss_mb=get_peak_rss_mb(children=True),
+                spans={name: dict(span) for name, span in self.spans.items()},
+                counters=dict(self.counters),
+                epochs=list(self.epochs),
+            )
+
+    def write(self, metrics_file: str):
+        dir_path = os.path.dirname(metrics_file)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        tmp_file = f'{metrics_file}.tmp'
+        with open(tmp_file, 'w') as fobj:
+            fobj.write(json.dumps(self.to_dict(), indent=2))
+        os.replace(tmp_file, metrics_file)
+
+    def print_summary(self):
+        metrics = self.to_dict()
+        stages = ', '.join(f'{name} {span["seconds"]:.2f}s' for name, span in metrics['spans'].items())
+        peak_rss = f', peak RSS {metrics["peak_rss_mb"]:.0f} MB' if metrics['peak_rss_mb'] is not None else ''
+        print(f'Took {metrics["total_seconds"]:.2f}s ({stages}){peak_rss}')
+
+
+@contextmanager
+def instrument(metrics_file: Optional[str] = None, profile_file: Optional[str] = None,
+               **info: Any) -> Iterator[Instrumentation]:
+    """
+    Instruments a command, printing a summary of the stage times at the end.
+    :param metrics_file: If set, the metrics are written to this JSON file at the end, even if the command failed
+    :param profile_file: If set, the command is profiled with cProfile and the stats are dumped to this file, they may
+    be read with pstats or snakeviz
+    """
+    instrumentation = Instrumentation(**info)
+    profiler = None
+    if profile_file:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield instrumentation
+    except BaseException:
+        instrumentation.info['failed'] = True
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+            print(f'Wrote the profile to {profile_file}')
+        instrumentation.print_summary()
+        if metrics_file:
+            instrumentation.write(metrics_file)
+            print(f'Wrote the metrics to {metrics_file}')
@@ -0,0 +1,137 @@
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+
+class MessageMirror(object):
+    """
+    Local copy of the history of slack channels stored in SQLite and indexed by channel and message timestamp.
+
+    Alongside the messages, the sync state of each channel is tracked: every message between the oldest and newest
+    synced timestamps has been stored, and the backfill is complete once the oldest message of the channel is stored.
+    Message timestamps are compared as strings, which orders them correctly since slack uses fixed width timestamps.
+    """
+
+    def __init__(self, mirror_file: str):
+        self.mirror_file = mirror_file
+        dir_path = os.path.dirname(mirror_file)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        # The mirror may be read from a background thread while classifying, so guard the connection with a lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(mirror_file, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                'channel_id TEXT NOT NULL, ts TEXT NOT NULL, message TEXT NOT NULL, PRIMARY KEY (channel_id, ts))'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS channels ('
+                'channel_id TEXT PRIMARY KEY, name TEXT, oldest_ts TEXT, newest_ts TEXT, '
+                'backfill_complete INTEGER NOT NULL DEFAULT 0)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS channels_name ON channels (name)')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self) -> 'MessageMirror':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_channel(self, channel_id: str, name: Optional[str] = None):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR IGNORE INTO channels (channel_id) VALUES (?)', (channel_id,))
+            if name:
+                self._connection.execute('UPDATE channels SET name = ? WHERE channel_id = ?', (name, channel_id))
+
+    def find_channel_id(self, name: str) -> Optional[str]:
+        """
+        Finds the ID of a synced channel by its name (with or without the # prefix).
+        """
+        if name.startswith('#'):
+            name = name[1:]
+        with self._lock:
+            row = self._connection.execute('SELECT channel_id FROM channels WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def get_sync_state(self, channel_id: str) -> Tuple[Optional[str], Optional[str], bool]:
+        """
+        :return: Tuple of the oldest and newest synced timestamps and whether the backfill is complete
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT oldest_ts, newest_ts, backfill_complete FROM channels WHERE channel_id = ?', (channel_id,)
+            ).fetchone()
+        if not row:
+            return None, None, False
+        return row[0], row[1], bool(row[2])
+
+    def set_sync_state(self, channel_id: str, oldest_ts: Optional[str], newest_ts: Optional[str],
+                       backfill_complete: bool):
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR IGNORE INTO channels (channel_id) VALUES (?)', (channel_id,))
+            self._connection.execute(
+                'UPDATE channels SET oldest_ts = ?, newest_ts = ?, backfill_complete = ? WHERE channel_id = ?',
+                (oldest_ts, newest_ts, int(backfill_complete), channel_id)
+            )
+
+    def add_messages(self, channel_id: str, messages: Iterable[dict]) -> int:
+        """
+        Stores the messages, replacing any messages with the same timestamp.
+        :return: The number of messages stored
+        """
+        rows = [(channel_id, message['ts'], json.dumps(message)) for message in messages]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO messages (channel_id, ts, message) VALUES (?, ?, ?)', rows
+            )
+        return len(rows)
+
+    def count(self, channel_id: str) -> int:
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM messages WHERE channel_id = ?', (channel_id,)
+            ).fetchone()[0]
+
+    def get_messages(
+            self, channel_id: str, start_timestamp: Optional[str], end_timestamp: Optional[str], direction: bool,
+            batch_size: Optional[int]
+    ) -> Tuple[List[dict], Optional[str], Optional[str]]:
+        """
+        Retrieves a list of messages in the same way as retrieving them from slack. Older messages are retrieved
+        before the start timestamp and newer messages are retrieved right after the end timestamp.
+        :param direction: True to retrieve newer messages (yuri.DIRECTION_NEWER), False for older messages
+        :return: Tuple of messages sorted according to the direction and the start/end timestamps
+        """
+        limit = batch_size if batch_size else -1
+        with self._lock:
+            if not direction:
+                rows = self._connection.execute(
+                    'SELECT message FROM messages WHERE channel_id = ? AND (? IS NULL OR ts < ?) '
+                    'ORDER BY ts DESC LIMIT ?',
+                    (channel_id, start_timestamp, start_timestamp, limit)
+                ).fetchall()
+            elif end_timestamp is None:
+                # Without an end timestamp, start with the newest messages like slack does
+                rows = self._connection.execute(
+                    'SELECT message FROM messages WHERE channel_id = ? ORDER BY ts DESC LIMIT ?', (channel_id, limit)
+                ).fetchall()
+                rows.reverse()
+            else:
+                rows = self._connection.execute(
+                    'SELECT message FROM messages WHERE channel_id = ? AND ts > ? ORDER BY ts ASC LIMIT ?',
+                    (channel_id, end_timestamp, limit)
+                ).fetchall()
+        messages = [json.loads(row[0]) for row in rows]
+        if not direction:
+            start_timestamp = messages[-1]['ts'] if messages else None
+        else:
+            end_timestamp = messages[-1]['ts'] if messages else None
+        return messages, start_timestamp, end_timestamp
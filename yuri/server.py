@@ -0,0 +1,383 @@
+
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+from .instrumentation import METRICS_FILE_NAME
+from .training import MANIFEST_FILE_NAME
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8642
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 2.0
+DEFAULT_RELOAD_INTERVAL = 5.0
+# The number of most recent request latencies kept for the percentiles
+LATENCY_WINDOW = 10000
+# Files written to the model dir after the model is saved, which do not change the model
+IGNORED_MODEL_FILES = (METRICS_FILE_NAME, MANIFEST_FILE_NAME)
+
+
+def get_model_version(model_dir: str) -> float:
+    """
+    Finds the newest modification time of the files in a model directory, which changes when a model is saved there.
+    A compact model file is versioned by its own modification time.
+    """
+    if os.path.isfile(model_dir):
+        return os.stat(model_dir).st_mtime
+    newest = 0.0
+    for dir_path, _, file_names in os.walk(model_dir):
+        for file_name in file_names:
+            if dir_path == model_dir and file_name in IGNORED_MODEL_FILES:
+                continue
+            try:
+                newest = max(newest, os.stat(os.path.join(dir_path, file_name)).st_mtime)
+            except FileNotFoundError:
+                # Removed while a model is being saved, the version is checked again later
+                continue
+    return newest
+
+
+class PendingTexts(object):
+    """
+    Texts of one request waiting to be scored in a batch.
+    """
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.cats: Optional[List[Dict[str, float]]] = None
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """
+    Scores the texts of concurrent requests together. A background thread waits for the first pending request, then
+    keeps collecting requests until the batch is full or the max wait has passed, and scores them all in one call.
+    """
+
+    def __init__(self, score_func: Callable[[List[str]], List[Dict[str, float]]],
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_wait: float = DEFAULT_MAX_WAIT_MS / 1000,
+                 on_batch: Optional[Callable[[int], None]] = None):
+        """
+        :param score_func: Scores a list of texts, returning the categories of each text
+        :param max_batch_size: The number of texts after which a batch is scored without waiting for more requests
+        :param max_wait: The seconds to wait for more requests after the first one of a batch
+        :param on_batch: If set, called with the number of texts of every scored batch
+        """
+        self._score_func = score_func
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._on_batch = on_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def score(self, texts: List[str]) -> List[Dict[str, float]]:
+        """
+        Waits until the texts were scored in a batch.
+        :return: The categories of each text
+        """
+        if self._stopped:
+            raise Exception('The batcher was stopped')
+        pending = PendingTexts(texts)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error:
+            raise pending.error
+        return pending.cats
+
+    def stop(self):
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            count = len(first.texts)
+            deadline = time.perf_counter() + self._max_wait
+            stop = False
+            while count < self._max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stop = True
+                    break
+                batch.append(pending)
+                count += len(pending.texts)
+            self._score_batch(batch, count)
+            if stop:
+                return
+
+    def _score_batch(self, batch: List[PendingTexts], count: int):
+        try:
+            cats = self._score_func([text for pending in batch for text in pending.texts])
+            offset = 0
+            for pending in batch:
+                pending.cats = cats[offset:offset + len(pending.texts)]
+                offset += len(pending.texts)
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        for pending in batch:
+            pending.done.set()
+        if self._on_batch:
+            self._on_batch(count)
+
+
+class ServerMetrics(object):
+    """
+    Counters of the requests served, shared by all request threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_time = time.time()
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.texts = 0
+        self.batches = 0
+        self.batched_texts = 0
+        self.reloads = 0
+
+    def add_request(self, texts: int, latency: float, error: bool = False):
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            else:
+                self.texts += texts
+                self._latencies.append(latency)
+
+    def add_batch(self, texts: int):
+        with self._lock:
+            self.batches += 1
+            self.batched_texts += texts
+
+    def add_reload(self):
+        with self._lock:
+            self.reloads += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            uptime = time.time() - self._start_time
+            latencies = sorted(self._latencies)
+            percentiles = {}
+            for percentile in (50, 95, 99):
+                index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+                percentiles[f'latency_p{percentile}_ms'] = latencies[index] * 1000 if latencies else None
+            return dict(
+                uptime_seconds=uptime,
+                requests=self.requests,
+                errors=self.errors,
+                texts=self.texts,
+                texts_per_second=self.texts / uptime if uptime else 0.0,
+                batches=self.batches,
+                mean_batch_size=self.batched_texts / self.batches if self.batches else 0.0,
+                reloads=self.reloads,
+                **percentiles,
+            )
+
+
+class ModelServer(object):
+    """
+    Serves the category scores of a trained model over HTTP, either on a TCP port or a Unix socket.
+
+    POST /classify with {"text": "..."} or {"texts": ["...", ...]} returns the categories of each text and the label
+    with the best score. GET /metrics returns the latency and throughput counters and GET /health the loaded model.
+
+    The model directory is checked for a newly saved model in the background. The new model is loaded next to the old
+    one and swapped in between batches, so requests are never dropped while reloading.
+    """
+
+    def __init__(self, model_dir: str, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 socket_path: Optional[str] = None, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms: float = DEFAULT_MAX_WAIT_MS, reload_interval: Optional[float] = DEFAULT_RELOAD_INTERVAL,
+                 load_func: Optional[Callable[[str], Any]] = None):
+        """
+        :param socket_path: If set, listen on this Unix socket instead of the host and port
+        :param reload_interval: The seconds between checks for a new model, None to never reload
+        :param load_func: Loads the model of a directory, defaults to loading a model dir or a compact model file
+        """
+        self.model_dir = model_dir
+        self.metrics = ServerMetrics()
+        if load_func is None:
+            from . import training
+            load_func = training.read_model
+        self._load_func = load_func
+        self._reload_interval = reload_interval
+        self._stop_event = threading.Event()
+        self._model_version = get_model_version(model_dir)
+        self._nlp = self._load_func(model_dir)
+        self._loaded_at = time.time()
+        self._batcher = MicroBatcher(self._score, max_batch_size=max_batch_size, max_wait=max_wait_ms / 1000,
+                                     on_batch=self.metrics.add_batch)
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self._server = _ThreadingUnixHTTPServer(socket_path, self._handler_class())
+            self.address = socket_path
+        else:
+            from http.server import ThreadingHTTPServer
+            self._server = ThreadingHTTPServer((host, port), self._handler_class())
+            self.address = f'http://{host}:{self._server.server_port}'
+        self._socket_path = socket_path
+        self._threads: List[threading.Thread] = []
+
+    def _score(self, texts: List[str]) -> List[Dict[str, float]]:
+        # A model swapped in while scoring is only used from the next batch
+        nlp = self._nlp
+        return [dict(doc.cats) for doc in nlp.pipe(texts, batch_size=max(len(texts), 1))]
+
+    def reload_if_changed(self) -> bool:
+        """
+        Loads the model again if a new one was saved in the model dir since it was loaded. A model that is still being
+        saved is only loaded once its files stopped changing.
+        :return: True if a new model was loaded
+        """
+        version = get_model_version(self.model_dir)
+        if version == self._model_version:
+            return False
+        # Wait until the model is completely saved
+        time.sleep(min(self._reload_interval or 1.0, 1.0))
+        if get_model_version(self.model_dir) != version:
+            return False
+        try:
+            nlp = self._load_func(self.model_dir)
+        except Exception as e:
+            print(f'Failed to load the new model from {self.model_dir}, still serving the previous one: {e}')
+            self._model_version = version
+            return False
+        self._nlp = nlp
+        self._model_version = version
+        self._loaded_at = time.time()
+        self.metrics.add_reload()
+        print(f'Loaded the new model from {self.model_dir}')
+        return True
+
+    def _watch(self):
+        while not self._stop_event.wait(self._reload_interval):
+            self.reload_if_changed()
+
+    def start(self) -> 'ModelServer':
+        self._threads.append(threading.Thread(target=self._server.serve_forever, daemon=True))
+        if self._reload_interval:
+            self._threads.append(threading.Thread(target=self._watch, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        self._server.shutdown()
+        self._server.server_close()
+        self._batcher.stop()
+        if self._socket_path and os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+
+    def __enter__(self) -> 'ModelServer':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def serve_forever(self):
+        self.start()
+        print(f'Serving the model from {self.model_dir} on {self.address}')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def classify(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        if isinstance(body.get('texts'), list):
+            texts = [str(text) for text in body['texts']]
+        elif 'text' in body:
+            texts = [str(body['text'])]
+        else:
+            raise ValueError('The request must have a "text" or a "texts" list')
+        start_time = time.perf_counter()
+        try:
+            cats = self._batcher.score(texts)
+        except Exception:
+            self.metrics.add_request(len(texts), time.perf_counter() - start_time, error=True)
+            raise
+        self.metrics.add_request(len(texts), time.perf_counter() - start_time)
+        results = [
+            {'cats': text_cats, 'label': max(text_cats, key=text_cats.get) if text_cats else None}
+            for text_cats in cats
+        ]
+        return {'results': results} if 'texts' in body else results[0]
+
+    def health(self) -> Dict[str, Any]:
+        return {'model_dir': self.model_dir, 'loaded_at': self._loaded_at}
+
+    def _handler_class(self):
+        from http.server import BaseHTTPRequestHandler
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    self._respond(200, server.metrics.to_dict())
+                elif self.path == '/health':
+                    self._respond(200, server.health())
+                else:
+                    self._respond(404, {'error': f'Unknown path {self.path}'})
+
+            def do_POST(self):
+                if self.path != '/classify':
+                    self._respond(404, {'error': f'Unknown path {self.path}'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                    if not isinstance(body, dict):
+                        raise ValueError('The request must be a JSON object')
+                    response = server.classify(body)
+                except ValueError as e:
+                    self._respond(400, {'error': str(e)})
+                    return
+                except Exception as e:
+                    self._respond(500, {'error': str(e)})
+                    return
+                self._respond(200, response)
+
+            def _respond(self, status: int, payload: Dict[str, Any]):
+                content = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def address_string(self) -> str:
+                # Unix socket clients have no address
+                return self.client_address[0] if self.client_address else server.address
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
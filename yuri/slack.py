@@ -0,0 +1,323 @@
+
+import json
+import os
+import slacker
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Iterator, List, Optional, Tuple
+from . import DEFAULT_CHANNEL_CACHE_FILE, DEFAULT_SYNC_PAGE_SIZE, DEFAULT_THREAD_WORKERS, DIRECTION_OLDER, \
+    get_message_id, mirror
+
+
+DEFAULT_CHANNEL_CACHE_TTL = 24 * 60 * 60
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 5
+DEFAULT_RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+SLACK_API_URL = 'https://slack.com/api/'
+
+
+class SlackSession(Session):
+    """
+    Session that sends slack API requests to another API URL, such as a local fake slack API.
+    """
+
+    def __init__(self, api_url: str):
+        super().__init__()
+        self.api_url = api_url if api_url.endswith('/') else f'{api_url}/'
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(SLACK_API_URL):
+            url = f'{self.api_url}{url[len(SLACK_API_URL):]}'
+        return super().request(method, url, *args, **kwargs)
+
+
+def create_session(pool_size: int = DEFAULT_POOL_SIZE, retries: int = DEFAULT_RETRIES,
+                   api_url: Optional[str] = None) -> Session:
+    """
+    Creates an HTTP session that keeps connections alive in a pool and automatically retries connection errors,
+    server errors and rate limited (HTTP 429) requests with an exponential backoff, honouring the Retry-After header.
+    :param api_url: The slack API URL to use instead of the real one, defaults to the SLACK_API_URL env var if set
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=DEFAULT_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        # Slack API methods used here only read data, so they are safe to retry
+        allowed_methods=frozenset(['GET', 'POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    api_url = api_url or os.environ.get('SLACK_API_URL')
+    session = SlackSession(api_url) if api_url else Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# The session and clients shared by everything in this process when no session is provided
+_session: Optional[Session] = None
+_clients: Dict[str, slacker.Slacker] = {}
+
+
+def get_session() -> Session:
+    global _session
+    if _session is None:
+        _session = create_session()
+    return _session
+
+
+def close_session():
+    """
+    Closes the shared session along with the clients using it.
+    """
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+    _clients.clear()
+
+
+def get_client(token: str, session: Optional[Session] = None) -> slacker.Slacker:
+    """
+    Retrieves a client for the token, reusing one client on the shared session unless a session is provided.
+    """
+    if not token:
+        raise Exception(f'No token was provided')
+    if not token.startswith('xoxp-'):
+        raise Exception(f'The provided token is invalid since it not a user token, please use a user token instead')
+    if session is not None:
+        return slacker.Slacker(token, session=session)
+    client = _clients.get(token)
+    if client is None:
+        client = slacker.Slacker(token, session=get_session())
+        _clients[token] = client
+    return client
+
+
+def load_channel_cache(cache_file: str) -> Dict[str, dict]:
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, 'r') as fobj:
+        try:
+            return json.loads(fobj.read()).get('channels', {})
+        except ValueError:
+            print(f'Warning: ignoring invalid channel cache {cache_file}')
+            return {}
+
+
+def write_channel_cache(channels: Dict[str, dict], cache_file: str):
+    dir_path = os.path.dirname(cache_file)
+    if dir_path and not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    # Write to a temporary file first so that concurrent runs never read a partial cache
+    tmp_file = f'{cache_file}.tmp'
+    with open(tmp_file, 'w') as fobj:
+        fobj.write(json.dumps({'channels': channels}, indent=2))
+    os.replace(tmp_file, cache_file)
+
+
+def channel_id_resolves(client: slacker.Slacker, channel_id: str, name: str) -> bool:
+    """
+    Checks that the channel ID still exists and has the given name.
+    """
+    try:
+        response = client.conversations.info(channel_id)
+    except slacker.Error:
+        return False
+    return response.body.get('channel', {}).get('name') == name
+
+
+def get_channel_id(token: str, name: str, session: Optional[Session] = None,
+                   cache_file: Optional[str] = DEFAULT_CHANNEL_CACHE_FILE,
+                   cache_ttl: float = DEFAULT_CHANNEL_CACHE_TTL) -> str:
+    """
+    Retrieves the ID of the channel with the given name, using the cache file (if set) to avoid listing every
+    channel. Cached IDs are used until they expire after the TTL (in seconds) or no longer resolve to the channel.
+    """
+    # Strip off # prefix if specified
+    if name.startswith('#'):
+        name = name[1:]
+
+    client = get_client(token, session=session)
+    channel_cache = load_channel_cache(cache_file) if cache_file else {}
+    cached = channel_cache.get(name)
+    if cached and time.time() - cached['time'] < cache_ttl:
+        if channel_id_resolves(client, cached['id'], name):
+            return cached['id']
+        print(f'Cached channel ID {cached["id"]} for {name} is no longer valid, retrieving it again')
+
+    channel_id = None
+    start_query = True
+    cursor = None
+    while (start_query or cursor) and not channel_id:
+        start_query = False
+        # Query 1000 at a time (the max supported) to keep the number of requests lower
+        response = client.conversations.list(types=['public_channel', 'private_channel'], cursor=cursor, limit=1000)
+        channels = response.body['channels']
+        now = time.time()
+        for channel in channels:
+            # Cache every channel seen so that looking up other channels later is cheaper
+            channel_cache[channel['name']] = {'id': channel['id'], 'time': now}
+            if channel['name'] == name:
+                channel_id = channel['id']
+        cursor = response.body.get('response_metadata', {}).get('next_cursor')
+
+    if cache_file:
+        if not channel_id:
+            channel_cache.pop(name, None)
+        write_channel_cache(channel_cache, cache_file)
+    if not channel_id:
+        raise Exception(f'Could not find channel {name} in list of channels for this user')
+    return channel_id
+
+
+def get_messages(
+        token: str, channel_id: str, start_timestamp: Optional[str], end_timestamp: Optional[str],
+        direction: bool, batch_size: Optional[int], session: Optional[Session] = None
+) -> Tuple[List[dict], Optional[str], Optional[str]]:
+    """
+    Retrieves a list of messages
+    :return: Tuple of messages sorted according to the direction and the start/end timestamps
+    """
+    client = get_client(token, session=session)
+    if direction == DIRECTION_OLDER:
+        timestamp_args = {'latest': start_timestamp}
+    else:
+        timestamp_args = {'oldest': end_timestamp}
+    response = client.conversations.history(channel_id, limit=batch_size, **timestamp_args)
+    # The messages are already in reverse age order, with the latest chronologically at the front of the list
+    messages = response.body['messages']
+    if direction == DIRECTION_OLDER:
+        start_timestamp = messages[-1]['ts'] if len(messages) > 0 else None
+    else:
+        # If we want newer messages, reverse the order
+        messages.reverse()
+        end_timestamp = messages[-1]['ts'] if len(messages) > 0 else None
+    return messages, start_timestamp, end_timestamp
+
+
+def get_history_pages(token: str, channel_id: str, oldest: Optional[str] = None, latest: Optional[str] = None,
+                      page_size: int = DEFAULT_SYNC_PAGE_SIZE,
+                      session: Optional[Session] = None) -> Iterator[List[dict]]:
+    """
+    Pages through all messages between the oldest and latest timestamps (exclusive) with cursors.
+    :return: Iterator of pages of messages, each page and the pages themselves ordered from newest to oldest
+    """
+    client = get_client(token, session=session)
+    cursor = None
+    while True:
+        response = client.conversations.history(
+            channel_id, cursor=cursor, oldest=oldest, latest=latest, limit=page_size
+        )
+        yield response.body['messages']
+        cursor = response.body.get('response_metadata', {}).get('next_cursor')
+        if not response.body.get('has_more') or not cursor:
+            return
+
+
+def get_replies(token: str, channel_id: str, thread_ts: str, page_size: int = DEFAULT_SYNC_PAGE_SIZE,
+                session: Optional[Session] = None) -> List[dict]:
+    """
+    Pages through the replies of a thread.
+    :param thread_ts: The timestamp of the message that started the thread
+    :return: The replies from oldest to newest, without the message that started the thread
+    """
+    client = get_client(token, session=session)
+    replies = []
+    cursor = None
+    while True:
+        try:
+            response = client.conversations.replies(channel_id, thread_ts, cursor=cursor, limit=page_size)
+        except slacker.Error as e:
+            # The thread may have been deleted since its message was retrieved
+            print(f'Warning: could not retrieve the replies of thread {thread_ts} ({e})')
+            return replies
+        replies.extend(message for message in response.body['messages'] if message['ts'] != thread_ts)
+        cursor = response.body.get('response_metadata', {}).get('next_cursor')
+        if not response.body.get('has_more') or not cursor:
+            return replies
+
+
+def expand_threads(token: str, channel_id: str, messages: List[dict], workers: int = DEFAULT_THREAD_WORKERS,
+                   session: Optional[Session] = None) -> List[dict]:
+    """
+    Adds the replies of the threads started by the messages right after the message starting each thread. The threads
+    are retrieved concurrently, rate limited requests are retried by the session after the delay slack asks for.
+    :param workers: The number of threads to retrieve at the same time
+    :return: The messages with the replies, replies also sent to the channel are only included once
+    """
+    thread_messages = [
+        message for message in messages
+        if message.get('reply_count') and message.get('thread_ts', message['ts']) == message['ts']
+    ]
+    if not thread_messages:
+        return messages
+    # Create the shared client up front instead of in every worker
+    get_client(token, session=session)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(thread_messages)))) as executor:
+        thread_replies = dict(zip(
+            (message['ts'] for message in thread_messages),
+            executor.map(lambda message: get_replies(token, channel_id, message['ts'], session=session),
+                         thread_messages)
+        ))
+    message_ids = {get_message_id(message) for message in messages}
+    expanded = []
+    for message in messages:
+        expanded.append(message)
+        for reply in thread_replies.get(message['ts'], []):
+            reply_id = get_message_id(reply)
+            if reply_id not in message_ids:
+                message_ids.add(reply_id)
+                expanded.append(reply)
+    return expanded
+
+
+def sync_channel(token: str, channel_id: str, message_mirror: mirror.MessageMirror,
+                 page_size: int = DEFAULT_SYNC_PAGE_SIZE, session: Optional[Session] = None,
+                 thread_workers: Optional[int] = None) -> int:
+    """
+    Syncs the history of the channel into the mirror. Messages newer than the newest synced message are retrieved
+    first, then the backfill of older messages continues from the oldest synced message until the start of the
+    channel. The sync state is saved after every page, so an interrupted sync resumes where it stopped.
+    :param thread_workers: If set, the replies of the threads started by the retrieved messages are stored as well,
+    retrieving this many threads at the same time
+    :return: The number of messages retrieved
+    """
+    oldest_ts, newest_ts, backfill_complete = message_mirror.get_sync_state(channel_id)
+    retrieved = 0
+
+    def add_page(page: List[dict]) -> int:
+        # Replies are stored along with the page, but the synced range only depends on the messages of the channel
+        if thread_workers:
+            page = expand_threads(token, channel_id, page, workers=thread_workers, session=session)
+        return message_mirror.add_messages(channel_id, page)
+
+    if newest_ts or backfill_complete:
+        # The synced range only moves forward once all newer messages are stored, otherwise a gap could be left
+        latest_ts = None
+        for page in get_history_pages(token, channel_id, oldest=newest_ts, page_size=page_size, session=session):
+            retrieved += add_page(page)
+            if page and not latest_ts:
+                latest_ts = page[0]['ts']
+            if page and not oldest_ts:
+                oldest_ts = page[-1]['ts']
+            print(f'Retrieved {retrieved} new message(s)')
+        newest_ts = latest_ts or newest_ts
+        message_mirror.set_sync_state(channel_id, oldest_ts, newest_ts, backfill_complete)
+
+    if not backfill_complete:
+        for page in get_history_pages(token, channel_id, latest=oldest_ts, page_size=page_size, session=session):
+            retrieved += add_page(page)
+            if page:
+                newest_ts = newest_ts or page[0]['ts']
+                oldest_ts = page[-1]['ts']
+            message_mirror.set_sync_state(channel_id, oldest_ts, newest_ts, False)
+            print(f'Retrieved {retrieved} message(s), backfilled to {oldest_ts}')
+        message_mirror.set_sync_state(channel_id, oldest_ts, newest_ts, True)
+
+    return retrieved
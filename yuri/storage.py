@@ -0,0 +1,221 @@
+
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+
+JOURNAL_SUFFIX = '.journal'
+DEFAULT_COMPACT_THRESHOLD = 1000
+RECORD_CLASSIFICATION = 'classification'
+RECORD_TIMESTAMPS = 'timestamps'
+RECORD_CHANNEL = 'channel'
+
+
+class DataStore(object):
+    """
+    Journaled storage for a classification data file.
+
+    The data file itself holds a snapshot of all classifications and the start/end timestamps as of a version. Every
+    change after that snapshot is appended as a JSON line record to the journal file next to it (with the
+    JOURNAL_SUFFIX), each with an increasing version. Loading replays the journal on top of the snapshot, and once the
+    journal has enough records it is compacted into a new snapshot. The previous snapshot is kept as
+    <data file>.<version> when compacting. Data files written before the journal existed are read as a version 0
+    snapshot, so they are migrated on the first compaction.
+
+    Besides the start/end timestamps of the data file, the start/end timestamps reached in each channel are kept by
+    channel ID along with the name of the channel, so that several channels may be classified into one data file.
+    """
+
+    def __init__(self, data_file: str, compact_threshold: int = DEFAULT_COMPACT_THRESHOLD):
+        self.data_file = data_file
+        self.journal_file = f'{data_file}{JOURNAL_SUFFIX}'
+        self.compact_threshold = compact_threshold
+        self.data: Dict[str, dict] = {}
+        self.start_timestamp: Optional[str] = None
+        self.end_timestamp: Optional[str] = None
+        self.channels: Dict[str, dict] = {}
+        self.version = 0
+        self.snapshot_version = 0
+        self.journal_records = 0
+        self.loaded = False
+
+    def exists(self) -> bool:
+        return os.path.exists(self.data_file) or os.path.exists(self.journal_file)
+
+    def load(self) -> Tuple[Dict[str, dict], Optional[str], Optional[str]]:
+        """
+        Loads the snapshot and replays the journal on top of it.
+        :return: Tuple of the data and the start/end timestamps
+        """
+        self.data = {}
+        self.start_timestamp = None
+        self.end_timestamp = None
+        self.channels = {}
+        self.version = 0
+        self.snapshot_version = 0
+        self.journal_records = 0
+
+        if os.path.exists(self.data_file):
+            with open(self.data_file, 'r') as fobj:
+                snapshot = json.loads(fobj.read())
+            if not snapshot:
+                raise Exception(f'The existing data file ({self.data_file}) is invalid, please check the file')
+            self.data = snapshot.get('data', {})
+            self.start_timestamp = snapshot.get('start_timestamp')
+            self.end_timestamp = snapshot.get('end_timestamp')
+            self.channels = snapshot.get('channels', {})
+            self.version = self.snapshot_version = snapshot.get('version', 0)
+
+        if os.path.exists(self.journal_file):
+            self._replay_journal()
+
+        self.loaded = True
+        return self.data, self.start_timestamp, self.end_timestamp
+
+    def _replay_journal(self):
+        valid_length = 0
+        with open(self.journal_file, 'rb') as fobj:
+            for line in fobj:
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # Only the last record may be incomplete (from an interrupted write), drop it and anything after it
+                    print(f'Warning: discarding incomplete record at the end of {self.journal_file}')
+                    break
+                valid_length += len(line)
+                # Records up to the snapshot version have already been compacted into the data file
+                if record['version'] <= self.snapshot_version:
+                    continue
+                self._apply(record)
+                self.journal_records += 1
+        if valid_length < os.path.getsize(self.journal_file):
+            with open(self.journal_file, 'r+b') as fobj:
+                fobj.truncate(valid_length)
+
+    def _apply(self, record: dict):
+        if record['type'] == RECORD_CLASSIFICATION:
+            self.data[record['id']] = record['classification']
+        elif record['type'] == RECORD_TIMESTAMPS:
+            self.start_timestamp = record['start_timestamp']
+            self.end_timestamp = record['end_timestamp']
+        elif record['type'] == RECORD_CHANNEL:
+            self.channels[record['channel_id']] = {
+                'name': record['name'],
+                'start_timestamp': record['start_timestamp'],
+                'end_timestamp': record['end_timestamp'],
+            }
+        else:
+            raise Exception(f'Unknown record type "{record["type"]}" found in {self.journal_file}')
+        self.version = record['version']
+
+    def append(self, classifications: Dict[str, dict], start_timestamp: Optional[str],
+               end_timestamp: Optional[str], channel_id: Optional[str] = None,
+               channel_name: Optional[str] = None) -> None:
+        """
+        Appends new or updated classifications and the start/end timestamps (if changed) to the journal, compacting
+        it into the data file if it has grown past the compaction threshold.
+        :param channel_id: If set, the timestamps are the ones reached in this channel instead of the data file's
+        :param channel_name: The name of the channel, kept along with its timestamps
+        """
+        if not self.loaded:
+            self.load()
+
+        records: List[dict] = []
+        for message_id, classification in classifications.items():
+            records.append({
+                'type': RECORD_CLASSIFICATION,
+                'id': message_id,
+                'classification': classification,
+            })
+        if channel_id is not None:
+            channel = {
+                'name': channel_name or self.channels.get(channel_id, {}).get('name'),
+                'start_timestamp': start_timestamp,
+                'end_timestamp': end_timestamp,
+            }
+            if self.channels.get(channel_id) != channel:
+                records.append({'type': RECORD_CHANNEL, 'channel_id': channel_id, **channel})
+        elif start_timestamp != self.start_timestamp or end_timestamp != self.end_timestamp:
+            records.append({
+                'type': RECORD_TIMESTAMPS,
+                'start_timestamp': start_timestamp,
+                'end_timestamp': end_timestamp,
+            })
+        if not records:
+            return
+
+        lines = []
+        for record in records:
+            record['version'] = self.version + 1
+            self._apply(record)
+            lines.append(json.dumps(record))
+
+        self._make_dir()
+        with open(self.journal_file, 'a') as fobj:
+            fobj.write('\n'.join(lines) + '\n')
+            fobj.flush()
+            os.fsync(fobj.fileno())
+        self.journal_records += len(records)
+
+        if self.journal_records >= self.compact_threshold:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Writes the current state as a new snapshot and removes the journal.
+        """
+        if not self.loaded:
+            self.load()
+
+        self._make_dir()
+        tmp_file = f'{self.data_file}.tmp'
+        with open(tmp_file, 'w') as fobj:
+            fobj.write(json.dumps({
+                'data': self.data,
+                'start_timestamp': self.start_timestamp,
+                'end_timestamp': self.end_timestamp,
+                'channels': self.channels,
+                'version': self.version,
+            }, indent=2))
+            fobj.flush()
+            os.fsync(fobj.fileno())
+
+        # Keep the previous snapshot under its version, a hard link avoids copying it
+        if os.path.exists(self.data_file):
+            previous_file = f'{self.data_file}.{self.snapshot_version}'
+            if os.path.exists(previous_file):
+                os.remove(previous_file)
+            try:
+                os.link(self.data_file, previous_file)
+            except OSError:
+                shutil.copy(self.data_file, previous_file)
+        os.replace(tmp_file, self.data_file)
+
+        # Everything in the journal is now part of the snapshot
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.snapshot_version = self.version
+        self.journal_records = 0
+        print(f'Compacted data file {self.data_file} at version {self.version}')
+
+    def _make_dir(self):
+        dir_path = os.path.dirname(self.data_file)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+
+
+# Stores used by this process, keyed by the real path of the data file
+_stores: Dict[str, DataStore] = {}
+
+
+def get_store(data_file: str) -> DataStore:
+    """
+    Retrieves the store for the given data file, creating it if it has not been used yet by this process.
+    """
+    key = os.path.realpath(data_file)
+    store = _stores.get(key)
+    if store is None:
+        store = DataStore(data_file)
+        _stores[key] = store
+    return store
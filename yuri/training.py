@@ -1,9 +1,103 @@
 
+import contextlib
+import hashlib
+import json
+import os
 import random
-import spacy
+import tempfile
+import time
 from pathlib import Path
-from spacy.util import minibatch, compounding, decaying
-from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
+from .instrumentation import Instrumentation
+
+# spaCy and numpy are slow to import, so they are only imported by the functions using them to keep the defaults
+# here cheap to read
+if TYPE_CHECKING:
+    import numpy
+
+
+DEFAULT_TEST_BATCH_SIZE = 256
+DEFAULT_N_ITER = 20
+DEFAULT_PATIENCE = 5
+DEFAULT_ARCHITECTURE = 'simple_cnn'
+# We mainly have small data sets, so it's recommended to use a high dropout rate at first
+# From https://spacy.io/usage/training#tips-dropout
+DEFAULT_DROPOUT = (0.6, 0.2, 1e-4)
+DEFAULT_BATCH_SIZE = (4.0, 32.0, 1.001)
+DEFAULT_TOKENIZE_BATCH_SIZE = 1000
+DOC_CACHE_SUFFIX = '.docbin'
+MANIFEST_FILE_NAME = 'yuri_manifest.json'
+
+# Models loaded by this process, keyed by the real path of the model directory
+_loaded_models: Dict[str, Any] = {}
+
+
+def read_model(model_dir: str) -> Any:
+    """
+    Loads the model in the given directory, or the compact model in the given file (see compact.export_compact_model).
+    :return: The loaded spaCy pipeline
+    """
+    from . import compact
+    if compact.is_compact_model(str(model_dir)):
+        return compact.load_compact_model(str(model_dir))
+    import spacy
+    return spacy.load(model_dir)
+
+
+def load_model(model_dir: str) -> Any:
+    """
+    Loads the model in the given directory, reusing the already loaded model if it was loaded before by this process.
+    :param model_dir: The directory of the model to load, or the file of a compact model
+    :return: The loaded spaCy pipeline
+    """
+    key = os.path.realpath(str(model_dir))
+    nlp = _loaded_models.get(key)
+    if nlp is None:
+        nlp = read_model(model_dir)
+        _loaded_models[key] = nlp
+    return nlp
+
+
+def unload_model(model_dir: str) -> None:
+    """
+    Removes the model in the given directory from the cache so that the next load reads it from disk again.
+    """
+    _loaded_models.pop(os.path.realpath(str(model_dir)), None)
+
+
+def get_entry_hash(text: str, label: str) -> str:
+    """
+    Hashes the text and label of a classified entry, so that a manifest notices entries that changed since training.
+    """
+    return hashlib.sha256(f'{label}\0{text}'.encode('utf-8')).hexdigest()[:16]
+
+
+def load_manifest(model_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Loads the manifest saved next to a model when it was trained.
+    :return: Dict of the labels, of the trained entries (each message ID to the hash of its text and label) and of the
+    message IDs held out for evaluation (eval_entries, missing in manifests of older models), None if the model dir
+    has no manifest
+    """
+    manifest_file = os.path.join(model_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, 'r') as fobj:
+        return json.loads(fobj.read())
+
+
+def write_manifest(model_dir: str, entries: Dict[str, str], labels: Iterable[str], eval_ids: Iterable[str] = ()):
+    """
+    Saves the manifest of the entries a model was trained on next to the model.
+    :param entries: Dict of each trained message ID to the hash of its text and label (see get_entry_hash)
+    :param eval_ids: The message IDs held out for evaluation, which later incremental runs are evaluated on
+    """
+    manifest_file = os.path.join(model_dir, MANIFEST_FILE_NAME)
+    with open(f'{manifest_file}.tmp', 'w') as fobj:
+        fobj.write(json.dumps(
+            {'labels': sorted(labels), 'entries': entries, 'eval_entries': sorted(set(eval_ids))}, sort_keys=True
+        ))
+    os.replace(f'{manifest_file}.tmp', manifest_file)
 
 
 def get_batches(train_data, model_type):
@@ -13,6 +107,7 @@ def get_batches(train_data, model_type):
     :param model_type:
     :return:
     """
+    from spacy.util import minibatch, compounding
     max_batch_sizes = {"tagger": 32, "parser": 16, "ner": 16, "textcat": 64}
     max_batch_size = max_batch_sizes[model_type]
     if len(train_data) < 1000:
@@ -24,67 +119,212 @@ def get_batches(train_data, model_type):
     return batches
 
 
-def _evaluate(tokenizer, textcat, data: List[Tuple[str, Dict[str, Dict[str, bool]]]]):
-    docs = (tokenizer(elem[0]) for elem in data)
-    tp = 0.0  # True positives
-    fp = 1e-8  # False positives
-    fn = 1e-8  # False negatives
-    tn = 0.0  # True negatives
-    for i, doc in enumerate(textcat.pipe(docs)):
-        gold = data[i][1]['cats']
-        # print(f'eval text: {data[i][0]}')
-        for label, score in doc.cats.items():
-            # print(f'\tscore for {label}: {score}')
-            if label not in gold:
-                continue
-            if score >= 0.5 and gold[label]:
-                tp += 1.0
-            elif score >= 0.5 and not gold[label]:
-                fp += 1.0
-            elif score < 0.5 and not gold[label]:
-                tn += 1
-            elif score < 0.5 and gold[label]:
-                fn += 1
-    precision = tp / (tp + fp)
-    recall = tp / (tp + fn)
-    if (precision + recall) == 0:
-        f_score = 0.0
-    else:
-        f_score = 2 * (precision * recall) / (precision + recall)
-    return {"textcat_p": precision, "textcat_r": recall, "textcat_f": f_score}
+def read_docs(nlp, doc_file: str) -> List[Any]:
+    """
+    Reads the docs saved with write_docs into the vocab of the pipeline.
+    """
+    from spacy.tokens import DocBin
+    with open(doc_file, 'rb') as fobj:
+        return list(DocBin().from_bytes(fobj.read()).get_docs(nlp.vocab))
 
 
-def test_textcat_model(model_dir: str, text: str, expected_cat: Optional[str] = None) -> bool:
+def write_docs(docs: Iterable[Any], doc_file: str):
     """
-    Tests the given test with the expected category/label (if present).
+    Saves the tokens of the docs to a DocBin file. The file is written next to its final path first and then moved
+    into place, so that a reader never sees a partly written file.
+    """
+    from spacy.tokens import DocBin
+    # Only the tokens are needed to restore the docs
+    doc_bin = DocBin(attrs=['ORTH'])
+    for doc in docs:
+        doc_bin.add(doc)
+    fd, tmp_file = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(doc_file) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as fobj:
+            fobj.write(doc_bin.to_bytes())
+        os.replace(tmp_file, doc_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def tokenize_texts(nlp, texts: Iterable[str], cache_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Tokenizes each distinct text once. If a cache dir is given, the docs are stored there in a DocBin file named by a
+    hash of the texts and the tokenizer, so that tokenizing is skipped entirely when training on the same data again.
+    :return: Dict of each text to its doc
+    """
+    import spacy
+    unique_texts = sorted(set(texts))
+    cache_file = None
+    if cache_dir:
+        digest = hashlib.sha256()
+        digest.update(f'{spacy.__version__}\0{nlp.lang}\0{nlp.meta.get("name")}\0{nlp.meta.get("version")}\0'.encode())
+        for text in unique_texts:
+            digest.update(text.encode('utf-8'))
+            digest.update(b'\0')
+        cache_file = os.path.join(cache_dir, f'{digest.hexdigest()}{DOC_CACHE_SUFFIX}')
+        if os.path.exists(cache_file):
+            docs = read_docs(nlp, cache_file)
+            if len(docs) == len(unique_texts):
+                print(f'Loaded {len(docs)} tokenized texts from {cache_file}')
+                return dict(zip(unique_texts, docs))
+
+    docs = list(nlp.tokenizer.pipe(unique_texts, batch_size=DEFAULT_TOKENIZE_BATCH_SIZE))
+    print(f'Tokenized {len(docs)} texts')
+    if cache_file:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        # Only the cache for the latest data is useful, so remove any others. Another run may be removing them too.
+        for name in os.listdir(cache_dir):
+            if name.endswith(DOC_CACHE_SUFFIX):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(cache_dir, name))
+        write_docs(docs, cache_file)
+        print(f'Saved tokenized texts to {cache_file}')
+    return dict(zip(unique_texts, docs))
+
+
+def check_early_stopping(f_scores: List[float], patience: Optional[int] = None) -> Tuple[int, bool]:
+    """
+    Finds the best epoch trained so far and whether training should stop.
+    :param f_scores: The evaluation F-score of each epoch trained so far
+    :param patience: If set, training stops once the F-score has not improved for this many epochs
+    :return: Tuple of the best epoch (counting from 1, the first of equal F-scores) and whether to stop training
+    """
+    best_epoch = max(range(len(f_scores)), key=lambda i: (f_scores[i], -i)) + 1
+    return best_epoch, bool(patience) and len(f_scores) - best_epoch >= patience
+
+
+def _evaluate(textcat, docs: List[Any], gold: 'numpy.ndarray') -> Dict[str, Any]:
+    """
+    Scores the docs and evaluates them against the gold matrix of docs x textcat labels.
+    """
+    from . import evaluation
+    labels = list(textcat.labels)
+    return evaluation.evaluate(evaluation.doc_scores(textcat.pipe(docs), labels), gold, labels)
+
+
+def _check_doc(doc, text: str, expected_cat: Optional[str] = None) -> bool:
+    """
+    Prints the result of a scored doc, comparing the best category to the expected category (if present).
     :return: True if the expected matched actual, false otherwise (always true when expected is unspecified)
     """
-    nlp = spacy.load(model_dir)
-    doc = nlp(text)
-    has_failures = False
     if expected_cat:
         best_score = max(doc.cats.keys(), key=lambda key: doc.cats[key])
         if best_score == expected_cat:
             print(f'PASS: {expected_cat} ({text})')
         else:
             print(f'FAIL: expected {expected_cat}, actual {best_score} ({text})')
-            has_failures = True
+            return False
     else:
         for cat, score in doc.cats.items():
             print('{0:.3f}\t{1}'.format(score, cat))
-    return not has_failures
+    return True
+
+
+def test_textcat_model(model_dir: str, text: str, expected_cat: Optional[str] = None,
+                       instrumentation: Optional[Instrumentation] = None) -> bool:
+    """
+    Tests the given test with the expected category/label (if present).
+    :param instrumentation: If set, the time spent loading the model and scoring is added to it
+    :return: True if the expected matched actual, false otherwise (always true when expected is unspecified)
+    """
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.span('load_model'):
+        nlp = load_model(model_dir)
+    with instrumentation.span('score'):
+        doc = nlp(text)
+    return _check_doc(doc, text, expected_cat)
+
+
+def test_textcat_model_batch(
+        model_dir: str, examples: Iterable[Tuple[str, str]], batch_size: int = DEFAULT_TEST_BATCH_SIZE,
+        n_process: int = 1, instrumentation: Optional[Instrumentation] = None
+) -> Tuple[int, int]:
+    """
+    Tests a stream of texts with their expected categories/labels, loading the model only once and scoring the texts
+    in batches.
+    :param examples: Iterable of (text, expected label) tuples, this is consumed lazily
+    :param batch_size: The number of texts to score at a time
+    :param n_process: The number of processes to use for scoring, 1 scores in the current process
+    :param instrumentation: If set, the stage times and the number of lines and words tested are added to it
+    :return: Tuple of the total number of texts tested and the number of failures
+    """
+    import numpy
+    from . import evaluation
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.span('load_model'):
+        nlp = load_model(model_dir)
+    labels = list(nlp.get_pipe('textcat').labels)
+    scores = []
+    expected_cats = []
+    failures = 0
+    words = 0
+    start_time = time.perf_counter()
+    # Reading the file is streamed along with scoring, so both are part of the same stage
+    with instrumentation.span('score'):
+        for doc, expected_cat in nlp.pipe(examples, as_tuples=True, batch_size=batch_size, n_process=n_process):
+            if not _check_doc(doc, doc.text, expected_cat):
+                failures += 1
+            scores.append([doc.cats.get(label, 0.0) for label in labels])
+            expected_cats.append(expected_cat)
+            words += len(doc)
+    elapsed = time.perf_counter() - start_time
+    total = len(expected_cats)
+    throughput = total / elapsed if elapsed > 0 else 0.0
+    instrumentation.count('lines', total)
+    instrumentation.count('words', words)
+    instrumentation.count('failures', failures)
+    with instrumentation.span('evaluate'):
+        evaluation.print_report(evaluation.evaluate(
+            numpy.array(scores, dtype=numpy.float32).reshape(-1, len(labels)),
+            evaluation.label_matrix(expected_cats, labels), labels
+        ))
+    print(f'Tested {total} line(s) with {failures} failure(s) in {elapsed:.2f}s ({throughput:.1f} lines/s, '
+          f'{words / elapsed if elapsed > 0 else 0.0:.1f} words/s)')
+    return total, failures
 
 
 def train_textcat_model(
         load_data_func: Callable[
             [], Tuple[List[Tuple[Any, Dict[str, Dict[str, bool]]]], List[Tuple[Any, Dict[str, Dict[str, bool]]]]]
         ],
-        n_iter: int = 20, max_texts: int = 2000, model: Optional[str] = None,
+        n_iter: int = DEFAULT_N_ITER, max_texts: int = 2000, model: Optional[str] = None,
         output_dir: str = '/tmp/model', labels: Optional[Iterable[str]] = None,
-        test_text: Optional[str] = None
-) -> None:
+        test_text: Optional[str] = None, doc_cache_dir: Optional[str] = None, doc_file: Optional[str] = None,
+        patience: Optional[int] = None,
+        architecture: str = DEFAULT_ARCHITECTURE, dropout: Tuple[float, float, float] = DEFAULT_DROPOUT,
+        batch_size: Tuple[float, float, float] = DEFAULT_BATCH_SIZE, seed: Optional[int] = None,
+        instrumentation: Optional[Instrumentation] = None
+) -> Dict[str, Any]:
+    """
+    Trains a text categorization model and saves the weights of the epoch with the best evaluation F-score to the
+    output dir.
+    :param load_data_func: Returns the training and evaluation examples, either lists of (text, {'cats': {label:
+    bool}}) tuples or LabeledExamples
+    :param n_iter: The maximum number of epochs to train
+    :param model: If set, the model to start from, the weights of its text classifier are trained further
+    :param patience: If set, stop training once the F-score has not improved for this many epochs
+    :param doc_cache_dir: If set, the tokenized texts are cached in this directory to skip tokenizing the same data
+    in later runs
+    :param doc_file: If set, a file of the already tokenized texts (see write_docs) used instead of tokenizing them, it
+    has to contain every training and evaluation text
+    :param architecture: The architecture of a new text classifier
+    :param dropout: The start, stop and decay of the dropout rate
+    :param batch_size: The start, stop and compounding rate of the batch size
+    :param seed: If set, the random seed used for training
+    :param instrumentation: If set, the time of each stage and the metrics of each epoch are added to it
+    :return: The evaluation scores of the best epoch
+    """
+    import spacy
+    from spacy.util import minibatch, compounding, decaying
+    from . import dataset, evaluation
+    instrumentation = instrumentation or Instrumentation()
+
     # Load data and verify there is some
-    train_data, eval_data = load_data_func()
+    with instrumentation.span('load_data'):
+        train_data, eval_data = load_data_func()
     if not train_data:
         raise Exception('There is no data provided to train')
     if not eval_data:
@@ -94,28 +334,41 @@ def train_textcat_model(
         raise Exception('No labels were provided to train')
     if not output_dir:
         raise Exception('Output dir must be specified')
+    if n_iter < 1:
+        raise Exception('At least one epoch must be trained')
 
-    if model:
-        nlp = spacy.load(model)
-        print(f'Loaded model "{model}"')
-    else:
-        nlp = spacy.blank("en")
-        print('Created blank "en" model')
+    if seed is not None:
+        spacy.util.fix_random_seed(seed)
+
+    with instrumentation.span('load_model'):
+        if model:
+            nlp = spacy.load(model)
+            print(f'Loaded model "{model}"')
+        else:
+            nlp = spacy.blank("en")
+            print('Created blank "en" model')
 
     # Add the text classifier to the pipeline if it doesn't exist
-    if 'textcat' not in nlp.pipe_names:
+    resume = model is not None and 'textcat' in nlp.pipe_names
+    if not resume:
         # nlp.create_pipe works for built-ins that are registered with spaCy
         textcat = nlp.create_pipe(
-            'textcat', config={'exclusive_classes': True, 'architecture': 'simple_cnn'}
+            'textcat', config={'exclusive_classes': True, 'architecture': architecture}
         )
         nlp.add_pipe(textcat, last=True)
     else:
         # Otherwise, get it, so we can add labels to it
         textcat = nlp.get_pipe('textcat')
 
-    # Add labels to text classifier
-    for label in labels:
-        textcat.add_label(label)
+    # Add labels to text classifier, spaCy can not add labels to the output layer of a trained classifier
+    if resume:
+        new_labels = set(labels).difference(textcat.labels)
+        if new_labels:
+            raise Exception(f'The model "{model}" does not know the labels {", ".join(sorted(new_labels))}, please '
+                            f'train a new model')
+    else:
+        for label in labels:
+            textcat.add_label(label)
 
     print(
         "Using max {} examples ({} training, {} evaluation)".format(
@@ -123,50 +376,112 @@ def train_textcat_model(
         )
     )
 
-    # We mainly have small data sets, so it's recommended to use a high dropout rate at first
-    # From https://spacy.io/usage/training#tips-dropout
-    dropout = decaying(0.6, 0.2, 1e-4)
+    # Tokenize all texts once up front, the same docs are then reused for every epoch
+    train_texts = dataset.get_texts(train_data)
+    eval_texts = dataset.get_texts(eval_data)
+    with instrumentation.span('tokenize'):
+        if doc_file:
+            docs = {doc.text: doc for doc in read_docs(nlp, doc_file)}
+        else:
+            docs = tokenize_texts(nlp, train_texts + eval_texts, cache_dir=doc_cache_dir)
+
+    # Each example only keeps the index of its label, the categories are shared by all examples with the same label
+    textcat_labels = list(textcat.labels)
+    label_index = {label: i for i, label in enumerate(textcat_labels)}
+    label_annotations = {
+        label_id: {'cats': {label: i == label_id for i, label in enumerate(textcat_labels)}}
+        for label_id in range(-1, len(textcat_labels))
+    }
+    train_data = [
+        (docs[text], label_index.get(label, -1))
+        for text, label in zip(train_texts, dataset.get_example_labels(train_data))
+    ]
+
+    train_words = sum(len(doc) for doc, _ in train_data)
+    instrumentation.count('train_examples', len(train_data))
+    instrumentation.count('eval_examples', len(eval_data))
+    dropout_rates = decaying(*dropout)
+
+    # The eval docs and their gold categories do not change between epochs
+    eval_docs = [docs[text] for text in eval_texts]
+    eval_gold = evaluation.label_matrix(dataset.get_example_labels(eval_data), textcat_labels)
 
     # Get names of other pipes to disable them during training
     other_pipes = [pipe for pipe in nlp.pipe_names if pipe != "textcat"]
+    f_scores = []
+    best_scores = None
+    best_epoch = 0
+    best_textcat = None
     with nlp.disable_pipes(*other_pipes):
-        optimizer = nlp.begin_training()
+        # Keep the weights of a trained classifier instead of initializing them again
+        optimizer = nlp.resume_training() if resume else nlp.begin_training()
         print('Training the model...')
-        print('{:^5}\t{:^5}\t{:^5}\t{:^5}'.format("LOSS", "P", "R", "F"))
-        batch_sizes = compounding(4.0, 32.0, 1.001)
+        print('{:^5}\t{:^5}\t{:^5}\t{:^5}\t{:^5}\t{:^5}\t{:^5}'.format("LOSS", "P", "R", "F", "ACC", "SEC", "WPS"))
+        batch_sizes = compounding(*batch_size)
         for i in range(n_iter):
             losses = {}
-            # batch up the examples using spaCy's minibatch
-            random.shuffle(train_data)
-            batches = minibatch(train_data, size=batch_sizes)
-            for batch in batches:
-                texts, annotations = zip(*batch)
-                nlp.update(texts, annotations, sgd=optimizer, drop=next(dropout), losses=losses)
-            with textcat.model.use_params(optimizer.averages):
+            update_start_time = time.perf_counter()
+            with instrumentation.span('update'):
+                # batch up the examples using spaCy's minibatch
+                random.shuffle(train_data)
+                batches = minibatch(train_data, size=batch_sizes)
+                for batch in batches:
+                    batch_docs, label_ids = zip(*batch)
+                    annotations = [label_annotations[label_id] for label_id in label_ids]
+                    nlp.update(batch_docs, annotations, sgd=optimizer, drop=next(dropout_rates), losses=losses)
+            update_seconds = time.perf_counter() - update_start_time
+            evaluate_start_time = time.perf_counter()
+            with instrumentation.span('evaluate'), textcat.model.use_params(optimizer.averages):
                 # evaluate on the dev data split off in load_data()
-                scores = _evaluate(nlp.tokenizer, textcat, eval_data)
+                scores = _evaluate(textcat, eval_docs, eval_gold)
+                f_scores.append(scores['textcat_f'])
+                best_epoch, stop = check_early_stopping(f_scores, patience)
+                # Keep the averaged weights of the best epoch in memory to save them at the end, the vocab is not
+                # changed by training the text classifier
+                if best_epoch == i + 1:
+                    best_scores = scores
+                    best_textcat = textcat.to_bytes(exclude=['vocab'])
+            epoch_metrics = instrumentation.add_epoch(
+                i + 1, update_seconds, len(train_data), train_words, loss=losses['textcat'],
+                evaluate_seconds=time.perf_counter() - evaluate_start_time,
+                **{key: scores[key] for key in ('textcat_p', 'textcat_r', 'textcat_f', 'textcat_accuracy')},
+            )
             # Print a simple table
             print(
-                "{0:.3f}\t{1:.3f}\t{2:.3f}\t{3:.3f}".format(
+                "{0:.3f}\t{1:.3f}\t{2:.3f}\t{3:.3f}\t{4:.3f}\t{5:.1f}\t{6:.0f}".format(
                     losses["textcat"],
                     scores["textcat_p"],
                     scores["textcat_r"],
                     scores["textcat_f"],
+                    scores["textcat_accuracy"],
+                    update_seconds,
+                    epoch_metrics["words_per_second"],
                 )
             )
+            if stop:
+                print(f'Stopping early after epoch {i + 1}, the F-score has not improved for {patience} epochs')
+                break
+
+    print(f'Evaluation of the best epoch ({best_epoch}):')
+    evaluation.print_report(best_scores)
+    # The best weights are already averaged
+    textcat.from_bytes(best_textcat, exclude=['vocab'])
 
     # Create the output dir (if it doesn't exist
     output_dir = Path(output_dir)
     if not output_dir.exists():
         output_dir.mkdir()
 
-    # Use the averages when writing out the model
+    # The best weights were taken with the averaged params
     # From https://spacy.io/usage/training#tips-param-avg
-    with nlp.use_params(optimizer.averages):
+    with instrumentation.span('save'):
         nlp.to_disk(output_dir)
+    unload_model(output_dir)
     print(f'Saved model to {output_dir}')
 
     # test the saved model
     if test_text:
         print(f'Loading saved model from {output_dir}')
-        test_textcat_model(output_dir, test_text)
+        test_textcat_model(output_dir, test_text, instrumentation=instrumentation)
+
+    return best_scores